@@ -0,0 +1,53 @@
+"""
+PTMLib - Pendragon Tools for Machine Learning
+
+Submodules and their public names are imported on first access, so ``import ptmlib`` does not pull in
+TensorFlow, matplotlib or pandas; ex: ``ptmlib.Stopwatch`` only imports ``ptmlib.time``.
+"""
+
+import importlib
+from typing import Any, List
+
+_submodules = ('benchmarks', 'cache', 'callbacks', 'charts', 'cpu', 'data', 'evaluation', 'events', 'fingerprint',
+               'history', 'locks', 'model_tools', 'monitor', 'preprocessing', 'storage', 'sweep', 'time', 'tuning')
+
+# public name -> submodule that defines it
+_public_names = {
+    'AlertSounds': 'time',
+    'ArrayBatches': 'data',
+    'CpuCount': 'cpu',
+    'FitResult': 'model_tools',
+    'ModelCache': 'cache',
+    'ResourceMonitor': 'monitor',
+    'Stopwatch': 'time',
+    'StopwatchResult': 'time',
+    'ThreadBudget': 'cpu',
+    'TimingRegistry': 'time',
+    'load_or_compute_arrays': 'preprocessing',
+    'load_or_evaluate': 'evaluation',
+    'load_or_fit': 'model_tools',
+    'load_or_fit_model': 'model_tools',
+    'load_or_fit_transform': 'preprocessing',
+    'load_or_predict': 'evaluation',
+    'run_sweep': 'sweep',
+    'show_history_chart': 'charts',
+    'show_history_comparison': 'charts',
+    'tune_n_jobs': 'tuning',
+    'wait_for_artifacts': 'model_tools',
+}
+
+__all__ = sorted(set(_submodules) | set(_public_names))
+
+
+def __getattr__(name: str) -> Any:
+    if name in _submodules:
+        return importlib.import_module(f'{__name__}.{name}')
+    if name in _public_names:
+        value = getattr(importlib.import_module(f'{__name__}.{_public_names[name]}'), name)
+        globals()[name] = value  # later lookups skip __getattr__
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,439 @@
+import argparse
+import contextlib
+import importlib.util
+import io
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Tuple
+
+import ptmlib.storage as pst
+from ptmlib.cpu import CpuCount
+
+BENCHMARK_FORMAT_VERSION = 1
+DEFAULT_THRESHOLD = 0.2
+
+# modules timed by the import benchmark, in a fresh interpreter each time
+IMPORT_MODULES = ('ptmlib', 'ptmlib.time', 'ptmlib.cpu', 'ptmlib.model_tools', 'ptmlib.charts', 'ptmlib.sweep')
+
+# benchmark name -> (modules required to run it, setup function returning {case name: (function, number)});
+# a case may add a dict of extra result fields, ex: (function, number, {'bytes': file_size})
+_benchmarks: Dict[str, Tuple[Tuple[str, ...], Callable[[str], Dict[str, Tuple[Callable, int]]]]] = {}
+
+
+def _benchmark(name: str, requires: Tuple[str, ...] = ()) -> Callable:
+    def decorator(setup_function: Callable) -> Callable:
+        _benchmarks[name] = (requires, setup_function)
+        return setup_function
+
+    return decorator
+
+
+@_benchmark('stopwatch')
+def _stopwatch_cases(work_dir: str) -> Dict[str, Tuple[Callable, int]]:
+    from ptmlib.time import Stopwatch, TimingRegistry
+
+    stopwatch = Stopwatch(registry=TimingRegistry())
+    lap_stopwatch = Stopwatch(registry=TimingRegistry())
+    lap_stopwatch.start()
+    disabled_stopwatch = Stopwatch(registry=TimingRegistry(enabled=False))
+
+    def start_stop():
+        stopwatch.start()
+        stopwatch.stop(silent=True)
+
+    def section():
+        with stopwatch.section('section'):
+            pass
+
+    def disabled_section():
+        with disabled_stopwatch.section('section'):
+            pass
+
+    return {
+        'stopwatch.start_stop': (start_stop, 1000),
+        'stopwatch.lap': (lap_stopwatch.lap, 10000),
+        'stopwatch.section': (section, 10000),
+        'stopwatch.section_disabled': (disabled_section, 10000),
+    }
+
+
+@_benchmark('history', requires=('numpy',))
+def _history_cases(work_dir: str) -> Dict[str, Tuple[Callable, int]]:
+    import numpy as np
+
+    import ptmlib.history as phist
+    import ptmlib.model_tools as modt
+
+    cases = {}
+    for epochs in (10, 1000, 100000):
+        model_file_name = os.path.join(work_dir, f'history_{epochs}')
+        values = np.random.default_rng(epochs).random(epochs).tolist()
+        history = _get_history({metric: values for metric in ('loss', 'accuracy', 'val_loss', 'val_accuracy')},
+                               epochs)
+        modt.save_history_data(history, model_file_name)
+
+        def load(model_file_name=model_file_name):
+            history_data, _ = phist.read_history_data(model_file_name)
+            for metric in history_data:
+                history_data[metric]
+
+        cases[f'history.save[epochs={epochs}]'] = (lambda h=history, f=model_file_name: modt.save_history_data(h, f),
+                                                   10)
+        cases[f'history.load[epochs={epochs}]'] = (load, 10)
+
+    steps = np.random.default_rng(0).random(1000000).cumsum()
+    cases['history.smooth_downsample[points=1000000]'] = (
+        lambda: phist.downsample_lttb(phist.smooth_values(steps, 50), 1000), 5)
+
+    return cases
+
+
+@_benchmark('charts', requires=('matplotlib', 'numpy'))
+def _charts_cases(work_dir: str) -> Dict[str, Tuple[Callable, int]]:
+    import ptmlib.charts as pch
+
+    history_data = {metric: [1.0 / (epoch + 1) for epoch in range(50)]
+                    for metric in ('loss', 'accuracy', 'val_loss', 'val_accuracy')}
+
+    return {
+        'charts.save_history_chart[metric]': (
+            lambda: pch.save_history_charts(history_data, ['accuracy'], 'benchmark', work_dir), 5),
+        'charts.save_history_chart[grid]': (
+            lambda: pch.save_history_charts(history_data, ['accuracy', 'loss'], 'benchmark', work_dir,
+                                            layout='grid'), 5),
+    }
+
+
+@_benchmark('storage', requires=('numpy',))
+def _storage_cases(work_dir: str) -> Dict[str, Tuple[Callable, ...]]:
+    import numpy as np
+
+    # weights of a small CNN classifier, about 3.3 million float32 parameters
+    rng = np.random.default_rng(0)
+    weights = [(rng.standard_normal(shape) * 0.05).astype(np.float32)
+               for shape in ((3, 3, 1, 64), (64,), (3, 3, 64, 64), (64,), (5 * 5 * 64 * 2, 1024), (1024,),
+                             (1024, 10), (10,))]
+
+    cases = {}
+    for dtype, compress in ((None, False), (None, True), ('float16', True), ('bfloat16', True)):
+        label = f'{dtype or "float32"}{"+zlib" if compress else ""}'
+        file_path = os.path.join(work_dir, f'weights-{label}.npz')
+        pst.write_weights_atomic(weights, file_path, dtype, compress)
+        extra = {'bytes': os.path.getsize(file_path)}
+        cases[f'storage.save[{label}]'] = (
+            lambda d=dtype, c=compress, f=file_path: pst.write_weights_atomic(weights, f, d, c), 3, extra)
+        cases[f'storage.load[{label}]'] = (lambda f=file_path: pst.read_weights(f), 3, extra)
+
+    return cases
+
+
+@_benchmark('evaluation', requires=('numpy',))
+def _evaluation_cases(work_dir: str) -> Dict[str, Tuple[Callable, int]]:
+    import numpy as np
+
+    import ptmlib.evaluation as peval
+
+    class DenseModel:
+
+        def __init__(self, weights):
+            self.weights = weights
+
+        def get_weights(self):
+            return [self.weights]
+
+        def predict(self, x):
+            return np.tanh(x @ self.weights)
+
+    rng = np.random.default_rng(0)
+    model = DenseModel(rng.standard_normal((256, 64)).astype(np.float32))
+    x = rng.standard_normal((100000, 256)).astype(np.float32)
+    miss_dirs = iter(range(1000000))
+
+    def predict_miss():
+        peval.load_or_predict(model, x, os.path.join(work_dir, f'miss-{next(miss_dirs)}'))
+
+    peval.load_or_predict(model, x, work_dir)
+    peval.load_or_predict(model, x, work_dir, model_fingerprint='model', data_fingerprint='x')
+
+    # hits with fingerprints passed in skip hashing the model and inputs
+    return {
+        'evaluation.predict_miss[rows=100000]': (predict_miss, 1),
+        'evaluation.predict_hit[rows=100000]': (lambda: peval.load_or_predict(model, x, work_dir), 1),
+        'evaluation.predict_hit_keyed[rows=100000]': (
+            lambda: peval.load_or_predict(model, x, work_dir, model_fingerprint='model', data_fingerprint='x'), 10),
+    }
+
+
+@_benchmark('storage_keras', requires=('tensorflow', 'numpy'))
+def _storage_keras_cases(work_dir: str) -> Dict[str, Tuple[Callable, ...]]:
+    from tensorflow import keras
+
+    import ptmlib.cache as pca
+    import ptmlib.model_tools as modt
+
+    def get_model():
+        model = keras.models.Sequential([keras.layers.Dense(1024, activation='relu', input_shape=(784,)),
+                                         keras.layers.Dense(512, activation='relu'),
+                                         keras.layers.Dense(10, activation='softmax')])
+        model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+        return model
+
+    model = get_model()
+    load_model = get_model()
+    cases = {}
+    for model_file_format in ('', 'tf_saved_model', *modt.WEIGHTS_FILE_FORMATS):
+        model_file_name = os.path.join(work_dir, f'model-{model_file_format or "h5"}')
+        model_file_path = modt.get_file_path(model_file_name, model_file_format)
+        try:
+            modt.save_model_file(model, model_file_path, model_file_format)
+        except (ValueError, NotImplementedError):
+            continue  # ex: SavedModel directories are not supported by model.save() in Keras 3
+        extra = {'bytes': pca.get_size_bytes(model_file_path)}
+        label = model_file_format or 'h5'
+        cases[f'storage.save[{label}]'] = (
+            lambda f=model_file_format, p=model_file_path: modt.save_model_file(model, p, f), 3, extra)
+        cases[f'storage.load[{label}]'] = (
+            lambda f=model_file_format, n=model_file_name: modt.load_model_file(load_model, n, f), 3, extra)
+
+    return cases
+
+
+@_benchmark('imports')
+def _import_cases(work_dir: str) -> Dict[str, Tuple[Callable, int]]:
+    return {f'import.{module}': (lambda m=module: _time_import(m), 1) for module in IMPORT_MODULES}
+
+
+@_benchmark('sklearn', requires=('sklearn', 'numpy'))
+def _sklearn_cases(work_dir: str) -> Dict[str, Tuple[Callable, int]]:
+    import numpy as np
+    from sklearn.linear_model import LogisticRegression
+
+    import ptmlib.model_tools as modt
+
+    rng = np.random.default_rng(0)
+    x = rng.random((500, 20))
+    y = (x[:, 0] > 0.5).astype(np.int64)
+
+    return _load_or_fit_cases('load_or_fit.sklearn', work_dir, lambda file_name: modt.load_or_fit(
+        LogisticRegression(), file_name, x, y))
+
+
+@_benchmark('keras', requires=('tensorflow', 'numpy'))
+def _keras_cases(work_dir: str) -> Dict[str, Tuple[Callable, int]]:
+    import numpy as np
+    from tensorflow import keras
+
+    import ptmlib.cache as pca
+    import ptmlib.model_tools as modt
+
+    rng = np.random.default_rng(0)
+    x = rng.random((500, 20)).astype(np.float32)
+    y = (x[:, 0] > 0.5).astype(np.int64)
+
+    def get_model():
+        model = keras.models.Sequential([keras.layers.Dense(8, activation='relu', input_shape=(20,)),
+                                         keras.layers.Dense(2, activation='softmax')])
+        model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+        return model
+
+    return _load_or_fit_cases('load_or_fit_model.keras', work_dir, lambda file_name: modt.load_or_fit_model(
+        get_model(), file_name, x, y, epochs=2, images_enabled=False, alert=False,
+        fit_model_function=lambda model, x, y, validation_data, epochs: model.fit(x, y, epochs=epochs, verbose=0)))
+
+
+def _load_or_fit_cases(name: str, work_dir: str, load_or_fit_function: Callable[[str], Any]) \
+        -> Dict[str, Tuple[Callable, int]]:
+    hit_file_name = os.path.join(work_dir, f'{name}-hit')
+    load_or_fit_function(hit_file_name)
+    fit_count = [0]
+
+    def fit():
+        # a new file name each time, so every call fits and saves
+        fit_count[0] += 1
+        load_or_fit_function(os.path.join(work_dir, f'{name}-fit-{fit_count[0]}'))
+
+    return {f'{name}.fit': (fit, 1), f'{name}.hit': (lambda: load_or_fit_function(hit_file_name), 1)}
+
+
+def _get_history(history_data: Dict[str, List[float]], epochs: int) -> Any:
+    return SimpleNamespace(history=history_data, params={'epochs': epochs, 'steps': 1, 'verbose': 0})
+
+
+def _time_import(module: str) -> float:
+    # run in a fresh interpreter, since modules are only imported once per process
+    code = (f'import time; start = time.perf_counter(); import {module}; '
+            f'print(time.perf_counter() - start)')
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def run_benchmarks(names: List[str] = None, repeat: int = 5, keyword: str = None) -> Dict[str, Any]:
+
+    """
+    Runs benchmarks and returns their results; benchmarks with missing dependencies are skipped
+
+    :param names: benchmark names, ex: ['stopwatch', 'history']; default is all
+    :param repeat: number of timed runs per case; the median is reported as seconds
+    :param keyword: if set, only cases whose name contains keyword are run
+    :return: JSON-compatible dict with environment info, results and skipped benchmarks
+    """
+
+    results = {}
+    skipped = {}
+    for name in (names or sorted(_benchmarks)):
+        if name not in _benchmarks:
+            raise ValueError(f'Unknown benchmark: {name}; expected one of {sorted(_benchmarks)}')
+
+        requires, setup_function = _benchmarks[name]
+        missing = [module for module in requires if importlib.util.find_spec(module) is None]
+        if missing:
+            skipped[name] = f'requires {", ".join(missing)}'
+            continue
+
+        with tempfile.TemporaryDirectory() as work_dir, contextlib.redirect_stdout(io.StringIO()):
+            cases = setup_function(work_dir)
+            for case_name, (function, number, *extra) in cases.items():
+                if keyword is None or keyword in case_name:
+                    result = _time_case(case_name, function, number, repeat)
+                    results[case_name] = {**result, **extra[0]} if extra else result
+
+    return {
+        'format_version': BENCHMARK_FORMAT_VERSION,
+        'created': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': CpuCount().total_count(),
+        'results': results,
+        'skipped': skipped,
+    }
+
+
+def _time_case(case_name: str, function: Callable, number: int, repeat: int) -> Dict[str, Any]:
+    timings = []
+    for _ in range(repeat):
+        if case_name.startswith('import.'):
+            # measured inside the child interpreter
+            timings.append(function())
+            continue
+
+        start_time = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - start_time) / number)
+
+    return {
+        'seconds': statistics.median(timings),
+        'min_seconds': min(timings),
+        'max_seconds': max(timings),
+        'repeat': repeat,
+        'number': number,
+    }
+
+
+def compare_results(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float = DEFAULT_THRESHOLD) \
+        -> List[Dict[str, Any]]:
+
+    """
+    Compares benchmark results with a baseline; cases missing from either are ignored
+
+    :param results: results returned by run_benchmarks()
+    :param baseline: earlier results returned by run_benchmarks(), ex: loaded from a JSON file
+    :param threshold: fractional slowdown reported as a regression; default is 0.2 (20% slower)
+    :return: list of regressions: case name, baseline seconds, seconds and change, slowest change first
+    """
+
+    regressions = []
+    for case_name, result in results['results'].items():
+        baseline_result = baseline['results'].get(case_name)
+        if baseline_result is None or baseline_result['seconds'] <= 0:
+            continue
+
+        change = result['seconds'] / baseline_result['seconds'] - 1
+        if change > threshold:
+            regressions.append({'name': case_name, 'baseline_seconds': baseline_result['seconds'],
+                                'seconds': result['seconds'], 'change': change})
+
+    return sorted(regressions, key=lambda regression: -regression['change'])
+
+
+def print_results(results: Dict[str, Any], baseline: Dict[str, Any] = None) -> None:
+
+    """
+    Prints a table of benchmark results, with the change from baseline if provided
+
+    :param results: results returned by run_benchmarks()
+    :param baseline: earlier results returned by run_benchmarks()
+    :return: None
+    """
+
+    print(f"{'Benchmark':<45}{'Median':>12}{'Min':>12}{'Change':>10}{'Size':>12}")
+    for case_name, result in results['results'].items():
+        change = ''
+        baseline_result = (baseline or {}).get('results', {}).get(case_name)
+        if baseline_result is not None and baseline_result['seconds'] > 0:
+            change = f"{(result['seconds'] / baseline_result['seconds'] - 1) * 100:+0.1f}%"
+        size = f"{result['bytes'] / 2 ** 20:0.2f} MB" if 'bytes' in result else ''
+        print(f"{case_name:<45}{_format_seconds(result['seconds']):>12}{_format_seconds(result['min_seconds']):>12}"
+              f"{change:>10}{size:>12}")
+    for name, reason in results['skipped'].items():
+        print(f'{name:<45}skipped: {reason}')
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f'{seconds * 1e6:0.1f} us'
+    if seconds < 1:
+        return f'{seconds * 1e3:0.2f} ms'
+    return f'{seconds:0.3f} s'
+
+
+def main(argv: List[str] = None) -> int:
+
+    """
+    Command line interface: python -m ptmlib.benchmarks [--output FILE] [--baseline FILE] [--threshold 0.2]
+
+    :param argv: command line arguments; default is sys.argv[1:]
+    :return: exit code; 1 if any case regressed beyond the threshold
+    """
+
+    parser = argparse.ArgumentParser(prog='python -m ptmlib.benchmarks', description='Benchmark ptmlib overhead')
+    parser.add_argument('benchmarks', nargs='*', help=f'benchmarks to run; default is all: {sorted(_benchmarks)}')
+    parser.add_argument('-k', '--keyword', default=None, help='only run cases whose name contains keyword')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='timed runs per case; default is 5')
+    parser.add_argument('-o', '--output', default=None, help='write results to a JSON file')
+    parser.add_argument('-b', '--baseline', default=None, help='compare with results from an earlier run')
+    parser.add_argument('-t', '--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='fractional slowdown reported as a regression; default is 0.2')
+    args = parser.parse_args(argv)
+
+    # CPU only, so results are comparable between machines with and without a GPU
+    os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+    results = run_benchmarks(args.benchmarks or None, args.repeat, args.keyword)
+    baseline = pst.read_json(args.baseline) if args.baseline else None
+    print_results(results, baseline)
+
+    if args.output:
+        pst.write_json_atomic(results, args.output)
+        print(f'Saved results: {args.output}')
+
+    if baseline is None:
+        return 0
+
+    regressions = compare_results(results, baseline, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression['name']}: {_format_seconds(regression['baseline_seconds'])} -> "
+              f"{_format_seconds(regression['seconds'])} ({regression['change'] * 100:+0.1f}%)")
+    print(f'Regressions: {len(regressions)} (threshold {args.threshold * 100:0.0f}%)')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,485 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import ptmlib.events as pev
+import ptmlib.storage as pst
+from ptmlib.locks import FileLock, is_in_progress
+
+INDEX_FILE_NAME = 'index.json'
+INDEX_LOCK_FILE_NAME = 'index.lock'
+MANIFEST_FILE_NAME = 'manifest.json'
+
+EVICTION_POLICIES = ('lru', 'cost')
+
+# seconds within which further hits of an entry are not written to the index
+DEFAULT_HIT_INTERVAL = 60.0
+
+# time of the last hit recorded by this process, by (cache directory, entry name)
+_recorded_hits: Dict[Tuple[str, str], float] = {}
+_recorded_hits_lock = threading.Lock()
+
+
+class ModelCache:
+
+    """
+    The ModelCache class manages a cache directory used by load_or_fit_model(cache_dir=...).
+    An index records the size, creation time, last hit time and fit duration of each entry, and the
+    oldest entries are evicted on insert when the cache exceeds max_bytes or max_entries.
+    The index is protected by a file lock, so several processes can share a cache directory.
+    Entries without a manifest, or with a held SingleFlightLock, are still being written and are never evicted.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = None, max_entries: int = None, policy: str = 'lru',
+                 hit_interval: float = DEFAULT_HIT_INTERVAL):
+
+        """
+        :param cache_dir: cache directory; created if it does not exist
+        :param max_bytes: maximum total size of all entries; default is no limit
+        :param max_entries: maximum number of entries; default is no limit
+        :param policy: 'lru' evicts the least recently used entries first; 'cost' also weighs fit time,
+                       so entries that were slow to fit are kept longer
+        :param hit_interval: seconds after a recorded hit during which further hits of the entry are not written
+                             to the index, so repeated loads do not lock and rewrite it; 0 records every hit
+        """
+
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f'policy must be one of {EVICTION_POLICIES}, not {policy!r}')
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.policy = policy
+        self.hit_interval = hit_interval
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def lock(self) -> FileLock:
+
+        """
+        Returns a FileLock for the cache index; hold it while reading and writing the index
+
+        :return: FileLock
+        """
+
+        return FileLock(os.path.join(self.cache_dir, INDEX_LOCK_FILE_NAME))
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+
+        """
+        Returns the index: entry name to size_bytes, created, last_hit, hits and fit_seconds
+
+        :return: dict
+        """
+
+        with self.lock():
+            return self._read_index()
+
+    def manifests(self) -> Dict[str, Dict[str, Any]]:
+
+        """
+        Returns the manifest of each complete entry; entries still being written have no manifest and are skipped
+
+        :return: dict of entry name to manifest
+        """
+
+        manifests = {}
+        for entry_name in self._list_entry_dirs():
+            manifest_path = os.path.join(self.cache_dir, entry_name, MANIFEST_FILE_NAME)
+            try:
+                manifests[entry_name] = pst.read_json(manifest_path)
+            except (OSError, ValueError):
+                continue  # incomplete, or evicted by another process
+
+        return manifests
+
+    def record_insert(self, entry_name: str, fit_seconds: float = None) -> List[str]:
+
+        """
+        Adds a completed entry to the index, then evicts entries until the cache is within its limits;
+        the new entry is never evicted by its own insert
+
+        :param entry_name: name of the entry directory within cache_dir
+        :param fit_seconds: seconds spent fitting the model
+        :return: list of evicted entry names
+        """
+
+        now = time.time()
+        with self.lock():
+            index = self._read_index()
+            index[entry_name] = {
+                'size_bytes': get_size_bytes(os.path.join(self.cache_dir, entry_name)),
+                'created': now,
+                'last_hit': now,
+                'hits': 0,
+                'fit_seconds': fit_seconds,
+            }
+            evicted = self._enforce_limits(index, protected=entry_name)
+            self._write_index(index)
+        with _recorded_hits_lock:
+            _recorded_hits.pop((os.path.abspath(self.cache_dir), entry_name), None)
+
+        return evicted
+
+    def record_hit(self, entry_name: str) -> None:
+
+        """
+        Updates the last hit time of an entry; entries created before the index existed are added.
+        Hits within hit_interval of the last recorded hit are skipped, so hits is a lower bound.
+
+        :param entry_name: name of the entry directory within cache_dir
+        :return: None
+        """
+
+        hit_key = (os.path.abspath(self.cache_dir), entry_name)
+        now = time.time()
+        with _recorded_hits_lock:
+            if now - _recorded_hits.get(hit_key, float('-inf')) < self.hit_interval:
+                return
+
+        # the index is replaced atomically, so a recent hit recorded by another process can be seen without the lock
+        entry = self._read_index().get(entry_name) if self.hit_interval > 0 else None
+        if entry is not None and entry.get('hits', 0) > 0 and now - entry.get('last_hit', 0) < self.hit_interval:
+            with _recorded_hits_lock:
+                _recorded_hits[hit_key] = entry['last_hit']
+            return
+
+        with self.lock():
+            index = self._read_index()
+            if entry_name not in index:
+                index[entry_name] = self._get_unindexed_entry(entry_name)
+            index[entry_name]['last_hit'] = now
+            index[entry_name]['hits'] = index[entry_name].get('hits', 0) + 1
+            self._write_index(index)
+
+        with _recorded_hits_lock:
+            _recorded_hits[hit_key] = now
+
+    def prune(self, max_bytes: int = None, max_entries: int = None) -> List[str]:
+
+        """
+        Synchronizes the index with the cache directory, then evicts entries until the cache is within
+        the given limits (or the cache limits, if not specified)
+
+        :param max_bytes: maximum total size of all entries
+        :param max_entries: maximum number of entries
+        :return: list of evicted entry names
+        """
+
+        with self.lock():
+            index = self._sync_index(self._read_index())
+            evicted = self._enforce_limits(index, max_bytes=max_bytes, max_entries=max_entries)
+            self._write_index(index)
+
+        return evicted
+
+    def evict(self, entry_name: str) -> None:
+
+        """
+        Removes an entry from the cache directory and the index
+
+        :param entry_name: name of the entry directory within cache_dir
+        :return: None
+        """
+
+        with self.lock():
+            index = self._read_index()
+            self._remove_entry(index, entry_name)
+            self._write_index(index)
+
+    def verify(self) -> Dict[str, List[str]]:
+
+        """
+        Checks that every entry has a manifest and all the files listed in it
+
+        :return: dict of entry name to list of problems, for entries with problems only
+        """
+
+        problems = {}
+        with self.lock():
+            index = self._read_index()
+
+        for entry_name in sorted(set(index) | set(self._list_entry_dirs())):
+            entry_dir = os.path.join(self.cache_dir, entry_name)
+            entry_problems = []
+            if not os.path.isdir(entry_dir):
+                entry_problems.append('entry directory is missing')
+            elif not os.path.exists(os.path.join(entry_dir, MANIFEST_FILE_NAME)):
+                entry_problems.append('manifest is missing; entry is incomplete')
+            else:
+                manifest = pst.read_json(os.path.join(entry_dir, MANIFEST_FILE_NAME))
+                for file_name in manifest.get('files', []):
+                    if not os.path.exists(os.path.join(entry_dir, file_name)):
+                        entry_problems.append(f'file is missing: {file_name}')
+            if entry_name not in index:
+                entry_problems.append('entry is not in the index')
+            if entry_problems:
+                problems[entry_name] = entry_problems
+
+        return problems
+
+    def _enforce_limits(self, index: Dict[str, Dict], protected: str = None, max_bytes: int = None,
+                        max_entries: int = None) -> List[str]:
+        max_bytes = max_bytes if max_bytes is not None else self.max_bytes
+        max_entries = max_entries if max_entries is not None else self.max_entries
+        evicted = []
+
+        for entry_name in self._get_eviction_order(index):
+            total_bytes = sum(entry.get('size_bytes', 0) for entry in index.values())
+            over_bytes = max_bytes is not None and total_bytes > max_bytes
+            over_entries = max_entries is not None and len(index) > max_entries
+            if not (over_bytes or over_entries):
+                break
+            if entry_name == protected or is_in_progress(os.path.join(self.cache_dir, entry_name)):
+                continue
+            self._remove_entry(index, entry_name)
+            evicted.append(entry_name)
+
+        return evicted
+
+    def _get_eviction_order(self, index: Dict[str, Dict]) -> List[str]:
+        if self.policy == 'cost':
+            # idle time divided by fit time: old entries that were quick to fit go first
+            now = time.time()
+            return sorted(index, key=lambda name: -(now - index[name].get('last_hit', 0))
+                          / (1.0 + (index[name].get('fit_seconds') or 0.0)))
+
+        return sorted(index, key=lambda name: index[name].get('last_hit', 0))
+
+    def _remove_entry(self, index: Dict[str, Dict], entry_name: str) -> None:
+        entry_dir = os.path.join(self.cache_dir, entry_name)
+        pev.emit('cache.evict', f'Evicting cache entry: {entry_dir}', entry_dir=entry_dir)
+        pst.remove_path(entry_dir)
+        index.pop(entry_name, None)
+
+    def _sync_index(self, index: Dict[str, Dict]) -> Dict[str, Dict]:
+        entry_names = set(self._list_entry_dirs())
+        for entry_name in list(index):
+            if entry_name not in entry_names:
+                del index[entry_name]
+        for entry_name in entry_names - set(index):
+            # entries are indexed once complete; the manifest is written last
+            if os.path.exists(os.path.join(self.cache_dir, entry_name, MANIFEST_FILE_NAME)):
+                index[entry_name] = self._get_unindexed_entry(entry_name)
+
+        return index
+
+    def _get_unindexed_entry(self, entry_name: str) -> Dict[str, Any]:
+        entry_dir = os.path.join(self.cache_dir, entry_name)
+        manifest_path = os.path.join(entry_dir, MANIFEST_FILE_NAME)
+        manifest = pst.read_json(manifest_path) if os.path.exists(manifest_path) else {}
+        created = manifest.get('created', os.path.getmtime(entry_dir) if os.path.exists(entry_dir) else time.time())
+
+        return {
+            'size_bytes': get_size_bytes(entry_dir),
+            'created': created,
+            'last_hit': created,
+            'hits': 0,
+            'fit_seconds': manifest.get('fit_seconds'),
+        }
+
+    def _list_entry_dirs(self) -> List[str]:
+        return [name for name in os.listdir(self.cache_dir)
+                if os.path.isdir(os.path.join(self.cache_dir, name)) and not name.startswith('.')]
+
+    def _read_index(self) -> Dict[str, Dict]:
+        index_path = os.path.join(self.cache_dir, INDEX_FILE_NAME)
+        if not os.path.exists(index_path):
+            return {}
+
+        return pst.read_json(index_path)['entries']
+
+    def _write_index(self, index: Dict[str, Dict]) -> None:
+        pst.write_json_atomic({'entries': index}, os.path.join(self.cache_dir, INDEX_FILE_NAME))
+
+
+class ModelMemo:
+
+    """
+    The ModelMemo class keeps recently loaded models in memory, so repeated cache hits return the
+    already-deserialized model instead of reading it from disk again. Entries are keyed by file path and
+    validated against the file's inode, modification time and size, so a model file replaced on disk is
+    reloaded. The least recently used entries are dropped when max_models is exceeded.
+    """
+
+    def __init__(self, max_models: int = 8):
+
+        """
+        :param max_models: maximum number of models kept in memory; 0 disables memoization
+        """
+
+        self.max_models = max_models
+        self._entries: 'OrderedDict[str, Tuple[Tuple, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_path: str) -> Optional[Any]:
+
+        """
+        Returns the value stored for file_path, or None if there is none or the file has changed
+
+        :param file_path: model file or directory path
+        :return: stored value or None
+        """
+
+        key = os.path.abspath(file_path)
+        signature = get_file_signature(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != signature:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, file_path: str, value: Any) -> None:
+
+        """
+        Stores value for file_path, keyed by the current state of the file
+
+        :param file_path: model file or directory path
+        :param value: value to store, ex: (model, history)
+        :return: None
+        """
+
+        if self.max_models <= 0:
+            return
+
+        key = os.path.abspath(file_path)
+        signature = get_file_signature(key)
+        if signature is None:
+            return
+
+        with self._lock:
+            self._entries[key] = (signature, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_models:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, file_path: str = None) -> None:
+
+        """
+        Drops the value stored for file_path, or all values
+
+        :param file_path: model file or directory path; default is all
+        :return: None
+        """
+
+        with self._lock:
+            if file_path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(file_path), None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def get_file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+
+    """
+    Returns (inode, modification time, size) for a file or directory, or None if it does not exist;
+    files saved with write-then-rename always get a new inode
+
+    :param path: file or directory path
+    :return: tuple or None
+    """
+
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+
+    return stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size
+
+
+def get_model_cache(cache_dir: Any) -> ModelCache:
+
+    """
+    Returns cache_dir if it is a ModelCache, otherwise an unbounded ModelCache for the directory
+
+    :param cache_dir: ModelCache or directory path
+    :return: ModelCache
+    """
+
+    return cache_dir if isinstance(cache_dir, ModelCache) else ModelCache(cache_dir)
+
+
+def get_size_bytes(path: str) -> int:
+
+    """
+    Returns the total size of a file, or of all files in a directory
+
+    :param path: file or directory path
+    :return: int
+    """
+
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    size_bytes = 0
+    for directory, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                size_bytes += os.path.getsize(os.path.join(directory, file_name))
+            except OSError:
+                pass  # removed while walking
+
+    return size_bytes
+
+
+def main(argv: List[str] = None) -> int:
+
+    """
+    Command line interface: python -m ptmlib.cache {list,prune,verify} CACHE_DIR
+
+    :param argv: command line arguments; default is sys.argv[1:]
+    :return: exit code
+    """
+
+    parser = argparse.ArgumentParser(prog='python -m ptmlib.cache', description='Manage a ptmlib model cache')
+    parser.add_argument('command', choices=('list', 'prune', 'verify'))
+    parser.add_argument('cache_dir')
+    parser.add_argument('--max-bytes', type=int, default=None, help='prune: maximum total size of all entries')
+    parser.add_argument('--max-entries', type=int, default=None, help='prune: maximum number of entries')
+    parser.add_argument('--policy', choices=EVICTION_POLICIES, default='lru', help='prune: eviction policy')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.cache_dir):
+        print(f'Cache directory not found: {args.cache_dir}', file=sys.stderr)
+        return 1
+
+    cache = ModelCache(args.cache_dir, policy=args.policy)
+
+    if args.command == 'list':
+        cache.prune()  # no limits; only synchronizes the index with the directory
+        entries = cache.entries()
+        print(f"{'Entry':<60}{'Size MB':>10}{'Fit Sec':>10}{'Hits':>6}  {'Last Hit':<20}")
+        for entry_name, entry in sorted(entries.items(), key=lambda item: -item[1].get('last_hit', 0)):
+            fit_seconds = entry.get('fit_seconds')
+            print(f"{entry_name:<60}{entry.get('size_bytes', 0) / 2 ** 20:>10.2f}"
+                  f"{fit_seconds if fit_seconds is not None else float('nan'):>10.1f}{entry.get('hits', 0):>6}  "
+                  f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.get('last_hit', 0))):<20}")
+        total_bytes = sum(entry.get('size_bytes', 0) for entry in entries.values())
+        print(f"Total: {len(entries)} entries, {total_bytes / 2 ** 20:0.2f} MB")
+        return 0
+
+    if args.command == 'prune':
+        evicted = cache.prune(args.max_bytes, args.max_entries)
+        print(f'Evicted {len(evicted)} entries')
+        return 0
+
+    problems = cache.verify()
+    for entry_name, entry_problems in problems.items():
+        for problem in entry_problems:
+            print(f'{entry_name}: {problem}')
+    print(f'Verified cache: {len(problems)} entries with problems')
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
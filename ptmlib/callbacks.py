@@ -0,0 +1,199 @@
+import os
+import pickle
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import ptmlib.storage as pst
+
+try:
+    from tensorflow import keras
+
+    Callback = keras.callbacks.Callback
+except ImportError:
+    class Callback:
+        # the part of keras.callbacks.Callback used here, so fit functions of other frameworks can drive callbacks
+        def __init__(self):
+            self.model = None
+            self.params = {}
+
+        def set_model(self, model: Any) -> None:
+            self.model = model
+
+        def set_params(self, params: dict) -> None:
+            self.params = params
+
+
+try:
+    import resource  # not available on windows; peak RSS is omitted there
+except ImportError:
+    resource = None
+
+CHECKPOINT_FILE_SUFFIX = '_checkpoint'
+CHECKPOINT_STATE_SUFFIX_EXTENSION = '_checkpoint.pkl'
+
+
+def get_checkpoint_file_name(model_file_name: str) -> str:
+    return f'{model_file_name}{CHECKPOINT_FILE_SUFFIX}'
+
+
+def load_checkpoint_state(model_file_name: str):
+
+    """
+    Returns the state saved with the last checkpoint, or None if no checkpoint exists;
+    state keys are epoch (number of completed epochs), history, params and fit_key
+
+    :param model_file_name: model file name, without extension
+    :return: dict or None
+    """
+
+    state_path = f'{model_file_name}{CHECKPOINT_STATE_SUFFIX_EXTENSION}'
+    if not os.path.exists(state_path):
+        return None
+
+    with open(state_path, 'rb') as state_file:
+        return pickle.load(state_file)
+
+
+def remove_checkpoint(model_file_name: str, file_extension: str) -> None:
+    pst.remove_path(f'{get_checkpoint_file_name(model_file_name)}{file_extension}')
+    pst.remove_path(f'{model_file_name}{CHECKPOINT_STATE_SUFFIX_EXTENSION}')
+
+
+def merge_history_data(previous: Dict[str, List], current: Dict[str, List]) -> Dict[str, List]:
+    merged = {key: list(values) for (key, values) in previous.items()}
+    for key, values in current.items():
+        merged[key] = merged.get(key, []) + list(values)
+    return merged
+
+
+class CheckpointCallback(Callback):
+
+    """
+    The CheckpointCallback class saves the model (including optimizer state) and the history so far
+    every N epochs, so an interrupted fit() can be resumed with initial_epoch
+    """
+
+    def __init__(self, model_file_name: str, file_extension: str = '.h5', every_n_epochs: int = 1,
+                 initial_state: dict = None, fit_key: str = None):
+
+        """
+        :param model_file_name: model file name, without extension
+        :param file_extension: model file extension of the checkpoint, ex: .h5
+        :param every_n_epochs: epochs between checkpoints
+        :param initial_state: state of the checkpoint being resumed, see load_checkpoint_state()
+        :param fit_key: key of the fit, ex: its cache key; a checkpoint is only resumed by a fit with the same key
+        """
+
+        super().__init__()
+        self.model_file_name = model_file_name
+        self.file_extension = file_extension
+        self.every_n_epochs = max(1, every_n_epochs)
+        self.fit_key = fit_key
+        self._history: Dict[str, List] = merge_history_data(initial_state['history'], {}) if initial_state else {}
+
+    def on_epoch_end(self, epoch: int, logs: dict = None) -> None:
+        for key, value in (logs or {}).items():
+            self._history.setdefault(key, []).append(value)
+
+        if (epoch + 1) % self.every_n_epochs == 0:
+            self._save_checkpoint(epoch + 1)
+
+    def _save_checkpoint(self, completed_epochs: int) -> None:
+        # the state file is written last; it marks the model file as complete
+        pst.save_model_atomic(self.model, f'{get_checkpoint_file_name(self.model_file_name)}{self.file_extension}')
+        pst.write_pickle_atomic({
+            'epoch': completed_epochs,
+            'history': self._history,
+            'params': self.params,
+            'fit_key': self.fit_key,
+        }, f'{self.model_file_name}{CHECKPOINT_STATE_SUFFIX_EXTENSION}')
+
+
+def get_peak_rss_bytes() -> Optional[int]:
+
+    """
+    Returns the peak resident set size of the current process in bytes, or None if unavailable
+
+    :return: int or None
+    """
+
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class ProfilingCallback(Callback):
+
+    """
+    The ProfilingCallback class records training loop timings: per-epoch wall time, steps/samples per second,
+    time spent waiting for input data vs. running train steps, sampled per-batch times and peak RSS.
+    Results are available as the profile dict after fit().
+    """
+
+    def __init__(self, batch_size: int = None, batch_sample_every: int = 10):
+
+        """
+        :param batch_size: samples per batch, used to report samples_per_second; omitted if None
+        :param batch_sample_every: keep detailed timings for every Nth batch; default is 10
+        """
+
+        super().__init__()
+        self.batch_size = batch_size
+        self.batch_sample_every = max(1, batch_sample_every)
+        self.profile: Dict[str, Any] = {'batch_size': batch_size, 'batch_sample_every': self.batch_sample_every,
+                                        'epochs': [], 'batches': []}
+        self._epoch = 0
+        self._epoch_start_time = 0.0
+        self._batch_start_time = 0.0
+        self._batch_data_wait_seconds = 0.0
+        self._batch_end_time = 0.0
+        self._steps = 0
+        self._data_wait_seconds = 0.0
+        self._compute_seconds = 0.0
+
+    def on_epoch_begin(self, epoch: int, logs: dict = None) -> None:
+        self._epoch = epoch
+        self._steps = 0
+        self._data_wait_seconds = 0.0
+        self._compute_seconds = 0.0
+        self._epoch_start_time = self._batch_end_time = time.perf_counter()
+
+    def on_train_batch_begin(self, batch: int, logs: dict = None) -> None:
+        self._batch_start_time = time.perf_counter()
+        # time between the end of the previous step and the start of this one is spent producing input data
+        self._batch_data_wait_seconds = self._batch_start_time - self._batch_end_time
+        self._data_wait_seconds += self._batch_data_wait_seconds
+
+    def on_train_batch_end(self, batch: int, logs: dict = None) -> None:
+        self._batch_end_time = time.perf_counter()
+        compute_seconds = self._batch_end_time - self._batch_start_time
+        self._compute_seconds += compute_seconds
+        self._steps += 1
+
+        if batch % self.batch_sample_every == 0:
+            self.profile['batches'].append({
+                'epoch': self._epoch,
+                'batch': batch,
+                'seconds': compute_seconds,
+                'data_wait_seconds': self._batch_data_wait_seconds,
+            })
+
+    def on_epoch_end(self, epoch: int, logs: dict = None) -> None:
+        seconds = time.perf_counter() - self._epoch_start_time
+        steps_per_second = self._steps / seconds if seconds > 0 else None
+
+        self.profile['epochs'].append({
+            'epoch': epoch,
+            'seconds': seconds,
+            'steps': self._steps,
+            'steps_per_second': steps_per_second,
+            'samples_per_second': steps_per_second * self.batch_size
+            if steps_per_second is not None and self.batch_size else None,
+            'data_wait_seconds': self._data_wait_seconds,
+            'compute_seconds': self._compute_seconds,
+            'peak_rss_bytes': get_peak_rss_bytes(),
+        })
@@ -1,10 +1,43 @@
-import matplotlib.pyplot as plt
-import pandas as pd
+import glob
+import math
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# matplotlib is imported by the functions that use it, so importing charts stays fast
+import ptmlib.events as pev
 from ptmlib.time import get_time_string
-from typing import Any
+from typing import Any, List
+
+_non_interactive_backends = ('agg', 'cairo', 'pdf', 'pgf', 'ps', 'svg', 'template')
+
+
+def display_available() -> bool:
+
+    """
+    Returns True if charts can be displayed: a notebook, or an interactive matplotlib backend with a display;
+    False on headless machines, where plt.show() would only produce warnings
+
+    :return: bool
+    """
+
+    import matplotlib
+
+    backend = matplotlib.get_backend().lower()
+    if 'inline' in backend or 'nbagg' in backend or 'ipympl' in backend or 'widget' in backend:
+        return True
+    if backend in _non_interactive_backends:
+        return False
+    if sys.platform.startswith('linux') and not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY')):
+        return False
+
+    return True
 
 
 def format_plt(fig_size: (int, int) = (10, 6)) -> None:
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=fig_size)
     plt.grid(True, which='major')
     plt.grid(True, which='minor', alpha=0.3, linestyle='--')
@@ -12,7 +45,7 @@ def format_plt(fig_size: (int, int) = (10, 6)) -> None:
 
 
 def show_history_chart(history: Any, search_string: str, fig_size: (int, int) = (10, 6),
-                       save_fig_enabled: bool = False, file_name_suffix: str = None) -> None:
+                       save_fig_enabled: bool = False, file_name_suffix: str = None, image_dir: str = None) -> None:
 
     """
     Renders line charts for TensorFlow training history (ex: accuracy, loss),
@@ -23,19 +56,21 @@ def show_history_chart(history: Any, search_string: str, fig_size: (int, int) =
     :param fig_size: chart size tuple; default is (10, 6)
     :param save_fig_enabled: save chart image with search_string-YYYYmmdd-HHMMSS.png file format
     :param file_name_suffix: suffix for file name; default is a timestamp
+    :param image_dir: directory for saved chart images; default is the working directory
     :return: None
     """
 
-    filtered_hist = {k: v for (k, v) in history.history.items() if search_string in k}
+    # select keys first, so lazily loaded histories only read the metrics being plotted
+    filtered_hist = {k: history.history[k] for k in history.history.keys() if search_string in k}
 
     if len(filtered_hist.keys()) == 0:
-        print('No data to plot for search_string:', search_string)
+        pev.emit('chart.empty', f'No data to plot for search_string: {search_string}', search_string=search_string)
         return
 
-    pd.DataFrame(filtered_hist).plot(figsize=fig_size)
-    plt.grid(True, which='major')
-    plt.grid(True, which='minor', alpha=0.3, linestyle='--')
-    plt.minorticks_on()
+    import matplotlib.pyplot as plt
+
+    figure, axes = plt.subplots(figsize=fig_size)
+    _plot_history_axes(axes, filtered_hist)
 
     if save_fig_enabled:
         if file_name_suffix is None:
@@ -43,7 +78,244 @@ def show_history_chart(history: Any, search_string: str, fig_size: (int, int) =
         else:
             image_file_name = f'{search_string}-{file_name_suffix}.png'
 
-        plt.savefig(image_file_name)
-        print('Saved image:', image_file_name)
+        if image_dir:
+            image_file_name = os.path.join(image_dir, image_file_name)
+
+        figure.savefig(image_file_name)
+        pev.emit('chart.saved', f'Saved image: {image_file_name}', image_file_name=image_file_name)
+
+    if display_available():
+        plt.show()
+
+    # release the figure immediately; pyplot keeps every open figure alive
+    plt.close(figure)
+
+
+def show_history_comparison(histories: Any, metric: str, pattern: str = '*', max_points: int = 1000,
+                            smoothing: int = None, downsample: str = 'lttb', fig_size: (int, int) = (10, 6),
+                            save_fig_enabled: bool = False, file_name_suffix: str = None,
+                            image_dir: str = None) -> None:
+
+    """
+    Renders one line chart comparing a metric (ex: val_loss) across many training runs; each run is smoothed
+    and downsampled with NumPy before plotting, so rendering time stays about the same for any run length
+
+    :param histories: dict of run name to history object or history dict, or a directory of histories saved by
+                      load_or_fit_model (ex: a cache_dir), searched with ptmlib.history.find_histories
+    :param metric: exact history key to compare; ex: accuracy, val_loss
+    :param pattern: fnmatch pattern selecting runs when histories is a directory; ex: 'computer_vision-*'
+    :param max_points: maximum points plotted per run; None plots every point
+    :param smoothing: if set, plot the trailing moving average over this many points
+    :param downsample: "lttb" keeps the visual shape of each line, "min_max" keeps every bucket minimum and maximum
+    :param fig_size: chart size tuple; default is (10, 6)
+    :param save_fig_enabled: save chart image with metric-comparison-YYYYmmdd-HHMMSS.png file format
+    :param file_name_suffix: suffix for file name; default is a timestamp
+    :param image_dir: directory for saved chart images; default is the working directory
+    :return: None
+    """
+
+    import ptmlib.history as phist
+
+    if downsample not in ('lttb', 'min_max'):
+        raise ValueError(f'downsample must be "lttb" or "min_max", not {downsample!r}')
+
+    if isinstance(histories, str):
+        histories = phist.find_histories(histories, pattern)
+    runs = {name: getattr(history, 'history', history) for (name, history) in histories.items()}
+    runs = {name: history_data[metric] for (name, history_data) in runs.items() if metric in history_data}
+
+    if len(runs) == 0:
+        pev.emit('chart.empty', f'No data to plot for metric: {metric}', metric=metric)
+        return
+
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    downsample_function = phist.downsample_lttb if downsample == 'lttb' else phist.downsample_min_max
+    figure, axes = plt.subplots(figsize=fig_size)
+    for name, values in runs.items():
+        values = phist.smooth_values(values, smoothing) if smoothing else np.asarray(values, dtype=np.float64)
+        indexes = downsample_function(values, max_points) if max_points else np.arange(len(values))
+        axes.plot(indexes, values[indexes], label=name, linewidth=1.0)
+    axes.set_title(metric)
+    axes.legend()
+    axes.grid(True, which='major')
+    axes.grid(True, which='minor', alpha=0.3, linestyle='--')
+    axes.minorticks_on()
+
+    if save_fig_enabled:
+        suffix = file_name_suffix if file_name_suffix is not None else get_time_string()
+        image_file_name = os.path.join(image_dir or '', f'{metric}-comparison-{suffix}.png')
+        figure.savefig(image_file_name)
+        pev.emit('chart.saved', f'Saved image: {image_file_name}', image_file_name=image_file_name)
+
+    if display_available():
+        plt.show()
+
+    plt.close(figure)
+
+
+def show_resource_chart(monitor_or_samples: Any, fig_size: (int, int) = (10, 6), save_fig_enabled: bool = False,
+                        file_name_suffix: str = None, image_dir: str = None) -> None:
+
+    """
+    Renders CPU utilization (per core and for the process) and memory charts for samples recorded by
+    ptmlib.monitor.ResourceMonitor, ex: Stopwatch(monitor=True).monitor
+
+    :param monitor_or_samples: ResourceMonitor, or dict returned by ResourceMonitor.samples()
+    :param fig_size: chart size tuple; default is (10, 6)
+    :param save_fig_enabled: save chart image with resources-YYYYmmdd-HHMMSS.png file format
+    :param file_name_suffix: suffix for file name; default is a timestamp
+    :param image_dir: directory for saved chart images; default is the working directory
+    :return: None
+    """
+
+    samples = monitor_or_samples.samples() if hasattr(monitor_or_samples, 'samples') else monitor_or_samples
+    if len(samples['time']) == 0:
+        pev.emit('chart.empty', 'No resource samples to plot')
+        return
+
+    import matplotlib.pyplot as plt
+
+    figure, (cpu_axes, memory_axes) = plt.subplots(2, 1, figsize=fig_size, sharex=True)
+    for core_index, core_percent in enumerate(zip(*samples['core_percent'])):
+        cpu_axes.plot(samples['time'], core_percent, linewidth=0.5, alpha=0.4, color='gray',
+                      label='core_percent' if core_index == 0 else None)
+    cpu_axes.plot(samples['time'], samples['process_cpu_percent'], label='process_cpu_percent')
+    cpu_axes.plot(samples['time'], samples['system_cpu_percent'], label='system_cpu_percent')
+    memory_axes.plot(samples['time'], [rss_bytes / 2 ** 20 for rss_bytes in samples['rss_bytes']], label='rss_mb')
+    memory_axes.set_xlabel('seconds')
+    for axes in (cpu_axes, memory_axes):
+        axes.legend()
+        axes.grid(True, which='major')
+        axes.grid(True, which='minor', alpha=0.3, linestyle='--')
+        axes.minorticks_on()
+
+    if save_fig_enabled:
+        image_file_name = f'resources-{file_name_suffix if file_name_suffix is not None else get_time_string()}.png'
+        if image_dir:
+            image_file_name = os.path.join(image_dir, image_file_name)
+
+        figure.savefig(image_file_name)
+        pev.emit('chart.saved', f'Saved image: {image_file_name}', image_file_name=image_file_name)
+
+    if display_available():
+        plt.show()
+
+    plt.close(figure)
+
+
+def save_history_charts(history: Any, search_strings: List[str], file_name_suffix: str, image_dir: str = None,
+                        fig_size: (int, int) = (10, 6), layout: str = "separate") -> List[str]:
+
+    """
+    Saves line charts for TensorFlow training history without displaying them;
+    draws every chart on one reused Agg Figure outside of pyplot, so it works on headless machines,
+    does not leak figures and is safe to call from a background thread
+
+    :param history: history object returned by TensorFlow fit(), or a dict of metric values
+    :param search_strings: strings to filter history; ex: ["accuracy", "loss"]
+    :param file_name_suffix: suffix for file names, saved as search_string-file_name_suffix.png
+    :param image_dir: directory for saved chart images; default is the working directory
+    :param fig_size: chart size tuple; default is (10, 6)
+    :param layout: "separate" saves one image per search string; "grid" saves a single
+                   history-file_name_suffix.png image with one chart per search string
+    :return: list of saved image file names
+    """
+
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    history_data = getattr(history, 'history', history)
+
+    # select keys first, so lazily loaded histories only read the metrics being plotted
+    filtered_hists = [(search_string, {k: history_data[k] for k in history_data.keys() if search_string in k})
+                      for search_string in search_strings]
+    filtered_hists = [(search_string, filtered_hist) for (search_string, filtered_hist) in filtered_hists
+                      if len(filtered_hist.keys()) > 0]
+    if len(filtered_hists) == 0:
+        return []
+
+    image_file_names = []
+
+    if layout == "grid":
+        columns = min(2, len(filtered_hists))
+        rows = math.ceil(len(filtered_hists) / columns)
+        figure = Figure(figsize=(fig_size[0] * columns, fig_size[1] * rows))
+        FigureCanvasAgg(figure)
+        for index, (search_string, filtered_hist) in enumerate(filtered_hists):
+            axes = figure.add_subplot(rows, columns, index + 1)
+            _plot_history_axes(axes, filtered_hist)
+            axes.set_title(search_string)
+
+        image_file_name = os.path.join(image_dir or '', f'history-{file_name_suffix}.png')
+        figure.savefig(image_file_name)
+        image_file_names.append(image_file_name)
+    elif layout == "separate":
+        figure = Figure(figsize=fig_size)
+        FigureCanvasAgg(figure)
+        axes = figure.add_subplot()
+        for search_string, filtered_hist in filtered_hists:
+            axes.clear()
+            _plot_history_axes(axes, filtered_hist)
+
+            image_file_name = os.path.join(image_dir or '', f'{search_string}-{file_name_suffix}.png')
+            figure.savefig(image_file_name)
+            image_file_names.append(image_file_name)
+    else:
+        raise ValueError(f'layout must be "separate" or "grid", not {layout!r}')
+
+    return image_file_names
+
+
+def render_history_directory(directory: str, search_strings: List[str], fig_size: (int, int) = (10, 6),
+                             layout: str = "separate", max_workers: int = None) -> List[str]:
+
+    """
+    Saves charts for every history file saved by load_or_fit_model in a directory (including subdirectories),
+    using a pool of worker processes; images are saved next to each history file
+
+    :param directory: directory to search for _history.npz and _history.pkl files
+    :param search_strings: strings to filter history; ex: ["accuracy", "loss"]
+    :param fig_size: chart size tuple; default is (10, 6)
+    :param layout: "separate" or "grid"; see save_history_charts
+    :param max_workers: number of worker processes; default is based on CpuCount
+    :return: list of saved image file names
+    """
+
+    import ptmlib.history as phist
+    from ptmlib.cpu import CpuCount
+
+    model_file_names = set()
+    for suffix in (phist.HISTORY_ARRAYS_SUFFIX_EXTENSION, phist.HISTORY_PICKLE_SUFFIX_EXTENSION):
+        for history_path in glob.glob(os.path.join(directory, '**', f'*{suffix}'), recursive=True):
+            model_file_names.add(history_path[:-len(suffix)])
+
+    if len(model_file_names) == 0:
+        return []
+
+    max_workers = min(max_workers or CpuCount().adjusted_count_by_percent(), len(model_file_names))
+    # spawned, not forked: forking a process that has loaded TensorFlow or matplotlib can deadlock the workers
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(_render_history_file, model_file_name, search_strings, fig_size, layout)
+                   for model_file_name in sorted(model_file_names)]
+        return [image_file_name for future in futures for image_file_name in future.result()]
+
+
+def _render_history_file(model_file_name: str, search_strings: List[str], fig_size: (int, int),
+                         layout: str) -> List[str]:
+    import ptmlib.history as phist
+
+    history_data, _ = phist.read_history_data(model_file_name)
+    image_dir, file_name_suffix = os.path.split(model_file_name)
+    return save_history_charts(history_data, search_strings, file_name_suffix, image_dir, fig_size, layout)
+
 
-    plt.show()
+def _plot_history_axes(axes: Any, filtered_hist: dict) -> None:
+    # plot the arrays directly; building a DataFrame per chart is slower and not needed
+    for key, values in filtered_hist.items():
+        axes.plot(values, label=key)
+    axes.legend()
+    axes.grid(True, which='major')
+    axes.grid(True, which='minor', alpha=0.3, linestyle='--')
+    axes.minorticks_on()
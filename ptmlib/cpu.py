@@ -1,22 +1,54 @@
+import glob
+import importlib.util
+import math
 import multiprocessing
+import os
+import sys
+from typing import Any, Dict, List, Optional, Set
+
+import ptmlib.events as pev
+
+# thread pool sizes read by BLAS/OpenMP/NumExpr/TensorFlow when they are first loaded
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'BLIS_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS')
 
 
 class CpuCount:
 
     """
     The CpuCount class provides information on the number of CPUs available on the host machine.
+    The usable count takes process CPU affinity and container (cgroup v1/v2) CPU quotas into account.
     """
 
     _default_excluded: int = 1
     _default_excluded_percent: float = 0.25
 
-    def __init__(self):
-        self._cpu_count: int = multiprocessing.cpu_count()
+    _cgroup_v1_cpu_dirs = ('cpu,cpuacct', 'cpu', 'cpuacct,cpu')
+
+    def __init__(self, root: str = '/'):
+
+        """
+        :param root: file system root used to read /proc and /sys; default is '/', may be set for testing
+        """
+
+        self._root: str = root
+        self._host_count: int = self._read_host_count()
+        self._allowed_cpus: Optional[Set[int]] = self._read_allowed_cpus()
+        self._quota: Optional[float] = self._read_cgroup_quota()
+
+        usable_counts = [self._host_count]
+        if self._allowed_cpus:
+            usable_counts.append(len(self._allowed_cpus))
+        if self._quota is not None:
+            # a quota of 1.5 CPUs can keep 2 threads partially busy
+            usable_counts.append(math.ceil(self._quota))
+
+        self._cpu_count: int = max(1, min(usable_counts))
 
     def adjusted_count(self, excluded_processors: int = _default_excluded) -> int:
 
         """
-        Returns the number of logical CPUs, reduced by a specific value
+        Returns the number of usable logical CPUs, reduced by a specific value
 
         :param excluded_processors: number of processors to exclude; default is 1
         :return: int
@@ -33,7 +65,7 @@ class CpuCount:
     def adjusted_count_by_percent(self, excluded_percent: float = _default_excluded_percent) -> int:
 
         """
-        Returns the number of logical CPUs, reduced by a specific percentage
+        Returns the number of usable logical CPUs, reduced by a specific percentage
 
         :param excluded_percent: percent of processors to exclude; default is 0.25
         :return: int
@@ -45,20 +77,352 @@ class CpuCount:
     def total_count(self) -> int:
 
         """
-        Returns the exact number of logical CPUs
+        Returns the exact number of logical CPUs usable by this process,
+        limited by CPU affinity and container CPU quota
 
         :return: int
         """
 
         return self._cpu_count
 
+    def host_count(self) -> int:
+
+        """
+        Returns the number of logical CPUs on the host machine, ignoring affinity and quota
+
+        :return: int
+        """
+
+        return self._host_count
+
+    def affinity_count(self) -> Optional[int]:
+
+        """
+        Returns the number of logical CPUs this process may run on, or None if unknown
+
+        :return: int or None
+        """
+
+        return len(self._allowed_cpus) if self._allowed_cpus else None
+
+    def quota(self) -> Optional[float]:
+
+        """
+        Returns the cgroup CPU quota as a number of CPUs (ex: 2.5), or None if unlimited
+
+        :return: float or None
+        """
+
+        return self._quota
+
+    def physical_count(self) -> Optional[int]:
+
+        """
+        Returns the number of physical cores among the CPUs this process may run on, or None if unknown
+
+        :return: int or None
+        """
+
+        cores = set()
+        for cpu in self._allowed_cpus or self._read_cpu_list('sys/devices/system/cpu/online') or []:
+            topology_dir = self._path(f'sys/devices/system/cpu/cpu{cpu}/topology')
+            package_id = self._read_text(os.path.join(topology_dir, 'physical_package_id'))
+            core_id = self._read_text(os.path.join(topology_dir, 'core_id'))
+            if core_id is None:
+                return None
+            cores.add((package_id, core_id))
+
+        return len(cores) if cores else None
+
+    def numa_nodes(self) -> Dict[int, List[int]]:
+
+        """
+        Returns the logical CPUs of each NUMA node, ex: {0: [0, 1, 2, 3], 1: [4, 5, 6, 7]};
+        empty if NUMA information is not available
+
+        :return: dict
+        """
+
+        nodes = {}
+        for node_dir in glob.glob(self._path('sys/devices/system/node/node[0-9]*')):
+            cpus = self._read_cpu_list(os.path.join(node_dir, 'cpulist'))
+            if cpus is not None:
+                nodes[int(os.path.basename(node_dir)[len('node'):])] = sorted(cpus)
+
+        return dict(sorted(nodes.items()))
+
     def print_stats(self) -> None:
 
         """
         Print info on CPU counts
         """
 
-        print(f"{'Total CPU Count:':<20}{self._cpu_count:>4}")
-        print(f"{'Adjusted Count:':<20}{self.adjusted_count():>4}")
-        print(f"{'  By Percent:':<20}{self.adjusted_count_by_percent():>4}")
-        print(f"{'  By 50 Percent:':<20}{self.adjusted_count_by_percent(0.5):>4}")
+        affinity_count = self.affinity_count()
+        quota = self.quota()
+        physical_count = self.physical_count()
+
+        numa_nodes = self.numa_nodes()
+
+        lines = [
+            f"{'Host CPU Count:':<20}{self._host_count:>4}",
+            f"{'  Affinity:':<20}{affinity_count if affinity_count is not None else 'n/a':>4}",
+            f"{'  Quota:':<20}{f'{quota:g}' if quota is not None else 'none':>4}",
+            f"{'  Physical Cores:':<20}{physical_count if physical_count is not None else 'n/a':>4}",
+            f"{'  NUMA Nodes:':<20}{len(numa_nodes) or 'n/a':>4}",
+            f"{'Total CPU Count:':<20}{self._cpu_count:>4}",
+            f"{'Adjusted Count:':<20}{self.adjusted_count():>4}",
+            f"{'  By Percent:':<20}{self.adjusted_count_by_percent():>4}",
+            f"{'  By 50 Percent:':<20}{self.adjusted_count_by_percent(0.5):>4}",
+        ]
+        pev.emit('cpu.stats', '\n'.join(lines), host_count=self._host_count, affinity_count=affinity_count,
+                 quota=quota, physical_count=physical_count, numa_nodes=len(numa_nodes), total_count=self._cpu_count,
+                 adjusted_count=self.adjusted_count(), adjusted_count_by_percent=self.adjusted_count_by_percent())
+
+    def _path(self, relative_path: str) -> str:
+        return os.path.join(self._root, relative_path)
+
+    def _read_host_count(self) -> int:
+        online_cpus = self._read_cpu_list('sys/devices/system/cpu/online')
+        if online_cpus:
+            return len(online_cpus)
+
+        return multiprocessing.cpu_count()
+
+    def _read_allowed_cpus(self) -> Optional[Set[int]]:
+        if self._root == '/' and hasattr(os, 'sched_getaffinity'):
+            return set(os.sched_getaffinity(0))
+
+        status = self._read_text(self._path('proc/self/status')) or ''
+        for line in status.splitlines():
+            if line.startswith('Cpus_allowed_list:'):
+                return _parse_cpu_list(line.split(':', 1)[1])
+
+        return None
+
+    def _read_cgroup_quota(self) -> Optional[float]:
+        cgroup_paths = self._read_cgroup_paths()
+
+        # cgroup v2: "max 100000" or "<quota> <period>" in cpu.max, checked from the process cgroup upwards
+        if '' in cgroup_paths:
+            quotas = []
+            for cgroup_dir in _get_cgroup_dirs(self._path('sys/fs/cgroup'), cgroup_paths['']):
+                cpu_max = self._read_text(os.path.join(cgroup_dir, 'cpu.max'))
+                if cpu_max is not None and not cpu_max.startswith('max'):
+                    quota, period = cpu_max.split()[:2]
+                    quotas.append(int(quota) / int(period))
+            if quotas:
+                return min(quotas)
+
+        # cgroup v1: cpu.cfs_quota_us is -1 when unlimited, checked from the process cgroup upwards,
+        # since an unlimited parent does not lift the limit of a nested cgroup
+        cpu_path = cgroup_paths.get('cpu', '/')
+        quotas = []
+        for cpu_dir_name in self._cgroup_v1_cpu_dirs:
+            for cgroup_dir in _get_cgroup_dirs(self._path(f'sys/fs/cgroup/{cpu_dir_name}'), cpu_path):
+                quota = self._read_text(os.path.join(cgroup_dir, 'cpu.cfs_quota_us'))
+                period = self._read_text(os.path.join(cgroup_dir, 'cpu.cfs_period_us'))
+                if quota is not None and period is not None and int(quota) > 0:
+                    quotas.append(int(quota) / int(period))
+
+        return min(quotas) if quotas else None
+
+    def _read_cgroup_paths(self) -> Dict[str, str]:
+        # lines are "hierarchy-id:controller-list:path"; cgroup v2 uses an empty controller list
+        paths = {}
+        for line in (self._read_text(self._path('proc/self/cgroup')) or '').splitlines():
+            parts = line.split(':', 2)
+            if len(parts) == 3:
+                for controller in parts[1].split(','):
+                    paths[controller] = parts[2]
+
+        return paths
+
+    def _read_cpu_list(self, relative_path: str) -> Optional[Set[int]]:
+        cpu_list = self._read_text(self._path(relative_path))
+        return _parse_cpu_list(cpu_list) if cpu_list else None
+
+    @staticmethod
+    def _read_text(file_path: str) -> Optional[str]:
+        try:
+            with open(file_path, 'r') as text_file:
+                return text_file.read().strip()
+        except OSError:
+            return None
+
+
+class ThreadBudget:
+
+    """
+    The ThreadBudget class applies one CPU budget to every thread pool a process may use: BLAS/OpenMP
+    (environment variables, and threadpoolctl for libraries already loaded), TensorFlow intra/inter-op
+    threads, and the joblib default n_jobs used by Scikit-Learn. This avoids nested oversubscription,
+    ex: a RandomForest using every core while each BLAS call starts another thread per core.
+    Use it as a context manager to restore the previous settings on exit, or call apply() once as a global policy.
+    """
+
+    def __init__(self, threads: int = None, inter_op_threads: int = 1,
+                 excluded_percent: float = CpuCount._default_excluded_percent, silent: bool = False):
+
+        """
+        :param threads: number of threads; default is CpuCount().adjusted_count_by_percent(excluded_percent)
+        :param inter_op_threads: TensorFlow inter-op threads, each using up to threads intra-op threads; default is 1
+        :param excluded_percent: percent of CPUs to keep free when threads is not set; default is 0.25
+        :param silent: if True, do not print the applied settings
+        """
+
+        self.threads = threads or CpuCount().adjusted_count_by_percent(excluded_percent)
+        self.inter_op_threads = inter_op_threads
+        self.silent = silent
+        self.applied: Dict[str, Any] = {}
+        self._restore_functions = []
+
+    def apply(self) -> Dict[str, Any]:
+
+        """
+        Applies the budget; settings for libraries that are not installed are skipped
+
+        :return: dict describing what was applied: threads, env, threadpoolctl, tensorflow and joblib
+        """
+
+        if self._restore_functions:
+            raise RuntimeError('ThreadBudget is already applied')
+
+        self.applied = {
+            'threads': self.threads,
+            'env': self._apply_env(),
+            'threadpoolctl': self._apply_threadpoolctl(),
+            'tensorflow': self._apply_tensorflow(),
+            'joblib': self._apply_joblib(),
+        }
+        self._report()
+        return self.applied
+
+    def restore(self) -> None:
+
+        """
+        Restores the settings in place before apply(); TensorFlow settings cannot be changed once
+        its runtime has started, so they may stay in effect until the process exits
+        """
+
+        while self._restore_functions:
+            self._restore_functions.pop()()
+
+    def __enter__(self) -> 'ThreadBudget':
+        self.apply()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.restore()
+
+    def _apply_env(self) -> Dict[str, str]:
+        values = {env_var: str(self.threads) for env_var in THREAD_ENV_VARS}
+        values['TF_NUM_INTEROP_THREADS'] = str(self.inter_op_threads)
+        previous_values = {env_var: os.environ.get(env_var) for env_var in values}
+
+        def restore_env():
+            for env_var, previous_value in previous_values.items():
+                if previous_value is None:
+                    os.environ.pop(env_var, None)
+                else:
+                    os.environ[env_var] = previous_value
+
+        os.environ.update(values)
+        self._restore_functions.append(restore_env)
+        return values
+
+    def _apply_threadpoolctl(self) -> Optional[List[Dict[str, Any]]]:
+        # environment variables are only read when a library is loaded; threadpoolctl resizes loaded pools
+        if importlib.util.find_spec('threadpoolctl') is None:
+            return None
+
+        import threadpoolctl
+
+        previous_info = threadpoolctl.threadpool_info()
+        limits = threadpoolctl.threadpool_limits(limits=self.threads)
+        self._restore_functions.append(limits.restore_original_limits)
+        return [{'internal_api': info['internal_api'], 'previous': info['num_threads'], 'threads': self.threads}
+                for info in previous_info]
+
+    def _apply_tensorflow(self) -> Optional[Dict[str, Any]]:
+        # TensorFlow is not imported here; if it is loaded later, TF_NUM_*_THREADS apply
+        if 'tensorflow' not in sys.modules:
+            return None
+
+        threading_config = sys.modules['tensorflow'].config.threading
+        previous_threads = (threading_config.get_intra_op_parallelism_threads(),
+                            threading_config.get_inter_op_parallelism_threads())
+        try:
+            threading_config.set_intra_op_parallelism_threads(self.threads)
+            threading_config.set_inter_op_parallelism_threads(self.inter_op_threads)
+        except RuntimeError as ex:
+            # raised once the TensorFlow runtime has been initialized
+            return {'error': str(ex)}
+
+        def restore_tensorflow():
+            try:
+                threading_config.set_intra_op_parallelism_threads(previous_threads[0])
+                threading_config.set_inter_op_parallelism_threads(previous_threads[1])
+            except RuntimeError:
+                pass
+
+        self._restore_functions.append(restore_tensorflow)
+        return {'intra_op': self.threads, 'inter_op': self.inter_op_threads}
+
+    def _apply_joblib(self) -> Optional[Dict[str, Any]]:
+        # sets the n_jobs used by joblib.Parallel, and Scikit-Learn estimators, when n_jobs is not given
+        if importlib.util.find_spec('joblib') is None:
+            return None
+
+        import joblib
+
+        if hasattr(joblib, 'parallel_config'):
+            config = joblib.parallel_config(n_jobs=self.threads)
+        else:
+            config = joblib.parallel_backend('loky', n_jobs=self.threads)
+        self._restore_functions.append(lambda: config.__exit__(None, None, None))
+        return {'n_jobs': self.threads}
+
+    def _report(self) -> None:
+        threadpools = self.applied['threadpoolctl']
+        tensorflow = self.applied['tensorflow']
+        if tensorflow is None:
+            tensorflow_text = 'not loaded (environment)'
+        elif 'error' in tensorflow:
+            tensorflow_text = f"not applied: {tensorflow['error']}"
+        else:
+            tensorflow_text = f"{tensorflow['intra_op']} intra-op, {tensorflow['inter_op']} inter-op"
+
+        lines = [
+            f"{'Thread Budget:':<20}{self.threads:>4}",
+            f"{'  Environment:':<20}{len(self.applied['env'])} variables, ex: OMP_NUM_THREADS={self.threads}",
+            f"{'  Thread Pools:':<20}" + ('threadpoolctl not installed' if threadpools is None else ', '.join(
+                f"{info['internal_api']} {info['previous']} -> {info['threads']}" for info in threadpools) or 'none'),
+            f"{'  TensorFlow:':<20}{tensorflow_text}",
+            f"{'  joblib:':<20}" + ('not installed' if self.applied['joblib'] is None else f'n_jobs={self.threads}'),
+        ]
+        pev.emit('cpu.thread_budget', None if self.silent else '\n'.join(lines), **self.applied)
+
+
+def _parse_cpu_list(cpu_list: str) -> Set[int]:
+    # format used by the kernel, ex: "0-3,8,10-11"
+    cpus = set()
+    for part in cpu_list.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        elif part:
+            cpus.add(int(part))
+
+    return cpus
+
+
+def _get_cgroup_dirs(mount_dir: str, cgroup_path: str) -> List[str]:
+    # inside a container the process cgroup is usually mounted as the root, so fall back to mount_dir
+    cgroup_dirs = []
+    relative_path = cgroup_path.strip('/')
+    while relative_path:
+        cgroup_dirs.append(os.path.join(mount_dir, relative_path))
+        relative_path = os.path.dirname(relative_path)
+    cgroup_dirs.append(mount_dir)
+
+    return [cgroup_dir for cgroup_dir in cgroup_dirs if os.path.isdir(cgroup_dir)]
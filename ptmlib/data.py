@@ -0,0 +1,313 @@
+import glob
+import math
+import os
+import queue
+import threading
+from typing import Any, Iterator, List, Union
+
+import ptmlib.fingerprint as fpr
+import ptmlib.storage as pst
+
+# NumPy and TensorFlow are imported by the functions that use them
+
+
+def save_shards(array: Any, file_name: str, shard_rows: int) -> List[str]:
+
+    """
+    Saves an array as a sequence of .npy shard files that can be reopened memory-mapped with ShardedArray;
+    each shard is written with write-then-rename
+
+    :param array: NumPy array, or any array supporting slicing along the first axis (ex: a memmap)
+    :param file_name: base file name; shards are saved as {file_name}-00000.npy, {file_name}-00001.npy, ...
+    :param shard_rows: number of rows per shard
+    :return: list of shard file paths
+    """
+
+    import numpy as np
+
+    directory = os.path.dirname(file_name)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    paths = []
+    for shard_index, start in enumerate(range(0, len(array), shard_rows)):
+        path = f'{file_name}-{shard_index:05d}.npy'
+        pst.write_array_atomic(np.ascontiguousarray(array[start:start + shard_rows]), path)
+        paths.append(path)
+
+    return paths
+
+
+class ShardedArray:
+
+    """
+    The ShardedArray class presents a sequence of memory-mapped .npy shard files as one array along the
+    first axis; rows are only read from disk when a batch is copied out of it
+    """
+
+    def __init__(self, shards: Union[str, List[str]], mmap_mode: str = 'r'):
+
+        """
+        :param shards: glob pattern (ex: 'data/train_x-*.npy') or list of .npy file paths
+        :param mmap_mode: NumPy memory-map mode used to open the shards
+        """
+
+        self.paths = sorted(glob.glob(shards)) if isinstance(shards, str) else list(shards)
+        if len(self.paths) == 0:
+            raise FileNotFoundError(f'No shard files found: {shards}')
+
+        self.mmap_mode = mmap_mode
+        self._open_shards()
+
+    def _open_shards(self) -> None:
+        import numpy as np
+
+        self.shards = [np.load(path, mmap_mode=self.mmap_mode, allow_pickle=False) for path in self.paths]
+        self.dtype = self.shards[0].dtype
+        for path, shard in zip(self.paths, self.shards):
+            if shard.dtype != self.dtype or shard.shape[1:] != self.shards[0].shape[1:]:
+                raise ValueError(f'Shard {path} has dtype {shard.dtype} and shape {shard.shape}, expected '
+                                 f'{self.dtype} and (n, {", ".join(str(d) for d in self.shards[0].shape[1:])})')
+        self._offsets = [0]
+        for shard in self.shards:
+            self._offsets.append(self._offsets[-1] + len(shard))
+        self.shape = (self._offsets[-1], *self.shards[0].shape[1:])
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def read_rows(self, start: int, stop: int, out: Any) -> Any:
+
+        """
+        Copies rows start:stop into out, converting to the dtype of out
+
+        :param start: first row
+        :param stop: row after the last row
+        :param out: NumPy array with at least stop - start rows
+        :return: out[:stop - start]
+        """
+
+        import numpy as np
+
+        position = 0
+        for shard, shard_start, shard_stop in zip(self.shards, self._offsets, self._offsets[1:]):
+            if shard_stop <= start or shard_start >= stop:
+                continue
+            rows = shard[max(start, shard_start) - shard_start:min(stop, shard_stop) - shard_start]
+            np.copyto(out[position:position + len(rows)], rows, casting='unsafe')
+            position += len(rows)
+
+        return out[:position]
+
+    def fingerprint(self) -> str:
+
+        """
+        Returns a fingerprint based on shard names, sizes, modification times, dtype and shape,
+        so the data is not read from disk
+
+        :return: str
+        """
+
+        shard_files = []
+        for path in self.paths:
+            stat_result = os.stat(path)
+            shard_files.append([os.path.basename(path), stat_result.st_size, stat_result.st_mtime_ns])
+
+        return fpr.fingerprint_config({'shards': shard_files, 'dtype': self.dtype.str, 'shape': list(self.shape)})
+
+    def __getstate__(self) -> dict:
+        # pickle the shard paths, not the data; ex: when sent to sweep worker processes
+        return {'paths': self.paths, 'mmap_mode': self.mmap_mode}
+
+    def __setstate__(self, state: dict) -> None:
+        self.paths = state['paths']
+        self.mmap_mode = state['mmap_mode']
+        self._open_shards()
+
+
+class ArrayBatches:
+
+    """
+    The ArrayBatches class is a batched, prefetching input pipeline over in-memory, memory-mapped or sharded
+    arrays. Each batch of x is copied and normalized in one pass into a preallocated buffer, so peak memory
+    scales with batch_size rather than with the size of the data set, ex: uint8 images scaled by 1 / 255.0.
+    Pass it to load_or_fit_model() as x; use to_dataset() with a custom fit_model_function.
+    """
+
+    def __init__(self, x: Any, y: Any = None, batch_size: int = 32, scale: float = None, dtype: str = 'float32',
+                 shuffle: bool = False, seed: int = None, prefetch: int = 2):
+
+        """
+        :param x: NumPy array or memmap, ShardedArray, or shard glob pattern / list of .npy file paths
+        :param y: target data, in the same forms as x; not normalized
+        :param batch_size: rows per batch
+        :param scale: if set, batches of x are multiplied by scale, ex: 1 / 255.0; requires a floating point dtype
+        :param dtype: dtype of x batches; None keeps the dtype of x
+        :param shuffle: if True, the order of batches is shuffled each epoch; rows within a batch are not,
+                        so memory-mapped reads stay sequential
+        :param seed: random seed used when shuffling
+        :param prefetch: number of batches prepared ahead by a background thread; 0 disables prefetching
+        """
+
+        self.x = _as_rows(x)
+        self.y = _as_rows(y) if y is not None else None
+        if self.y is not None and len(self.y) != len(self.x):
+            raise ValueError(f'x has {len(self.x)} rows but y has {len(self.y)} rows')
+        if scale is not None:
+            import numpy as np
+
+            # batches are scaled in place; an integer buffer would truncate the scaled values, ex: to 0
+            x_dtype = np.dtype(dtype if dtype is not None else self.x.dtype)
+            if not np.issubdtype(x_dtype, np.floating):
+                raise ValueError(f'scale requires a floating point dtype, not {x_dtype}; ex: dtype="float32"')
+
+        self.batch_size = batch_size
+        self.scale = scale
+        self.dtype = dtype
+        self.shuffle = shuffle
+        self.seed = seed
+        self.prefetch = prefetch
+        self._epoch = 0
+
+    def __len__(self) -> int:
+        return math.ceil(len(self.x) / self.batch_size)
+
+    def __iter__(self) -> Iterator:
+
+        """
+        Iterates over one epoch of batches: x, or (x, y) if y is set. Batches of x are stored in a small ring of
+        reused buffers and are only valid until prefetch + 1 further batches have been read; copy them to keep them
+        """
+
+        order = self._get_batch_order()
+        self._epoch += 1
+        if self.prefetch <= 0:
+            buffers = self._new_buffers(1)
+            for batch_index in order:
+                yield self._read_batch(batch_index, buffers[0])
+            return
+
+        yield from self._iter_prefetched(order)
+
+    def _iter_prefetched(self, order: List[int]) -> Iterator:
+        # the producer can be at most prefetch batches ahead while the consumer holds one more
+        buffers = self._new_buffers(self.prefetch + 2)
+        batches = queue.Queue(maxsize=self.prefetch)
+        stopped = threading.Event()
+        done = object()
+
+        def put(item) -> bool:
+            while not stopped.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for position, batch_index in enumerate(order):
+                    if not put(self._read_batch(batch_index, buffers[position % len(buffers)])):
+                        return
+                put(done)
+            except BaseException as ex:
+                put(ex)
+
+        producer = threading.Thread(target=produce, name='ptmlib-prefetch', daemon=True)
+        producer.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is done:
+                    return
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield batch
+        finally:
+            # the consumer may stop early, ex: when training stops; release the producer
+            stopped.set()
+            producer.join()
+
+    def _get_batch_order(self) -> List[int]:
+        if not self.shuffle:
+            return list(range(len(self)))
+
+        import numpy as np
+
+        seed = None if self.seed is None else self.seed + self._epoch
+        return [int(i) for i in np.random.default_rng(seed).permutation(len(self))]
+
+    def _new_buffers(self, count: int) -> List[Any]:
+        import numpy as np
+
+        dtype = self.dtype if self.dtype is not None else self.x.dtype
+        return [np.empty((self.batch_size, *self.x.shape[1:]), dtype=dtype) for _ in range(count)]
+
+    def _read_batch(self, batch_index: int, buffer: Any) -> Any:
+        import numpy as np
+
+        start = batch_index * self.batch_size
+        stop = min(start + self.batch_size, len(self.x))
+        if isinstance(self.x, ShardedArray):
+            x_batch = self.x.read_rows(start, stop, buffer)
+        else:
+            x_batch = buffer[:stop - start]
+            np.copyto(x_batch, self.x[start:stop], casting='unsafe')
+        if self.scale is not None:
+            np.multiply(x_batch, self.scale, out=x_batch, casting='unsafe')
+
+        if self.y is None:
+            return x_batch
+
+        if isinstance(self.y, ShardedArray):
+            y_batch = self.y.read_rows(start, stop, np.empty((stop - start, *self.y.shape[1:]), dtype=self.y.dtype))
+        else:
+            y_batch = np.array(self.y[start:stop])
+        return x_batch, y_batch
+
+    def to_dataset(self) -> Any:
+
+        """
+        Returns a tf.data.Dataset that iterates over this pipeline once per epoch
+
+        :return: tf.data.Dataset
+        """
+
+        import tensorflow as tf
+
+        x_dtype = self.dtype if self.dtype is not None else self.x.dtype
+        x_spec = tf.TensorSpec(shape=(None, *self.x.shape[1:]), dtype=tf.as_dtype(x_dtype))
+        if self.y is None:
+            output_signature = x_spec
+        else:
+            output_signature = (x_spec, tf.TensorSpec(shape=(None, *self.y.shape[1:]),
+                                                      dtype=tf.as_dtype(self.y.dtype)))
+
+        return tf.data.Dataset.from_generator(self._iter_copies, output_signature=output_signature)
+
+    def _iter_copies(self) -> Iterator:
+        # tf.data may keep or prefetch a batch that shares memory with a reused buffer, so batches are copied
+        for batch in self:
+            yield batch.copy() if self.y is None else (batch[0].copy(), batch[1])
+
+    def fingerprint(self) -> str:
+
+        """
+        Returns a fingerprint of the data and the pipeline settings that affect training;
+        sharded data is fingerprinted from file metadata, without reading it
+
+        :return: str
+        """
+
+        hasher = fpr.new_hasher()
+        fpr.update_hasher(hasher, [self.batch_size, self.scale, str(self.dtype), self.shuffle, self.seed])
+        fpr.update_hasher(hasher, self.x)
+        fpr.update_hasher(hasher, self.y)
+        return hasher.hexdigest()
+
+
+def _as_rows(data: Any) -> Any:
+    if isinstance(data, str) or (isinstance(data, (list, tuple)) and all(isinstance(p, str) for p in data)):
+        return ShardedArray(data)
+    return data
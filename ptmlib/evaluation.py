@@ -0,0 +1,229 @@
+import os
+import time
+from typing import Any, Callable, Dict, List
+
+import ptmlib.events as pev
+import ptmlib.fingerprint as fpr
+import ptmlib.storage as pst
+
+MANIFEST_FILE_NAME = 'manifest.json'
+EVALUATION_FILE_NAME = 'evaluation.json'
+
+# rows predicted at a time; only one batch of inputs and outputs is held in memory
+DEFAULT_BATCH_SIZE = 8192
+
+
+def get_evaluation_key(operation: str, model_fingerprint: str, data_fingerprint: str) -> str:
+
+    """
+    Returns a cache key for evaluating or predicting with a trained model on a data set
+
+    :param operation: 'predict' or 'evaluate'
+    :param model_fingerprint: see ptmlib.fingerprint.model_fingerprint()
+    :param data_fingerprint: see ptmlib.fingerprint.fingerprint_data()
+    :return: str
+    """
+
+    return fpr.fingerprint_config({'operation': operation, 'model': model_fingerprint, 'data': data_fingerprint})
+
+
+def load_or_predict(model: Any, x: Any, cache_dir: str = '', name: str = 'predictions',
+                    batch_size: int = DEFAULT_BATCH_SIZE, mmap_mode: str = 'r',
+                    predict_function: Callable[[Any, Any], Any] = None, model_fingerprint: str = None,
+                    data_fingerprint: str = None) -> Any:
+
+    """
+    Returns model.predict(x), computing and caching it on the first call only; the cache is keyed by the model
+    configuration and weights plus a fingerprint of x. Rows are predicted batch_size at a time and written to
+    .npy files, which are reopened memory-mapped, so memory use is bounded by one batch on every call.
+
+    :param model: trained Keras model or scikit-learn estimator
+    :param x: NumPy array (in memory or memory-mapped) or ptmlib.data.ShardedArray
+    :param cache_dir: directory for cache entries; default is the working directory
+    :param name: name used for the cache entry directory, ex: the model file name
+    :param batch_size: rows predicted at a time
+    :param mmap_mode: NumPy memory-map mode used to open cached predictions; None loads them into memory
+    :param predict_function: function(model, x_batch) returning an array, or a list of arrays for models with
+                             several outputs; default is model.predict(); not part of the cache key
+    :param model_fingerprint: if set, used instead of fingerprinting the model weights, ex: a cache key
+    :param data_fingerprint: if set, used instead of fingerprinting x, ex: a data set version
+    :return: array, or list of arrays for models with several outputs
+    """
+
+    if model_fingerprint is None:
+        model_fingerprint = fpr.model_fingerprint(model)
+    if data_fingerprint is None:
+        data_fingerprint = fpr.fingerprint_data(x)
+
+    cache_key = get_evaluation_key('predict', model_fingerprint, data_fingerprint)
+    entry_dir = os.path.join(cache_dir, f'{name}-{cache_key}')
+    manifest_path = os.path.join(entry_dir, MANIFEST_FILE_NAME)
+
+    if os.path.exists(manifest_path):
+        pev.emit('evaluation.hit', f'Loading existing predictions: {entry_dir}', entry_dir=entry_dir,
+                 cache_key=cache_key)
+        manifest = pst.read_json(manifest_path)
+        outputs = _load_outputs(entry_dir, manifest['outputs'], mmap_mode)
+        return outputs if manifest['multiple_outputs'] else outputs[0]
+
+    pev.emit('evaluation.miss', entry_dir=entry_dir, cache_key=cache_key, rows=len(x))
+    os.makedirs(entry_dir, exist_ok=True)
+    start_time = time.perf_counter()
+    count, multiple_outputs = _predict_batches(model, x, entry_dir, batch_size,
+                                               predict_function or _default_predict_function)
+    predict_seconds = time.perf_counter() - start_time
+    pev.emit('evaluation.save', f'Saving new predictions: {entry_dir}', entry_dir=entry_dir,
+             predict_seconds=predict_seconds)
+
+    # the manifest is written last; without it the entry is incomplete
+    pst.write_json_atomic({
+        'cache_key': cache_key,
+        'operation': 'predict',
+        'model_fingerprint': model_fingerprint,
+        'data_fingerprint': data_fingerprint,
+        'rows': len(x),
+        'outputs': count,
+        'multiple_outputs': multiple_outputs,
+        'created': time.time(),
+        'predict_seconds': predict_seconds,
+    }, manifest_path)
+
+    outputs = _load_outputs(entry_dir, count, mmap_mode)
+    return outputs if multiple_outputs else outputs[0]
+
+
+def load_or_evaluate(model: Any, x: Any, y: Any = None, cache_dir: str = '', name: str = 'evaluation',
+                     evaluate_function: Callable[[Any, Any, Any], Dict[str, Any]] = None,
+                     model_fingerprint: str = None, data_fingerprint: str = None) -> Dict[str, Any]:
+
+    """
+    Returns the metrics of model.evaluate(x, y), computing and caching them on the first call only;
+    the cache is keyed by the model configuration and weights plus a fingerprint of x and y
+
+    :param model: trained Keras model or scikit-learn estimator
+    :param x: test data, ex: NumPy array or ptmlib.data.ArrayBatches
+    :param y: test targets
+    :param cache_dir: directory for cache entries; default is the working directory
+    :param name: name used for the cache entry directory, ex: the model file name
+    :param evaluate_function: function(model, x, y) returning a dict of metrics; default is
+                              model.evaluate(return_dict=True) for Keras, and model.score() as 'score' otherwise;
+                              not part of the cache key
+    :param model_fingerprint: if set, used instead of fingerprinting the model weights, ex: a cache key
+    :param data_fingerprint: if set, used instead of fingerprinting x and y, ex: a data set version
+    :return: dict of metric name to value
+    """
+
+    if model_fingerprint is None:
+        model_fingerprint = fpr.model_fingerprint(model)
+    if data_fingerprint is None:
+        data_fingerprint = fpr.fingerprint_data((x, y))
+
+    cache_key = get_evaluation_key('evaluate', model_fingerprint, data_fingerprint)
+    entry_dir = os.path.join(cache_dir, f'{name}-{cache_key}')
+    evaluation_path = os.path.join(entry_dir, EVALUATION_FILE_NAME)
+
+    if os.path.exists(evaluation_path):
+        pev.emit('evaluation.hit', f'Loading existing evaluation: {evaluation_path}', entry_dir=entry_dir,
+                 cache_key=cache_key)
+        return pst.read_json(evaluation_path)['metrics']
+
+    pev.emit('evaluation.miss', entry_dir=entry_dir, cache_key=cache_key)
+    os.makedirs(entry_dir, exist_ok=True)
+    start_time = time.perf_counter()
+    metrics = (evaluate_function or _default_evaluate_function)(model, x, y)
+    evaluate_seconds = time.perf_counter() - start_time
+    pev.emit('evaluation.save', f'Saving new evaluation: {evaluation_path}', entry_dir=entry_dir,
+             evaluate_seconds=evaluate_seconds)
+
+    metrics = {str(metric): _to_json(value) for metric, value in metrics.items()}
+    pst.write_json_atomic({
+        'cache_key': cache_key,
+        'operation': 'evaluate',
+        'model_fingerprint': model_fingerprint,
+        'data_fingerprint': data_fingerprint,
+        'created': time.time(),
+        'evaluate_seconds': evaluate_seconds,
+        'metrics': metrics,
+    }, evaluation_path)
+
+    return metrics
+
+
+def _default_predict_function(model: Any, x: Any) -> Any:
+    if hasattr(model, 'predict_on_batch'):
+        # Keras; no progress bar for every batch
+        return model.predict(x, verbose=0)
+    return model.predict(x)
+
+
+def _default_evaluate_function(model: Any, x: Any, y: Any) -> Dict[str, Any]:
+    if hasattr(model, 'predict_on_batch'):
+        # ptmlib.data.ArrayBatches pipelines are streamed through tf.data instead of being loaded into memory
+        if hasattr(x, 'to_dataset'):
+            x = x.to_dataset()
+        return model.evaluate(x, y, verbose=0, return_dict=True)
+    return {'score': model.score(x, y)}
+
+
+def _predict_batches(model: Any, x: Any, entry_dir: str, batch_size: int, predict_function) -> tuple:
+    import numpy as np
+
+    rows = len(x)
+    if rows == 0:
+        raise ValueError('x has no rows to predict')
+
+    arrays = []
+    temp_paths = []
+    multiple_outputs = False
+    try:
+        for start in range(0, rows, batch_size):
+            stop = min(start + batch_size, rows)
+            batch_outputs = predict_function(model, _read_rows(x, start, stop))
+            multiple_outputs = isinstance(batch_outputs, (list, tuple))
+            batch_outputs = [np.asarray(output) for output in (batch_outputs if multiple_outputs else [batch_outputs])]
+
+            if start == 0:
+                # outputs are written to memory-mapped files, allocated once the output shapes are known
+                for index, output in enumerate(batch_outputs):
+                    temp_paths.append(pst.get_temp_path(_get_output_path(entry_dir, index)))
+                    arrays.append(np.lib.format.open_memmap(temp_paths[-1], mode='w+', dtype=output.dtype,
+                                                            shape=(rows, *output.shape[1:])))
+            for array, output in zip(arrays, batch_outputs):
+                array[start:stop] = output
+
+        for array in arrays:
+            array.flush()
+        arrays.clear()  # close the memory maps before the files are renamed
+        for index, temp_path in enumerate(temp_paths):
+            os.replace(temp_path, _get_output_path(entry_dir, index))
+    finally:
+        arrays.clear()
+        for temp_path in temp_paths:
+            pst.remove_path(temp_path)
+
+    return len(temp_paths), multiple_outputs
+
+
+def _read_rows(x: Any, start: int, stop: int) -> Any:
+    if hasattr(x, 'read_rows'):
+        # ptmlib.data.ShardedArray copies rows out of its shard files
+        import numpy as np
+
+        return x.read_rows(start, stop, np.empty((stop - start, *x.shape[1:]), dtype=x.dtype))
+    return x[start:stop]
+
+
+def _get_output_path(entry_dir: str, index: int) -> str:
+    return os.path.join(entry_dir, f'predictions_{index}.npy')
+
+
+def _load_outputs(entry_dir: str, count: int, mmap_mode: str) -> List[Any]:
+    import numpy as np
+
+    return [np.load(_get_output_path(entry_dir, index), mmap_mode=mmap_mode, allow_pickle=False)
+            for index in range(count)]
+
+
+def _to_json(value: Any) -> Any:
+    # NumPy scalars and arrays, ex: metrics returned by Keras
+    return value.tolist() if hasattr(value, 'tolist') else value
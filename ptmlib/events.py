@@ -0,0 +1,160 @@
+import atexit
+import collections
+import json
+import os
+import socket
+import threading
+import time
+import warnings
+from typing import Any, Callable, Dict, List
+
+# set to a file path to write every event to a JSON-lines file, ex: for batch jobs
+EVENTS_FILE_ENV_VAR = 'PTMLIB_EVENTS_FILE'
+
+
+def print_sink(record: Dict[str, Any]) -> None:
+
+    """
+    Prints the message of an event, if it has one; this is how ptmlib reports progress by default
+
+    :param record: event record
+    :return: None
+    """
+
+    message = record.get('message')
+    if message is not None:
+        print(message)
+
+
+class JsonLinesSink:
+
+    """
+    The JsonLinesSink class appends events to a JSON-lines file, one JSON object per line.
+    Events are buffered in memory and written by a background thread every flush_interval seconds,
+    so emitting an event never waits for the disk. Records are flushed on close() and at exit.
+    """
+
+    def __init__(self, file_path: str, flush_interval: float = 1.0):
+
+        """
+        :param file_path: JSON-lines file path; events are appended if it already exists
+        :param flush_interval: maximum seconds between writes
+        """
+
+        self.file_path = file_path
+        self.flush_interval = flush_interval
+        self._records = collections.deque()
+        self._write_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ptmlib-events', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __call__(self, record: Dict[str, Any]) -> None:
+        self._records.append(record)
+
+    def _run(self) -> None:
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self) -> None:
+
+        """
+        Writes all buffered events
+        """
+
+        with self._write_lock:
+            lines = []
+            while self._records:
+                lines.append(json.dumps(self._records.popleft(), default=str, separators=(',', ':')))
+            if lines:
+                # one write per batch; appends from several processes do not interleave within a line
+                with open(self.file_path, 'a', encoding='utf-8') as events_file:
+                    events_file.write('\n'.join(lines) + '\n')
+
+    def close(self) -> None:
+
+        """
+        Stops the background thread and writes all buffered events
+        """
+
+        if not self._closed.is_set():
+            self._closed.set()
+            self._thread.join()
+            atexit.unregister(self.close)
+        self.flush()
+
+
+_sinks: List[Callable[[Dict[str, Any]], None]] = [print_sink]
+_context: Dict[str, Any] = {'host': socket.gethostname()}
+_sinks_lock = threading.Lock()
+
+
+def emit(event: str, message: str = None, **fields: Any) -> None:
+
+    """
+    Sends an event to every sink; ptmlib modules emit events such as 'load_or_fit_model.hit',
+    'load_or_fit_model.saved', 'stopwatch.stop' and 'cpu.stats'
+
+    :param event: event name
+    :param message: human readable message, printed by print_sink
+    :param fields: event data; values should be JSON-compatible
+    :return: None; a sink that raises is reported with warnings.warn(), and the other sinks still receive the event
+    """
+
+    record = {'event': event, 'time': time.time(), 'pid': os.getpid(), **_context, **fields}
+    if message is not None:
+        record['message'] = message
+
+    for sink in _sinks:
+        try:
+            sink(record)
+        except Exception as ex:
+            # reporting must never break the library call that emitted the event
+            warnings.warn(f'event sink {sink!r} failed for {event}: {ex!r}', RuntimeWarning, stacklevel=2)
+
+
+def add_sink(sink: Callable[[Dict[str, Any]], None]) -> None:
+
+    """
+    Adds a sink: any function that accepts an event record dict, or a JsonLinesSink
+
+    :param sink: sink function
+    :return: None
+    """
+
+    global _sinks
+
+    with _sinks_lock:
+        _sinks = [*_sinks, sink]  # copy on write, so emit() never needs the lock
+
+
+def remove_sink(sink: Callable[[Dict[str, Any]], None]) -> None:
+
+    """
+    Removes a sink; use remove_sink(print_sink) to stop printing progress messages
+
+    :param sink: sink function
+    :return: None
+    """
+
+    global _sinks
+
+    with _sinks_lock:
+        _sinks = [existing_sink for existing_sink in _sinks if existing_sink is not sink]
+
+
+def set_context(**fields: Any) -> None:
+
+    """
+    Adds fields to every event record, ex: set_context(job_id='sweep-42')
+
+    :param fields: context fields
+    :return: None
+    """
+
+    _context.update(fields)
+
+
+if os.environ.get(EVENTS_FILE_ENV_VAR):
+    add_sink(JsonLinesSink(os.environ[EVENTS_FILE_ENV_VAR]))
@@ -10,6 +10,7 @@ from tensorflow.keras import layers
 
 import ptmlib.model_tools as modt
 import ptmlib.charts as pch
+import ptmlib.evaluation as peval
 
 class MyCallback(keras.callbacks.Callback):
 
@@ -96,9 +97,10 @@ def main():
                                             load_model_function=load_model_function_custom,
                                             fit_model_function=fit_model_function_with_callback)
 
-    model.evaluate(test_images, test_labels)
+    # evaluation and predictions are cached too, keyed by the model weights and test data
+    print(peval.load_or_evaluate(model, test_images, test_labels, name=f'{model_file_name}_evaluation'))
 
-    classifications = model.predict(test_images)
+    classifications = peval.load_or_predict(model, test_images, name=f'{model_file_name}_predictions')
     print(classifications[0])
     print(test_labels[0])
     print(max(classifications[0]))
@@ -0,0 +1,75 @@
+# THIS CODE IS A MODULARIZED AND UPDATED VERSION OF CODE FROM THE "DEEPLEARNING.AI TENSORFLOW DEVELOPER" COURSE
+# SOURCE:
+# https://github.com/lmoroney/dlaicourse/blob/master/Course%201%20-%20Part%204%20-%20Lesson%202%20-%20Notebook.ipynb
+
+import os
+
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers
+
+import ptmlib.charts as pch
+import ptmlib.data as pdata
+import ptmlib.model_tools as modt
+
+DATA_DIR = 'data'
+CACHE_DIR = 'cache'
+
+
+def get_data():
+    # save uint8 images once as .npy shards; later runs read them memory-mapped, batch by batch
+    if not os.path.exists(os.path.join(DATA_DIR, 'training_images-00000.npy')):
+        mnist = keras.datasets.fashion_mnist
+        (training_images, training_labels), (test_images, test_labels) = mnist.load_data()
+        for name, array in (('training_images', training_images), ('training_labels', training_labels),
+                            ('test_images', test_images), ('test_labels', test_labels)):
+            pdata.save_shards(array, os.path.join(DATA_DIR, name), shard_rows=20000)
+
+    # normalize image data to values between 0 and 1, one float32 batch at a time
+    training_batches = pdata.ArrayBatches(os.path.join(DATA_DIR, 'training_images-*.npy'),
+                                          os.path.join(DATA_DIR, 'training_labels-*.npy'),
+                                          batch_size=64, scale=1 / 255.0, shuffle=True, seed=42)
+    test_batches = pdata.ArrayBatches(os.path.join(DATA_DIR, 'test_images-*.npy'),
+                                      os.path.join(DATA_DIR, 'test_labels-*.npy'),
+                                      batch_size=256, scale=1 / 255.0)
+
+    return training_batches, test_batches
+
+
+def get_model() -> keras.models.Sequential:
+    model = keras.models.Sequential([
+        layers.Flatten(input_shape=(28, 28)),
+        layers.Dropout(0.2),
+        layers.Dense(512, activation=tf.nn.relu),
+        layers.Dense(10, activation=tf.nn.softmax)
+    ])
+
+    model.compile(
+        optimizer=tf.optimizers.Adam(),
+        loss="sparse_categorical_crossentropy",
+        metrics=["accuracy"]
+    )
+
+    return model
+
+
+def main():
+
+    # HYPER PARAMS
+    hp_epochs = 5
+    model_file_name = "computer_vision_streaming"
+
+    training_batches, test_batches = get_data()
+
+    # the cache key is computed from the shard file metadata, so the images are not read to fingerprint them
+    model, history = modt.load_or_fit_model(get_model(), model_file_name, x=training_batches,
+                                            validation_data=test_batches, epochs=hp_epochs,
+                                            metrics=["accuracy"], cache_dir=CACHE_DIR, profile_enabled=True)
+
+    model.evaluate(test_batches.to_dataset())
+
+    pch.show_history_chart(history, "accuracy")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,16 +9,19 @@ from sklearn.ensemble import RandomForestClassifier
 
 from sklearn.metrics import accuracy_score
 
-from ptmlib.time import Stopwatch
+import ptmlib.model_tools as modt
+import ptmlib.preprocessing as pprep
 from ptmlib.cpu import CpuCount
 
+CACHE_DIR = 'cache'
 
-def get_data():
+
+def fetch_data():
     from sklearn.datasets import fetch_openml
 
     train_data_count = 60000
     print('\n', 'RETRIEVING MNIST_784 DATA', '\n')
-    mnist = fetch_openml('mnist_784', version=1)
+    mnist = fetch_openml('mnist_784', version=1, as_frame=False)
     mnist.target = mnist.target.astype(np.uint8)
 
     x_train = mnist['data'][:train_data_count]
@@ -27,20 +30,25 @@ def get_data():
     x_test = mnist['data'][train_data_count:]
     y_test = mnist['target'][train_data_count:]
 
+    return x_train, y_train, x_test, y_test
+
+
+def get_data():
+    # fetched and converted once; later runs reopen memory-mapped .npy files
+    x_train, y_train, x_test, y_test = pprep.load_or_compute_arrays('mnist_784', fetch_data, cache_dir=CACHE_DIR)
     return (x_train, y_train), (x_test, y_test)
 
 
 def get_reduced_data(x_train, x_test, variance):
     from sklearn.decomposition import PCA
 
-    pca = PCA(n_components=variance)
-    x_train_reduced = pca.fit_transform(x_train)
+    # PCA is only refit if its params or x_train change
+    _, x_train_reduced, x_test_reduced = pprep.load_or_fit_transform(PCA(n_components=variance), 'mnist_pca',
+                                                                     x_train, x_test, cache_dir=CACHE_DIR)
 
     print('x_train shape:', x_train.shape)
     print('x_train_reduced shape:', x_train_reduced.shape)
 
-    x_test_reduced = pca.transform(x_test)
-
     return x_train_reduced, x_test_reduced
 
 
@@ -48,7 +56,6 @@ def main():
 
     # INFO AND SETUP
     print('Scikit-Learn Version:', sklearn.__version__)
-    stopwatch = Stopwatch()
     cpu_count = CpuCount()
     cpu_count.print_stats()
     max_cpu = cpu_count.adjusted_count_by_percent()  # don't use too many processors :)
@@ -65,9 +72,9 @@ def main():
     print(f'Init RandomForestClassifier with n_jobs={max_cpu}')
     rnd_clf = RandomForestClassifier(n_estimators=hp_estimators, random_state=hp_random_state, n_jobs=max_cpu)
 
-    stopwatch.start()
-    rnd_clf.fit(x_train, y_train)
-    stopwatch.stop()
+    # the fitted forest is saved with joblib and memory-mapped when reloaded on later runs
+    rnd_clf, fit_result = modt.load_or_fit(rnd_clf, 'mnist_random_forest', x_train, y_train, cache_dir=CACHE_DIR)
+    print(f'Fit seconds: {fit_result.fit_seconds:0.4f} (cached: {fit_result.cached})')
 
     y_pred = rnd_clf.predict(x_test)
 
@@ -77,14 +84,14 @@ def main():
     x_train_reduced, x_test_reduced = get_reduced_data(x_train, x_test, hp_variance)
     rnd_clf = RandomForestClassifier(n_estimators=hp_estimators, random_state=hp_random_state, n_jobs=max_cpu)
 
-    stopwatch.start()
-    rnd_clf.fit(x_train_reduced, y_train)
-    stopwatch.stop()
+    rnd_clf, fit_result = modt.load_or_fit(rnd_clf, 'mnist_pca_random_forest', x_train_reduced, y_train,
+                                           cache_dir=CACHE_DIR)
+    print(f'Fit seconds: {fit_result.fit_seconds:0.4f} (cached: {fit_result.cached})')
 
     y_pred = rnd_clf.predict(x_test_reduced)
 
     print('\n', 'PCA ACCURACY SCORE:', accuracy_score(y_test, y_pred), '\n')
-    
+
     print('EXPECTED RESULT: SLOWER training and LOWER accuracy; PCA is not always the answer')
     print('See exercise 9 in the following notebook for more info:')
     print('https://github.com/ageron/handson-ml2/blob/master/08_dimensionality_reduction.ipynb')
@@ -0,0 +1,359 @@
+import hashlib
+import json
+import weakref
+from typing import Any, Dict, Optional
+
+# hash large buffers in slices so we never hold a second copy of the data in memory
+CHUNK_SIZE_BYTES: int = 16 * 1024 * 1024
+
+_DIGEST_SIZE: int = 16
+
+# fingerprints of models loaded or fit by ptmlib, ex: their cache keys; see set_model_fingerprint()
+_model_fingerprints: 'weakref.WeakKeyDictionary[Any, str]' = weakref.WeakKeyDictionary()
+
+# Keras config keys holding nested layer configs, and keys holding references to layers by name
+_LAYER_LIST_KEYS = ('layers',)
+_LAYER_KEYS = ('layer', 'forward_layer', 'backward_layer')
+_LAYER_REFERENCE_KEYS = ('inbound_nodes', 'input_layers', 'output_layers', 'keras_history')
+
+
+def new_hasher() -> Any:
+    return hashlib.blake2b(digest_size=_DIGEST_SIZE)
+
+
+def fingerprint_data(data: Any) -> str:
+
+    """
+    Returns a hex digest for training data such as NumPy arrays, pandas objects,
+    (x, y) tuples or plain Python values
+
+    :param data: data to fingerprint
+    :return: str
+    """
+
+    hasher = new_hasher()
+    update_hasher(hasher, data)
+    return hasher.hexdigest()
+
+
+def fingerprint_config(config: Any) -> str:
+
+    """
+    Returns a hex digest for a JSON-compatible configuration (ex: model.get_config());
+    objects that are not JSON serializable are reduced to a stable description
+
+    :param config: configuration dict, list or value
+    :return: str
+    """
+
+    hasher = new_hasher()
+    hasher.update(_config_to_json(config).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def model_config(model: Any) -> dict:
+
+    """
+    Returns a dict describing a compiled Keras model: architecture, optimizer, loss and metrics
+
+    :param model: compiled Keras model
+    :return: dict
+    """
+
+    config = {
+        'class_name': type(model).__name__,
+        'model': normalize_layer_names(model.get_config()) if hasattr(model, 'get_config') else repr(model),
+    }
+
+    if hasattr(model, 'get_compile_config'):
+        # TF 2.13+ provides optimizer, loss and metrics in a single config
+        config['compile'] = model.get_compile_config()
+    else:
+        optimizer = getattr(model, 'optimizer', None)
+        config['compile'] = {
+            'optimizer': optimizer.get_config() if hasattr(optimizer, 'get_config') else optimizer,
+            'loss': getattr(model, 'loss', None),
+            'metrics': getattr(model, 'compiled_metrics', None),
+        }
+
+    return config
+
+
+def normalize_layer_names(config: Any) -> Any:
+
+    """
+    Returns a copy of a Keras model config with the names of the model and its layers replaced by their position,
+    including references to layers in inbound nodes; Keras numbers default names per process (dense, dense_1, ...),
+    so the same architecture built twice has different names but the same normalized config
+
+    :param config: model config, ex: model.get_config()
+    :return: normalized config
+    """
+
+    names: Dict[str, str] = {}
+    # the first pass numbers the layers, the second also renames references to layers defined later
+    _normalize_names(config, names, is_layer=True)
+    return _normalize_names(config, names, is_layer=True)
+
+
+def _normalize_names(value: Any, names: Dict[str, str], is_layer: bool = False) -> Any:
+    if isinstance(value, list):
+        return [_normalize_names(item, names) for item in value]
+    if not isinstance(value, dict):
+        return value
+
+    normalized = {}
+    for key, item in value.items():
+        if is_layer and key == 'name' and isinstance(item, str):
+            normalized[key] = names.setdefault(item, f'layer_{len(names)}')
+        elif (is_layer and key == 'config') or key in _LAYER_KEYS:
+            normalized[key] = _normalize_names(item, names, is_layer=isinstance(item, dict))
+        elif key in _LAYER_LIST_KEYS and isinstance(item, list):
+            normalized[key] = [_normalize_names(layer, names, is_layer=True) for layer in item]
+        elif key in _LAYER_REFERENCE_KEYS:
+            normalized[key] = _rename_references(item, names)
+        else:
+            normalized[key] = _normalize_names(item, names)
+
+    return normalized
+
+
+def _rename_references(value: Any, names: Dict[str, str]) -> Any:
+    if isinstance(value, str):
+        return names.get(value, value)
+    if isinstance(value, (list, tuple)):
+        return [_rename_references(item, names) for item in value]
+    if isinstance(value, dict):
+        return {key: _rename_references(item, names) for (key, item) in value.items()}
+    return value
+
+
+def weights_fingerprint(model: Any) -> Optional[str]:
+
+    """
+    Returns a hex digest of the shapes and dtypes of a model's weights, ex: to find models whose weights
+    can be loaded into this one; None if the model has no weights, ex: a Keras model that is not built yet
+
+    :param model: model with a get_weights() method
+    :return: str or None
+    """
+
+    weights = model.get_weights() if hasattr(model, 'get_weights') else []
+    if len(weights) == 0:
+        return None
+
+    return fingerprint_config([[list(weight.shape), str(weight.dtype)] for weight in weights])
+
+
+def model_fingerprint(model: Any) -> str:
+
+    """
+    Returns a hex digest identifying a trained model. Models returned by load_or_fit_model(cache_dir=...) or
+    load_or_fit(cache_dir=...) are identified by their cache key, without reading the weights (see
+    set_model_fingerprint()). Keras models are fingerprinted by their configuration plus the values of their
+    weights, and scikit-learn estimators by get_params() plus their fitted attributes (names ending in '_').
+
+    :param model: trained Keras model or scikit-learn estimator
+    :return: str
+    """
+
+    fingerprint = get_model_fingerprint(model)
+    if fingerprint is not None:
+        return fingerprint
+
+    hasher = new_hasher()
+    if hasattr(model, 'get_weights'):
+        hasher.update(fingerprint_config(model_config(model)).encode('ascii'))
+        update_hasher(hasher, model.get_weights())
+    else:
+        _update_with_model_state(hasher, model)
+    return hasher.hexdigest()
+
+
+def set_model_fingerprint(model: Any, fingerprint: Optional[str]) -> None:
+
+    """
+    Records the fingerprint returned by model_fingerprint() for a model object, ex: the cache key it was loaded
+    with; pass None to forget it, ex: after training the model further
+
+    :param model: model object; the fingerprint is forgotten when the model is garbage collected
+    :param fingerprint: fingerprint, or None
+    :return: None
+    """
+
+    try:
+        if fingerprint is None:
+            _model_fingerprints.pop(model, None)
+        else:
+            _model_fingerprints[model] = fingerprint
+    except TypeError:
+        pass  # not weakly referenceable or not hashable; model_fingerprint() reads the model instead
+
+
+def get_model_fingerprint(model: Any) -> Optional[str]:
+
+    """
+    Returns the fingerprint recorded with set_model_fingerprint(), or None
+
+    :param model: model object
+    :return: str or None
+    """
+
+    try:
+        return _model_fingerprints.get(model)
+    except TypeError:
+        return None
+
+
+def fit_fingerprint(model: Any, x: Any, y: Any = None, validation_data: Any = None, epochs: int = 1,
+                    data_fingerprint: str = None) -> str:
+
+    """
+    Returns a cache key for a fit() call, derived from the model configuration, epochs and training data
+
+    :param model: compiled Keras model
+    :param x: training data
+    :param y: target data
+    :param validation_data: validation data passed to fit()
+    :param epochs: number of epochs
+    :param data_fingerprint: if set, used instead of fingerprinting x, y and validation_data;
+                             ex: a data set version for generators or tf.data.Dataset inputs
+    :return: str
+    """
+
+    hasher = new_hasher()
+    hasher.update(fingerprint_config(model_config(model)).encode('ascii'))
+    hasher.update(f'epochs={epochs}'.encode('ascii'))
+    if data_fingerprint is not None:
+        hasher.update(f'data_fingerprint={data_fingerprint}'.encode('utf-8'))
+    else:
+        for data in (x, y, validation_data):
+            hasher.update(fingerprint_data(data).encode('ascii'))
+    return hasher.hexdigest()
+
+
+def update_hasher(hasher: Any, data: Any) -> None:
+
+    """
+    Feeds data into an existing hashlib object, tagging each value with its type and shape
+    so that equal bytes with different layouts produce different digests
+
+    :param hasher: hashlib object
+    :param data: data to hash
+    :return: None
+    """
+
+    if data is None:
+        hasher.update(b'none;')
+    elif isinstance(data, (bytes, bytearray, memoryview)):
+        hasher.update(b'bytes;')
+        _update_with_buffer(hasher, memoryview(data))
+    elif isinstance(data, (str, int, float, bool)):
+        hasher.update(f'{type(data).__name__}:{data!r};'.encode('utf-8'))
+    elif isinstance(data, (tuple, list)):
+        hasher.update(f'{type(data).__name__}[{len(data)}];'.encode('ascii'))
+        for item in data:
+            update_hasher(hasher, item)
+    elif isinstance(data, dict):
+        hasher.update(f'dict[{len(data)}];'.encode('ascii'))
+        for key in sorted(data, key=str):
+            update_hasher(hasher, str(key))
+            update_hasher(hasher, data[key])
+    elif callable(getattr(data, 'fingerprint', None)):
+        # streaming inputs (ex: ptmlib.data.ArrayBatches) fingerprint themselves without reading all data
+        hasher.update(f'{type(data).__name__}:{data.fingerprint()};'.encode('utf-8'))
+    elif hasattr(data, 'dtype') and hasattr(data, 'shape') and hasattr(data, '__array_interface__'):
+        _update_with_array(hasher, data)
+    elif hasattr(data, 'to_numpy'):
+        # pandas DataFrame/Series; include labels so renamed columns change the key
+        columns = getattr(data, 'columns', None)
+        update_hasher(hasher, [str(c) for c in columns] if columns is not None else getattr(data, 'name', None))
+        _update_with_array(hasher, data.to_numpy())
+    else:
+        raise TypeError(f'Unable to fingerprint data of type {type(data).__name__}; '
+                        f'pass data_fingerprint, or add a fingerprint() method')
+
+
+def _update_with_model_state(hasher: Any, value: Any) -> None:
+    # scikit-learn estimators are hashed by params plus fitted attributes; nested estimators (ex: the trees of a
+    # random forest) and other objects by their state, so no pickled bytes, which vary between runs, are hashed
+    if isinstance(value, (list, tuple)):
+        hasher.update(f'{type(value).__name__}[{len(value)}];'.encode('ascii'))
+        for item in value:
+            _update_with_model_state(hasher, item)
+    elif isinstance(value, dict):
+        hasher.update(f'dict[{len(value)}];'.encode('ascii'))
+        for key in sorted(value, key=str):
+            update_hasher(hasher, str(key))
+            _update_with_model_state(hasher, value[key])
+    elif isinstance(value, (set, frozenset)):
+        _update_with_model_state(hasher, sorted(value, key=str))
+    elif hasattr(value, 'get_params') and not isinstance(value, type):
+        update_hasher(hasher, f'{type(value).__module__}.{type(value).__qualname__}')
+        hasher.update(fingerprint_config(value.get_params(deep=False)).encode('ascii'))
+        fitted_attributes = {name: attribute for (name, attribute) in vars(value).items()
+                             if name.endswith('_') and not name.startswith('_')}
+        _update_with_model_state(hasher, fitted_attributes)
+    elif value is None or isinstance(value, (bytes, bytearray, memoryview, str, int, float, bool)) \
+            or hasattr(value, '__array_interface__') or hasattr(value, 'to_numpy'):
+        update_hasher(hasher, value)
+    elif hasattr(value, 'item') and getattr(value, 'shape', None) == ():
+        update_hasher(hasher, value.item())  # NumPy scalar
+    elif callable(value):
+        update_hasher(hasher, _json_default(value))
+    else:
+        update_hasher(hasher, f'{type(value).__module__}.{type(value).__qualname__}')
+        state = value.__getstate__() if hasattr(value, '__getstate__') else getattr(value, '__dict__', None)
+        _update_with_model_state(hasher, state if state is not value else None)
+
+
+def _update_with_array(hasher: Any, array: Any) -> None:
+    hasher.update(f'array:{array.dtype.str}:{tuple(array.shape)};'.encode('ascii'))
+
+    if array.dtype.hasobject:
+        # object arrays hold pointers, not values
+        hasher.update(repr(array.tolist()).encode('utf-8'))
+    elif array.flags['C_CONTIGUOUS']:
+        try:
+            view = memoryview(array)
+        except (TypeError, ValueError):
+            # dtypes without a buffer format (ex: datetime64) are hashed by their raw bytes
+            view = memoryview(array.view('u1'))
+        _update_with_buffer(hasher, view)
+    else:
+        # copy one block of rows at a time instead of the whole array
+        row_bytes = max(1, array.itemsize * (array.size // max(1, len(array))))
+        rows_per_chunk = max(1, CHUNK_SIZE_BYTES // row_bytes)
+        for start in range(0, len(array), rows_per_chunk):
+            _update_with_buffer(hasher, memoryview(array[start:start + rows_per_chunk].copy()))
+
+
+def _update_with_buffer(hasher: Any, view: memoryview) -> None:
+    view = view.cast('B') if view.ndim != 1 or view.format != 'B' else view
+    for start in range(0, len(view), CHUNK_SIZE_BYTES):
+        hasher.update(view[start:start + CHUNK_SIZE_BYTES])
+
+
+def _config_to_json(config: Any) -> str:
+    return json.dumps(config, sort_keys=True, default=_json_default)
+
+
+def _json_default(value: Any) -> Any:
+    if hasattr(value, 'get_config'):
+        return {'class_name': type(value).__name__, 'config': value.get_config()}
+    if hasattr(value, 'item') and getattr(value, 'shape', None) == ():
+        # NumPy scalar
+        return value.item()
+    if hasattr(value, '__array_interface__'):
+        return fingerprint_data(value)
+    if callable(value):
+        # avoid repr(), which includes memory addresses
+        return f'{getattr(value, "__module__", "")}.{getattr(value, "__qualname__", type(value).__name__)}'
+
+    # str() of most objects also includes a memory address, which changes every run; ex: np.random.RandomState
+    hasher = new_hasher()
+    try:
+        _update_with_model_state(hasher, value)
+    except RecursionError:
+        pass  # objects that refer to themselves are identified by their class only
+    return {'class_name': f'{type(value).__module__}.{type(value).__qualname__}', 'state': hasher.hexdigest()}
@@ -0,0 +1,282 @@
+import fnmatch
+import glob
+import json
+import math
+import os
+import pickle
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import ptmlib.storage as pst
+
+HISTORY_ARRAYS_SUFFIX_EXTENSION = '_history.npz'
+HISTORY_PICKLE_SUFFIX_EXTENSION = '_history.pkl'
+
+_HEADER_KEY = 'header'
+_FORMAT_VERSION = 1
+
+
+def get_history_arrays_path(model_file_name: str) -> str:
+    return f'{model_file_name}{HISTORY_ARRAYS_SUFFIX_EXTENSION}'
+
+
+def read_history_data(model_file_name: str) -> Optional[Tuple[Any, Dict[str, Any]]]:
+
+    """
+    Returns the (history, params) saved for a model, or None if no history file exists;
+    reads the .npz format lazily and falls back to the legacy pickle format
+
+    :param model_file_name: model file name, without extension
+    :return: tuple of history mapping and params dict, or None
+    """
+
+    arrays_path = get_history_arrays_path(model_file_name)
+    if os.path.exists(arrays_path):
+        history_data = LazyHistoryData(arrays_path)
+        return history_data, history_data.params
+
+    pickle_path = f'{model_file_name}{HISTORY_PICKLE_SUFFIX_EXTENSION}'
+    if os.path.exists(pickle_path):
+        with open(pickle_path, 'rb') as history_file:
+            # load from previously saved history_params_tuple
+            return pickle.load(history_file)
+
+    return None
+
+
+def save_history_arrays(history_data: Dict[str, Any], params: Dict[str, Any], file_path: str) -> None:
+
+    """
+    Saves training history as one contiguous float64 array per metric, plus a small JSON header
+    holding params and metric names, in an uncompressed .npz file
+
+    :param history_data: history dict; ex: history.history
+    :param params: params dict; ex: history.params
+    :param file_path: .npz file path
+    :return: None
+    """
+
+    import numpy as np
+
+    # convert everything before writing; raises ValueError/TypeError for non-numeric metrics
+    arrays = {f'metric_{index}': np.asarray(values, dtype=np.float64)
+              for (index, values) in enumerate(history_data.values())}
+    header = {
+        'format_version': _FORMAT_VERSION,
+        'metrics': {name: f'metric_{index}' for (index, name) in enumerate(history_data.keys())},
+        'epochs': max((len(array) for array in arrays.values()), default=0),
+        'params': params,
+    }
+    arrays[_HEADER_KEY] = np.frombuffer(json.dumps(header, default=str).encode('utf-8'), dtype=np.uint8)
+
+    temp_path = pst.get_temp_path(file_path)
+    try:
+        with open(temp_path, 'wb') as history_file:
+            np.savez(history_file, **arrays)
+        os.replace(temp_path, file_path)
+    finally:
+        pst.remove_path(temp_path)
+
+
+def load_history_header(file_path: str) -> Dict[str, Any]:
+
+    """
+    Reads only the JSON header of a history .npz file
+
+    :param file_path: .npz file path
+    :return: dict with metrics, epochs and params keys
+    """
+
+    import numpy as np
+
+    with np.load(file_path, allow_pickle=False) as npz_file:
+        return json.loads(npz_file[_HEADER_KEY].tobytes().decode('utf-8'))
+
+
+class LazyHistoryData(MutableMapping):
+
+    """
+    The LazyHistoryData class is a dict-like view of a history .npz file;
+    each metric array is read from disk the first time it is accessed, and returned as a list of floats,
+    like keras.callbacks.History.history
+    """
+
+    def __init__(self, file_path: str, header: Dict[str, Any] = None):
+        self.file_path = file_path
+        self._header = header if header is not None else load_history_header(file_path)
+        self._keys = list(self._header['metrics'].keys())
+        self._loaded: Dict[str, Any] = {}
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return self._header['params']
+
+    @property
+    def epochs(self) -> int:
+        return self._header['epochs']
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._loaded:
+            if key not in self._header['metrics']:
+                raise KeyError(key)
+
+            import numpy as np
+
+            with np.load(self.file_path, allow_pickle=False) as npz_file:
+                # lists, so code written for History.history keeps working; ex: history['loss'] + [0.1]
+                self._loaded[key] = npz_file[self._header['metrics'][key]].tolist()
+        return self._loaded[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in self._keys:
+            self._keys.append(key)
+        self._loaded[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self._keys:
+            raise KeyError(key)
+        self._keys.remove(key)
+        self._loaded.pop(key, None)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._keys))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __repr__(self) -> str:
+        return f'LazyHistoryData({self.file_path!r}, metrics={self._keys})'
+
+
+def find_histories(directory: str, pattern: str = '*') -> Dict[str, Any]:
+
+    """
+    Finds histories saved by load_or_fit_model in a directory (including subdirectories), ex: a cache_dir;
+    .npz histories are read lazily, so only the metrics being compared are loaded
+
+    :param directory: directory to search for _history.npz and _history.pkl files
+    :param pattern: fnmatch pattern for the model file name, relative to directory;
+                    ex: 'computer_vision-*' selects every cache entry for computer_vision
+    :return: dict of name (model file name relative to directory) to history mapping, sorted by name
+    """
+
+    model_file_names = set()
+    for suffix in (HISTORY_ARRAYS_SUFFIX_EXTENSION, HISTORY_PICKLE_SUFFIX_EXTENSION):
+        for history_path in glob.glob(os.path.join(directory, '**', f'*{suffix}'), recursive=True):
+            model_file_names.add(history_path[:-len(suffix)])
+
+    histories = {}
+    for model_file_name in sorted(model_file_names):
+        name = os.path.relpath(model_file_name, directory).replace(os.sep, '/')
+        if fnmatch.fnmatch(name, pattern):
+            histories[name] = read_history_data(model_file_name)[0]
+
+    return histories
+
+
+def smooth_values(values: Any, window: int) -> Any:
+
+    """
+    Returns the trailing moving average of values over window points; the first window - 1 points average
+    the points available so far, and NaN values (ex: a diverged loss) are skipped rather than propagated
+
+    :param values: sequence of numbers
+    :param window: number of points averaged
+    :return: float64 NumPy array, the same length as values
+    """
+
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    if window <= 1 or len(values) == 0:
+        return values
+
+    finite = np.isfinite(values)
+    # one cumulative sum for the totals and one for the counts of finite values gives every window in O(n)
+    totals = np.concatenate(([0.0], np.cumsum(np.where(finite, values, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(finite)))
+    stops = np.arange(1, len(values) + 1)
+    starts = np.maximum(stops - window, 0)
+    window_counts = counts[stops] - counts[starts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(window_counts > 0, (totals[stops] - totals[starts]) / window_counts, np.nan)
+
+
+def downsample_min_max(values: Any, max_points: int) -> Any:
+
+    """
+    Returns the indexes of at most max_points values, keeping the first and last values and the minimum
+    and maximum of each of (max_points - 2) / 2 equal buckets, so spikes and dips are never dropped
+
+    :param values: sequence of numbers
+    :param max_points: maximum number of indexes returned; at least 4
+    :return: sorted int64 NumPy array of indexes
+    """
+
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) <= max_points:
+        return np.arange(len(values))
+
+    bucket_size = math.ceil(len(values) / max((max_points - 2) // 2, 1))
+    bucket_count = math.ceil(len(values) / bucket_size)
+    padding = bucket_count * bucket_size - len(values)
+    # non-finite values and padding are never chosen as a minimum or maximum unless a bucket has nothing else
+    for_min = np.concatenate((np.where(np.isfinite(values), values, np.inf), np.full(padding, np.inf)))
+    for_max = np.concatenate((np.where(np.isfinite(values), values, -np.inf), np.full(padding, -np.inf)))
+    offsets = np.arange(bucket_count) * bucket_size
+    min_indexes = offsets + for_min.reshape(bucket_count, bucket_size).argmin(axis=1)
+    max_indexes = offsets + for_max.reshape(bucket_count, bucket_size).argmax(axis=1)
+
+    indexes = np.unique(np.concatenate((min_indexes, max_indexes, [0, len(values) - 1])))
+    return indexes[indexes < len(values)]
+
+
+def downsample_lttb(values: Any, max_points: int) -> Any:
+
+    """
+    Returns the indexes of at most max_points values chosen with Largest-Triangle-Three-Buckets, which keeps
+    the visual shape of a line; values are first reduced to 4 * max_points with downsample_min_max,
+    so the time taken grows with max_points, not with the number of values
+
+    :param values: sequence of numbers
+    :param max_points: maximum number of indexes returned; at least 3
+    :return: sorted int64 NumPy array of indexes
+    """
+
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) <= max_points:
+        return np.arange(len(values))
+    if max_points < 3:
+        raise ValueError(f'max_points must be at least 3, not {max_points}')
+
+    candidates = downsample_min_max(values, 4 * max_points)
+    if len(candidates) <= max_points:
+        return candidates
+
+    x = candidates.astype(np.float64)
+    y = values[candidates]
+    finite = np.isfinite(y)
+    # the first and last points are always kept; the rest are split into max_points - 2 buckets
+    edges = np.linspace(1, len(candidates) - 1, max_points - 1).astype(np.int64)
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, len(candidates) - 1
+
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_start, next_stop = stop, edges[bucket + 2] if bucket + 2 < len(edges) else len(candidates)
+        next_finite = finite[next_start:next_stop]
+        next_x = x[next_start:next_stop].mean()
+        next_y = y[next_start:next_stop][next_finite].mean() if next_finite.any() else y[previous]
+        # twice the area of the triangle formed with the previous point and the mean of the next bucket
+        areas = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous])
+                       - (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        areas[~np.isfinite(areas)] = -1.0
+        previous = start + int(areas.argmax())
+        selected[bucket + 1] = previous
+
+    return candidates[selected]
@@ -0,0 +1,322 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+import ptmlib.events as pev
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # windows; msvcrt is used instead
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+class FileLock:
+
+    """
+    The FileLock class is an advisory, cross-process lock based on a lock file;
+    use it as a context manager, ex: with FileLock('cache/index.lock'): ...
+    """
+
+    def __init__(self, lock_path: str, timeout: float = None, poll_interval: float = 0.05):
+
+        """
+        :param lock_path: path of the lock file; created if it does not exist
+        :param timeout: maximum number of seconds to wait in acquire(); default is no limit
+        :param poll_interval: seconds between attempts while waiting
+        """
+
+        self.lock_path = lock_path
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._lock_file = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+
+        """
+        Acquire the lock
+
+        :param blocking: wait for the lock (up to timeout); if False, return immediately
+        :return: True if the lock was acquired; raises TimeoutError if timeout is exceeded
+        """
+
+        if self._lock_file is not None:
+            raise RuntimeError(f'lock is already held: {self.lock_path}')
+
+        lock_file = open(self.lock_path, 'a+')
+        start_time = time.monotonic()
+
+        while True:
+            if _try_lock(lock_file):
+                self._lock_file = lock_file
+                return True
+
+            if not blocking:
+                lock_file.close()
+                return False
+
+            if self.timeout is not None and time.monotonic() - start_time >= self.timeout:
+                lock_file.close()
+                raise TimeoutError(f'timed out after {self.timeout} seconds waiting for lock: {self.lock_path}')
+
+            time.sleep(self.poll_interval)
+
+    def release(self) -> None:
+
+        """
+        Release the lock
+        """
+
+        if self._lock_file is None:
+            return
+
+        _unlock(self._lock_file)
+        self._lock_file.close()
+        self._lock_file = None
+
+    @property
+    def locked(self) -> bool:
+        return self._lock_file is not None
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class SingleFlightLock:
+
+    """
+    The SingleFlightLock class lets one process at a time do a piece of work, such as fitting a model,
+    while other processes (on this machine or on a shared file system) wait for the result.
+    The owner creates an "in progress" marker file and refreshes it with a heartbeat from a background thread.
+    A marker whose owner process has exited (same host), or whose heartbeat has not changed for stale_seconds
+    (any host), is stale and is taken over. Marker changes are serialized with a FileLock.
+    """
+
+    def __init__(self, path: str, heartbeat_interval: float = 5.0, stale_seconds: float = 30.0,
+                 poll_interval: float = 0.5):
+
+        """
+        :param path: path the lock is for, ex: a model file name; the hidden files .{name}.lock and
+                     .{name}.inprogress are created in the same directory
+        :param heartbeat_interval: seconds between heartbeats while the lock is held
+        :param stale_seconds: seconds without a heartbeat after which a marker is stale; must be well above
+                              heartbeat_interval
+        :param poll_interval: seconds between checks while waiting
+        """
+
+        directory, name = os.path.split(path)
+        self.lock_path = os.path.join(directory, f'.{name}.lock')
+        self.marker_path = os.path.join(directory, f'.{name}.inprogress')
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_seconds = stale_seconds
+        self.poll_interval = poll_interval
+        self._marker: Optional[Dict[str, Any]] = None
+        self._heartbeat_stopped = threading.Event()
+        self._heartbeat_thread = None
+        self._observed_marker = None
+        self._observed_time = None
+
+    def acquire(self, timeout: float = None, is_done: Callable[[], bool] = None) -> bool:
+
+        """
+        Become the owner, or wait while another process is the owner
+
+        :param timeout: maximum seconds to wait for another owner; None waits until it finishes, 0 fails fast;
+                        raises TimeoutError when exceeded
+        :param is_done: function returning True when the work is already done, ex: the model file exists;
+                        checked whenever there is no owner
+        :return: True if this process is now the owner; False if is_done() returned True
+        """
+
+        if self._marker is not None:
+            raise RuntimeError(f'lock is already held: {self.marker_path}')
+
+        start_time = time.monotonic()
+        waiting = False
+        while True:
+            with FileLock(self.lock_path):
+                marker = self._read_marker()
+                if marker is not None and self._is_stale(marker):
+                    pev.emit('lock.stale', f'Removing stale lock: {self.marker_path} '
+                             f'(host {marker.get("host")}, pid {marker.get("pid")})',
+                             marker_path=self.marker_path, owner=marker)
+                    os.remove(self.marker_path)
+                    marker = None
+
+                # the owner may still be finishing the work, so is_done() is only trusted without an owner
+                if marker is None:
+                    if is_done is not None and is_done():
+                        return False
+                    self._create_marker()
+                    return True
+
+            if timeout is not None and time.monotonic() - start_time >= timeout:
+                raise TimeoutError(f'waited {timeout} seconds for host {marker.get("host")}, '
+                                   f'pid {marker.get("pid")} to release: {self.marker_path}')
+            if not waiting:
+                waiting = True
+                pev.emit('lock.wait', f'Waiting for host {marker.get("host")}, pid {marker.get("pid")}: '
+                         f'{self.marker_path}', marker_path=self.marker_path, owner=marker)
+            time.sleep(self.poll_interval)
+
+    def release(self) -> None:
+
+        """
+        Stop the heartbeat and remove the marker, unless another process has taken it over
+        """
+
+        if self._marker is None:
+            return
+
+        self._heartbeat_stopped.set()
+        if self._heartbeat_thread is not threading.current_thread():
+            self._heartbeat_thread.join()
+        with FileLock(self.lock_path):
+            current_marker = self._read_marker()
+            if current_marker is not None and current_marker.get('token') == self._marker['token']:
+                os.remove(self.marker_path)
+        self._marker = None
+
+    def owner(self) -> Optional[Dict[str, Any]]:
+
+        """
+        Returns the marker of the current owner: host, pid, token, started, heartbeat and time; None if not held
+
+        :return: dict or None
+        """
+
+        return self._read_marker()
+
+    @property
+    def locked(self) -> bool:
+        return self._marker is not None
+
+    def __enter__(self) -> 'SingleFlightLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+    def _create_marker(self) -> None:
+        now = time.time()
+        self._marker = {'host': socket.gethostname(), 'pid': os.getpid(), 'token': uuid.uuid4().hex,
+                        'started': now, 'heartbeat': 0, 'time': now}
+        self._write_marker()
+
+        self._heartbeat_stopped.clear()
+        self._heartbeat_thread = threading.Thread(target=self._run_heartbeat, name='ptmlib-heartbeat', daemon=True)
+        self._heartbeat_thread.start()
+
+    def _run_heartbeat(self) -> None:
+        marker = self._marker
+        while not self._heartbeat_stopped.wait(self.heartbeat_interval):
+            with FileLock(self.lock_path):
+                current_marker = self._read_marker()
+                if current_marker is None or current_marker.get('token') != marker['token']:
+                    # taken over after missing heartbeats, ex: the machine was suspended
+                    pev.emit('lock.lost', f'Lock was taken over by another process: {self.marker_path}',
+                             marker_path=self.marker_path, owner=current_marker)
+                    return
+                marker['heartbeat'] += 1
+                marker['time'] = time.time()
+                self._write_marker()
+
+    def _write_marker(self) -> None:
+        # the heartbeat count changes the content, which, unlike mtime, is not subject to attribute caching
+        temp_path = f'{self.marker_path}.{self._marker["token"]}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as marker_file:
+            json.dump(self._marker, marker_file)
+        os.replace(temp_path, self.marker_path)
+
+    def _read_marker(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.marker_path, 'r', encoding='utf-8') as marker_file:
+                return json.load(marker_file)
+        except (OSError, ValueError):
+            return None
+
+    def _is_stale(self, marker: Dict[str, Any]) -> bool:
+        if marker.get('host') == socket.gethostname() and not _is_process_running(marker.get('pid')):
+            return True
+
+        # staleness is measured with this process's clock, so clocks on other hosts do not need to agree
+        observed_marker = (marker.get('token'), marker.get('heartbeat'))
+        if observed_marker != self._observed_marker:
+            self._observed_marker = observed_marker
+            self._observed_time = time.monotonic()
+            return False
+
+        return time.monotonic() - self._observed_time >= self.stale_seconds
+
+
+def is_in_progress(directory: str) -> bool:
+
+    """
+    Returns True if any SingleFlightLock for a path in directory is held, ex: a model is being fit or saved there;
+    markers whose owner process has exited on this host are ignored
+
+    :param directory: directory of the locked paths
+    :return: bool
+    """
+
+    try:
+        file_names = os.listdir(directory)
+    except OSError:
+        return False
+
+    for file_name in file_names:
+        if not (file_name.startswith('.') and file_name.endswith('.inprogress')):
+            continue
+        marker = SingleFlightLock(os.path.join(directory, file_name[1:-len('.inprogress')])).owner()
+        if marker is not None and (marker.get('host') != socket.gethostname()
+                                   or _is_process_running(marker.get('pid'))):
+            return True
+
+    return False
+
+
+def _try_lock(lock_file) -> bool:
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(lock_file) -> None:
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _is_process_running(pid: int) -> bool:
+    if os.name != 'posix' or not isinstance(pid, int):
+        return True  # os.kill(pid, 0) would terminate the process on windows
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # running as another user
+
+    return True
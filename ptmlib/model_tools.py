@@ -1,15 +1,43 @@
+import abc
+import functools
+import inspect
+import json
 import os
-import pickle
-from typing import Any, List
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, List, Union
 
-import matplotlib.image as mpimg
-import matplotlib.pyplot as plt
-from tensorflow import keras
-
-import ptmlib.charts as pch
+# TensorFlow, matplotlib and ptmlib.callbacks/ptmlib.charts are imported by the functions that use them,
+# so importing model_tools stays fast
+import ptmlib.cache as pca
+import ptmlib.events as pev
+import ptmlib.fingerprint as fpr
+import ptmlib.history as phist
+import ptmlib.locks as plk
+import ptmlib.storage as pst
 from ptmlib.time import Stopwatch
 
-HISTORY_FILE_SUFFIX_EXTENSION = '_history.pkl'
+HISTORY_FILE_SUFFIX_EXTENSION = phist.HISTORY_PICKLE_SUFFIX_EXTENSION
+PROFILE_FILE_SUFFIX_EXTENSION = '_profile.json'
+MANIFEST_FILE_NAME = 'manifest.json'
+RESULT_FILE_SUFFIX_EXTENSION = '_result.json'
+
+# model_file_format -> (file extension, storage dtype) for weight archives; see save_model_file()
+WEIGHTS_FILE_FORMATS = {
+    'weights_npz': ('_weights.npz', None),
+    'weights_float16': ('_weights_float16.npz', 'float16'),
+    'weights_bfloat16': ('_weights_bfloat16.npz', 'bfloat16'),
+}
+
+# artifacts are written by a single background thread, in submission order
+_artifact_executor: ThreadPoolExecutor = None
+_artifact_futures: List[Future] = []
+_artifact_lock = threading.Lock()
+
+# models loaded by load_or_fit_model(memoize=True); set model_memo.max_models to change the capacity
+model_memo = pca.ModelMemo()
 
 
 def get_file_path(model_file_name: str, model_file_format: str = ""):
@@ -17,8 +45,33 @@ def get_file_path(model_file_name: str, model_file_format: str = ""):
     return f'{model_file_name}{extension}'
 
 
+def get_image_file_path(metric: str, model_file_name: str):
+    directory, base_name = os.path.split(model_file_name)
+    return os.path.join(directory, f'{metric}-{base_name}.png')
+
+
+def get_cache_entry_dir(cache_dir: str, model_file_name: str, cache_key: str):
+    return os.path.join(cache_dir, f'{os.path.basename(model_file_name)}-{cache_key}')
+
+
+def load_manifest(entry_dir: str):
+    manifest_path = os.path.join(entry_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+        return json.load(manifest_file)
+
+
+def _save_manifest(entry_dir: str, manifest: dict):
+    # write-then-rename so a partially written manifest is never treated as a cache hit
+    pst.write_json_atomic(manifest, os.path.join(entry_dir, MANIFEST_FILE_NAME))
+
+
 def _get_model_file_extension(model_file_format: str):
-    if model_file_format == "tf_saved_model":
+    if model_file_format in WEIGHTS_FILE_FORMATS:
+        extension = WEIGHTS_FILE_FORMATS[model_file_format][0]
+    elif model_file_format == "tf_saved_model":
         # no extension means we are using TensorFlow SavedModel format
         extension = ""
     else:
@@ -27,79 +80,800 @@ def _get_model_file_extension(model_file_format: str):
 
 
 def _default_load_model_function(model_file_name: str, model_file_format: str = ""):
+    from tensorflow import keras
+
     return keras.models.load_model(get_file_path(model_file_name, model_file_format))
 
 
-def _default_fit_model_function(model: Any, x: Any, y: Any = None, validation_data: Any = None, epochs: int = 1):
-    return model.fit(x, y, validation_data=validation_data, epochs=epochs)
+def save_model_file(model: Any, model_file_path: str, model_file_format: str = ""):
+
+    """
+    Saves a model with write-then-rename. Weight archive formats save only the weights, in a compressed .npz file:
+    "weights_npz" keeps float32, "weights_float16" and "weights_bfloat16" halve the size of the weights
+
+    :param model: Keras model
+    :param model_file_path: model file path, including extension; see get_file_path()
+    :param model_file_format: "" (.h5), "tf_saved_model", "weights_npz", "weights_float16" or "weights_bfloat16"
+    :return: storage metadata for weight archives (format, dtype, checksum), otherwise None
+    """
+
+    if model_file_format not in WEIGHTS_FILE_FORMATS:
+        pst.save_model_atomic(model, model_file_path)
+        return None
+
+    header = pst.write_weights_atomic(model.get_weights(), model_file_path, WEIGHTS_FILE_FORMATS[model_file_format][1])
+    return {'format': model_file_format, 'dtype': header['dtype'], 'checksum': header['checksum']}
+
+
+def load_model_file(model: Any, model_file_name: str, model_file_format: str = "",
+                    load_model_function=_default_load_model_function):
+
+    """
+    Loads a saved model. Weight archives are verified against their checksum, upcast to the original dtypes,
+    and loaded into model, which must have the same architecture; the optimizer state is not restored
+
+    :param model: Keras model; used for weight archive formats
+    :param model_file_name: model file name, without extension
+    :param model_file_format: see save_model_file()
+    :param load_model_function: function used for formats other than weight archives
+    :return: model
+    """
+
+    if model_file_format in WEIGHTS_FILE_FORMATS and load_model_function is _default_load_model_function:
+        model.set_weights(pst.read_weights(get_file_path(model_file_name, model_file_format)))
+        return model
+
+    return load_model_function(model_file_name, model_file_format)
+
+
+def find_warm_start_entry(cache_dir: Union[str, pca.ModelCache], model: Any, model_file_name: str = None):
+
+    """
+    Finds the cached model nearest to model, to warm start it: only entries whose weights have the same shapes
+    and dtypes are compatible; entries with the same model config (including optimizer, loss and metrics) come first,
+    then entries with the same model file name, then the newest entry
+
+    :param cache_dir: cache directory or ModelCache
+    :param model: built Keras model; models that are not built yet have no weights and match no entries
+    :param model_file_name: model file name; entries for other model file names are used if none match
+    :return: (entry directory, manifest), or None if no entry is compatible
+    """
+
+    cache = pca.get_model_cache(cache_dir)
+    weights_fingerprint = fpr.weights_fingerprint(model)
+    if weights_fingerprint is None:
+        return None
+
+    config_fingerprint = fpr.fingerprint_config(fpr.model_config(model))
+    base_name = os.path.basename(model_file_name) if model_file_name is not None else None
+    candidates = [(entry_name, manifest) for entry_name, manifest in cache.manifests().items()
+                  if manifest.get('weights_fingerprint') == weights_fingerprint and os.path.exists(get_file_path(
+                      os.path.join(cache.cache_dir, entry_name, manifest['model_file_name']),
+                      manifest['model_file_format']))]
+    if len(candidates) == 0:
+        return None
+
+    entry_name, manifest = max(candidates, key=lambda candidate: (
+        candidate[1].get('model_config_fingerprint') == config_fingerprint,
+        candidate[1].get('model_file_name') == base_name,
+        candidate[1].get('created', 0)))
+    return os.path.join(cache.cache_dir, entry_name), manifest
+
+
+def _load_warm_start_model(model: Any, entry_dir: str, manifest: dict, load_model_function,
+                           load_optimizer: bool) -> tuple:
+    parent_file_format = manifest['model_file_format']
+    parent_file_name = os.path.join(entry_dir, manifest['model_file_name'])
+
+    if parent_file_format in WEIGHTS_FILE_FORMATS:
+        # weight archives have no optimizer state
+        return load_model_file(model, parent_file_name, parent_file_format), False
+
+    parent_model = load_model_function(parent_file_name, parent_file_format)
+    if load_optimizer:
+        return parent_model, True
+
+    model.set_weights(parent_model.get_weights())
+    return model, False
+
+
+def _default_fit_model_function(model: Any, x: Any, y: Any = None, validation_data: Any = None, epochs: int = 1,
+                                **fit_kwargs):
+    # ptmlib.data.ArrayBatches pipelines are streamed through tf.data instead of being loaded into memory
+    if hasattr(x, 'to_dataset'):
+        x = x.to_dataset()
+    if hasattr(validation_data, 'to_dataset'):
+        validation_data = validation_data.to_dataset()
+    return model.fit(x, y, validation_data=validation_data, epochs=epochs, **fit_kwargs)
 
 
 def load_or_fit_model(model: Any, model_file_name: str, x: Any, y: Any = None, validation_data: Any = None,
                       epochs: int = 1, metrics: List[str] = None, images_enabled=True, fig_size: (int, int) = (10, 6),
                       model_file_format: str = "",
                       load_model_function=_default_load_model_function,
-                      fit_model_function=_default_fit_model_function):
+                      fit_model_function=_default_fit_model_function,
+                      cache_dir: Union[str, pca.ModelCache] = None, checkpoint_epochs: int = 0,
+                      async_save: bool = False, profile_enabled: bool = False, memoize: bool = False,
+                      data_fingerprint: str = None, single_flight: bool = False, wait_timeout: float = None,
+                      warm_start: bool = False, warm_start_epochs: int = None, warm_start_optimizer: bool = False,
+                      alert: bool = True):
+    if warm_start and cache_dir is None:
+        raise ValueError('warm_start requires cache_dir')
+    _check_fit_model_function(fit_model_function, checkpoint_epochs, profile_enabled)
+
     file_extension = _get_model_file_extension(model_file_format)
+    cache = None
+    entry_dir = None
+    cache_key = None
+
+    if cache_dir is not None:
+        # content-addressed cache: any change to model config, epochs or data results in a new entry
+        cache = pca.get_model_cache(cache_dir)
+        cache_key = fpr.fit_fingerprint(model, x, y, validation_data, epochs, data_fingerprint)
+        if warm_start:
+            # warm started models are kept apart from models fit from scratch with the same arguments
+            cache_key = fpr.fingerprint_config([cache_key, 'warm_start', warm_start_epochs, warm_start_optimizer])
+        entry_dir = get_cache_entry_dir(cache.cache_dir, model_file_name, cache_key)
+        model_file_name = os.path.join(entry_dir, os.path.basename(model_file_name))
 
-    if os.path.exists(f'{model_file_name}{file_extension}'):
-        print(f'Loading existing model file: {model_file_name}{file_extension}')
-        model = load_model_function(model_file_name, model_file_format)
+    model_file_path = f'{model_file_name}{file_extension}'
+    memoized = model_memo.get(model_file_path) if memoize else None
+
+    fit_lock = None
+    if memoized is None and single_flight:
+        # only one process fits a model; others wait for it to finish saving, then load the saved model
+        fit_lock = plk.SingleFlightLock(model_file_name)
+        if not _is_cached(model_file_name, file_extension, entry_dir) or fit_lock.owner() is not None:
+            if os.path.dirname(model_file_name):
+                os.makedirs(os.path.dirname(model_file_name), exist_ok=True)
+            if not fit_lock.acquire(wait_timeout, lambda: _is_cached(model_file_name, file_extension, entry_dir)):
+                fit_lock = None
+        else:
+            fit_lock = None
+
+    if memoized is not None:
+        # already loaded by this process and unchanged on disk; saved charts are not displayed again
+        pev.emit('load_or_fit_model.hit', f'Using loaded model: {model_file_path}', model_file_name=model_file_path,
+                 cache_key=cache_key, memoized=True)
+        model, history = memoized
+        if history is not None and profile_enabled and getattr(history, 'profile', None) is None:
+            history.profile = load_profile_data(model_file_name)
+        if cache is not None:
+            cache.record_hit(os.path.basename(entry_dir))
+    elif _is_cached(model_file_name, file_extension, entry_dir):
+        pev.emit('load_or_fit_model.hit', f'Loading existing model file: {model_file_path}',
+                 model_file_name=model_file_path, cache_key=cache_key, memoized=False)
+        load_start_time = time.perf_counter()
+        model = load_model_file(model, model_file_name, model_file_format, load_model_function)
         history = load_history_data(model_file_name)
+        if history is not None and profile_enabled:
+            history.profile = load_profile_data(model_file_name)
+        pev.emit('load_or_fit_model.loaded', model_file_name=model_file_path,
+                 load_seconds=time.perf_counter() - load_start_time)
+        if memoize:
+            model_memo.put(model_file_path, (model, history))
+        if cache is not None:
+            cache.record_hit(os.path.basename(entry_dir))
         if images_enabled:
             _show_saved_images(metrics, model_file_name, fig_size)
     else:
-        stopwatch = Stopwatch()
-        stopwatch.start()
-        history = fit_model_function(model, x, y, validation_data, epochs)
-        stopwatch.stop()
-        print(f'Saving new model file: {model_file_name}{file_extension}')
-        model.save(f'{model_file_name}{file_extension}')
-        save_history_data(history, model_file_name)
-        if images_enabled:
+        try:
+            pev.emit('load_or_fit_model.miss', model_file_name=model_file_path, cache_key=cache_key)
+            model_memo.invalidate(model_file_path)
+            if entry_dir is not None:
+                os.makedirs(entry_dir, exist_ok=True)
+            fit_epochs = epochs
+            warm_start_manifest = None
+            if warm_start:
+                parent_entry = find_warm_start_entry(cache, model, model_file_name)
+                if parent_entry is not None:
+                    parent_entry_dir, warm_start_manifest = parent_entry
+                    model, optimizer_loaded = _load_warm_start_model(model, parent_entry_dir, warm_start_manifest,
+                                                                     load_model_function, warm_start_optimizer)
+                    fit_epochs = epochs if warm_start_epochs is None else warm_start_epochs
+                    cache.record_hit(os.path.basename(parent_entry_dir))
+                    pev.emit('load_or_fit_model.warm_start',
+                             f'Warm starting from cache entry: {parent_entry_dir} '
+                             f'({warm_start_manifest.get("total_epochs", warm_start_manifest["epochs"])} epochs)',
+                             model_file_name=model_file_path, parent_entry_dir=parent_entry_dir,
+                             optimizer_loaded=optimizer_loaded, epochs=fit_epochs)
+            callbacks = []
+            if profile_enabled:
+                import ptmlib.callbacks as pcb
+
+                # the default fit function uses the Keras default batch size for in-memory arrays
+                batch_size = None
+                if fit_model_function is _default_fit_model_function and hasattr(x, 'shape'):
+                    batch_size = 32
+                batch_size = getattr(x, 'batch_size', batch_size)
+                profiling_callback = pcb.ProfilingCallback(batch_size=batch_size)
+                callbacks.append(profiling_callback)
+            stopwatch = Stopwatch()
+            stopwatch.start()
+            if checkpoint_epochs > 0:
+                # a checkpoint is only resumed by the same fit: model config, data, epochs and warm start
+                fit_key = cache_key or _get_fit_key(model, x, y, validation_data, epochs, data_fingerprint)
+                model, history = _fit_with_checkpoints(model, model_file_name, x, y, validation_data, fit_epochs,
+                                                       checkpoint_epochs, _get_checkpoint_format(model_file_format),
+                                                       load_model_function, fit_model_function, callbacks, fit_key)
+            elif len(callbacks) > 0:
+                history = fit_model_function(model, x, y, validation_data, fit_epochs, callbacks=callbacks)
+            else:
+                history = fit_model_function(model, x, y, validation_data, fit_epochs)
+            # the audio alert blocks until the sound has played; benchmarks and batch jobs pass alert=False
+            fit_seconds = stopwatch.stop(silent=not alert).wall_seconds
+            pev.emit('load_or_fit_model.fit', model_file_name=model_file_path, epochs=fit_epochs,
+                     fit_seconds=fit_seconds)
+            if profile_enabled:
+                history.profile = profiling_callback.profile
+            manifest = None
+            if entry_dir is not None:
+                manifest = {
+                    'cache_key': cache_key,
+                    'model_file_name': os.path.basename(model_file_name),
+                    'model_file_format': model_file_format,
+                    'epochs': epochs,
+                    'created': time.time(),
+                    'fit_seconds': fit_seconds,
+                    'model_config_fingerprint': fpr.fingerprint_config(fpr.model_config(model)),
+                    'weights_fingerprint': fpr.weights_fingerprint(model),
+                    'total_epochs': fit_epochs,
+                    'warm_start': None,
+                    'lineage': [],
+                }
+                if warm_start_manifest is not None:
+                    # lineage lists the cache keys of all ancestors, oldest first
+                    manifest['total_epochs'] += warm_start_manifest.get('total_epochs', warm_start_manifest['epochs'])
+                    manifest['warm_start'] = {'cache_key': warm_start_manifest['cache_key'],
+                                              'model_file_name': warm_start_manifest['model_file_name'],
+                                              'epochs': fit_epochs, 'optimizer_loaded': optimizer_loaded}
+                    manifest['lineage'] = warm_start_manifest.get('lineage', []) + [warm_start_manifest['cache_key']]
+            pev.emit('load_or_fit_model.save', f'Saving new model file: {model_file_path}',
+                     model_file_name=model_file_path, async_save=async_save)
+            save_function = functools.partial(_save_artifacts, model, history, model_file_name, model_file_format,
+                                              metrics, images_enabled, async_save,
+                                              checkpoint_epochs > 0, entry_dir, manifest, cache, fit_lock)
+            if async_save:
+                _submit_artifacts(save_function)
+            else:
+                save_function()
+                if memoize:
+                    model_memo.put(model_file_path, (model, history))
+        except BaseException:
+            if fit_lock is not None:
+                fit_lock.release()
+            raise
+
+    if cache_key is not None:
+        # evaluation caches identify the model by its cache key instead of reading its weights
+        fpr.set_model_fingerprint(model, cache_key)
+    return model, history
+
+
+class FitResult:
+
+    """
+    The FitResult class is the uniform result of load_or_fit() for every backend
+    """
+
+    def __init__(self, backend: str, history: dict = None, params: dict = None, fit_seconds: float = None,
+                 cached: bool = False):
+
+        """
+        :param backend: backend name; ex: keras, sklearn, callable
+        :param history: metric name to list of values; Keras training history, or scores for other backends
+        :param params: fit parameters; ex: Keras history.params
+        :param fit_seconds: wall clock seconds spent fitting the model, recorded when it was first fit
+        :param cached: True if the model was loaded instead of fit
+        """
+
+        self.backend = backend
+        self.history = history if history is not None else {}
+        self.params = params if params is not None else {}
+        self.fit_seconds = fit_seconds
+        self.cached = cached
+
+    def __repr__(self) -> str:
+        return f'FitResult(backend={self.backend!r}, metrics={list(self.history.keys())}, ' \
+               f'fit_seconds={self.fit_seconds}, cached={self.cached})'
+
+
+class ModelBackend(abc.ABC):
+
+    """
+    The ModelBackend class defines how load_or_fit() fits, saves and loads one kind of model;
+    subclass it and implement fit(), save() and load() to support other frameworks
+    """
+
+    name: str = 'base'
+    extension: str = ''
+
+    def get_file_path(self, model_file_name: str) -> str:
+        return f'{model_file_name}{self.extension}'
+
+    def get_cache_key(self, model: Any, x: Any, y: Any = None, validation_data: Any = None, epochs: int = 1) -> str:
+        config = {
+            'class_name': f'{type(model).__module__}.{type(model).__qualname__}',
+            'params': model.get_params(deep=True) if hasattr(model, 'get_params') else None,
+            'epochs': epochs,
+        }
+        return fpr.fingerprint_data([fpr.fingerprint_config(config), fpr.fingerprint_data((x, y, validation_data))])
+
+    @abc.abstractmethod
+    def fit(self, model: Any, x: Any, y: Any = None, validation_data: Any = None, epochs: int = 1) -> tuple:
+        """
+        Fit the model; returns (fitted model, history dict, params dict)
+        """
+
+    @abc.abstractmethod
+    def save(self, model: Any, model_file_name: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    def load(self, model_file_name: str) -> Any:
+        pass
+
+
+class KerasBackend(ModelBackend):
+
+    """
+    Saves and loads Keras models using the same formats and functions as load_or_fit_model()
+    """
+
+    name: str = 'keras'
+
+    def __init__(self, model_file_format: str = "", load_model_function=_default_load_model_function,
+                 fit_model_function=_default_fit_model_function):
+        self.model_file_format = model_file_format
+        self.extension = _get_model_file_extension(model_file_format)
+        self.load_model_function = load_model_function
+        self.fit_model_function = fit_model_function
+
+    def get_cache_key(self, model: Any, x: Any, y: Any = None, validation_data: Any = None, epochs: int = 1) -> str:
+        return fpr.fit_fingerprint(model, x, y, validation_data, epochs)
+
+    def fit(self, model: Any, x: Any, y: Any = None, validation_data: Any = None, epochs: int = 1) -> tuple:
+        history = self.fit_model_function(model, x, y, validation_data, epochs)
+        return model, history.history, history.params
+
+    def save(self, model: Any, model_file_name: str) -> None:
+        pst.save_model_atomic(model, self.get_file_path(model_file_name))
+
+    def load(self, model_file_name: str) -> Any:
+        return self.load_model_function(model_file_name, self.model_file_format)
+
+
+class SklearnBackend(ModelBackend):
+
+    """
+    Saves and loads scikit-learn estimators with joblib; uncompressed files are loaded memory-mapped,
+    so large models such as random forests are read lazily
+    """
+
+    name: str = 'sklearn'
+    extension: str = '.joblib'
+
+    def __init__(self, compress: int = 0, mmap_mode: str = 'r'):
+
+        """
+        :param compress: joblib compression level 0-9; compressed files are smaller but cannot be memory-mapped
+        :param mmap_mode: NumPy memory-map mode used to load uncompressed files; None loads them into memory
+        """
+
+        self.compress = compress
+        self.mmap_mode = mmap_mode
+
+    def fit(self, model: Any, x: Any, y: Any = None, validation_data: Any = None, epochs: int = 1) -> tuple:
+        model.fit(x, y)
+        history = {}
+        if validation_data is not None and hasattr(model, 'score'):
+            history['val_score'] = [float(model.score(*validation_data))]
+        return model, history, {'estimator_params': model.get_params(deep=False)}
+
+    def save(self, model: Any, model_file_name: str) -> None:
+        import joblib
+
+        file_path = self.get_file_path(model_file_name)
+        temp_path = pst.get_temp_path(file_path)
+        try:
+            joblib.dump(model, temp_path, compress=self.compress)
+            pst.replace_path(temp_path, file_path)
+        finally:
+            pst.remove_path(temp_path)
+
+    def load(self, model_file_name: str) -> Any:
+        import joblib
+
+        return joblib.load(self.get_file_path(model_file_name), mmap_mode=None if self.compress else self.mmap_mode)
+
+
+class CallableBackend(ModelBackend):
+
+    """
+    Fits any model using a callable: fit_function(x, y) returns the fitted model, which is saved with pickle
+    """
+
+    name: str = 'callable'
+    extension: str = '.pkl'
+
+    def __init__(self, fit_function=None):
+
+        """
+        :param fit_function: function(x, y) returning the fitted model; default calls model.fit(x, y)
+        """
+
+        self.fit_function = fit_function
+
+    def fit(self, model: Any, x: Any, y: Any = None, validation_data: Any = None, epochs: int = 1) -> tuple:
+        fitted_model = self.fit_function(x, y) if self.fit_function is not None else model.fit(x, y)
+        return fitted_model if fitted_model is not None else model, {}, {}
+
+    def save(self, model: Any, model_file_name: str) -> None:
+        pst.write_pickle_atomic(model, self.get_file_path(model_file_name))
+
+    def load(self, model_file_name: str) -> Any:
+        import pickle
+
+        with open(self.get_file_path(model_file_name), 'rb') as model_file:
+            return pickle.load(model_file)
+
+
+def get_backend(model: Any) -> ModelBackend:
+
+    """
+    Returns the default backend for a model: KerasBackend for Keras models, SklearnBackend for
+    scikit-learn estimators, otherwise CallableBackend
+
+    :param model: model or estimator
+    :return: ModelBackend
+    """
+
+    if hasattr(model, 'compile') and hasattr(model, 'save'):
+        return KerasBackend()
+    if hasattr(model, 'get_params') and hasattr(model, 'fit'):
+        return SklearnBackend()
+    return CallableBackend()
+
+
+def load_or_fit(model: Any, model_file_name: str, x: Any, y: Any = None, validation_data: Any = None,
+                epochs: int = 1, backend: ModelBackend = None, cache_dir: Union[str, pca.ModelCache] = None):
+
+    """
+    Fits and saves a model, or loads it if it has already been saved, for any supported framework;
+    unlike load_or_fit_model(), which is specific to Keras, this returns a uniform FitResult
+
+    :param model: Keras model, scikit-learn estimator, or any model supported by backend
+    :param model_file_name: model file name, without extension
+    :param x: training data
+    :param y: target data
+    :param validation_data: (x, y) validation data; scored after fitting for scikit-learn estimators
+    :param epochs: number of epochs; Keras only
+    :param backend: ModelBackend instance; default is based on the type of model, see get_backend()
+    :param cache_dir: if set, use a content-addressed cache directory or ModelCache, see load_or_fit_model()
+    :return: tuple of (model, FitResult)
+    """
+
+    backend = backend if backend is not None else get_backend(model)
+    cache = None
+    entry_dir = None
+    cache_key = None
+
+    if cache_dir is not None:
+        cache = pca.get_model_cache(cache_dir)
+        cache_key = backend.get_cache_key(model, x, y, validation_data, epochs)
+        entry_dir = get_cache_entry_dir(cache.cache_dir, model_file_name, cache_key)
+        model_file_name = os.path.join(entry_dir, os.path.basename(model_file_name))
+
+    result_path = f'{model_file_name}{RESULT_FILE_SUFFIX_EXTENSION}'
+
+    # the result file is written last; without it the model file may be incomplete
+    if os.path.exists(backend.get_file_path(model_file_name)) and os.path.exists(result_path):
+        pev.emit('load_or_fit.hit', f'Loading existing model file: {backend.get_file_path(model_file_name)}',
+                 model_file_name=backend.get_file_path(model_file_name), backend=backend.name, cache_key=cache_key)
+        model = backend.load(model_file_name)
+        saved_result = pst.read_json(result_path)
+        history_params_tuple = phist.read_history_data(model_file_name)
+        history, params = history_params_tuple if history_params_tuple is not None else ({}, {})
+        if cache is not None:
+            cache.record_hit(os.path.basename(entry_dir))
+            fpr.set_model_fingerprint(model, cache_key)
+        return model, FitResult(backend.name, history, params, saved_result['fit_seconds'], cached=True)
+
+    if entry_dir is not None:
+        os.makedirs(entry_dir, exist_ok=True)
+
+    stopwatch = Stopwatch(f'load_or_fit/{backend.name}')
+    stopwatch.start()
+    model, history, params = backend.fit(model, x, y, validation_data, epochs)
+    fit_seconds = stopwatch.stop(silent=True).wall_seconds
+
+    pev.emit('load_or_fit.save', f'Saving new model file: {backend.get_file_path(model_file_name)}',
+             model_file_name=backend.get_file_path(model_file_name), backend=backend.name, cache_key=cache_key,
+             fit_seconds=fit_seconds)
+    backend.save(model, model_file_name)
+    save_history_data(SimpleNamespace(history=history, params=params), model_file_name)
+    created = time.time()
+    pst.write_json_atomic({'backend': backend.name, 'cache_key': cache_key, 'fit_seconds': fit_seconds,
+                           'created': created}, result_path)
+
+    if entry_dir is not None:
+        _save_manifest(entry_dir, {
+            'cache_key': cache_key,
+            'model_file_name': os.path.basename(model_file_name),
+            'backend': backend.name,
+            'created': created,
+            'fit_seconds': fit_seconds,
+            'files': sorted(f for f in os.listdir(entry_dir) if not f.startswith('.')),
+        })
+        cache.record_insert(os.path.basename(entry_dir), fit_seconds)
+        fpr.set_model_fingerprint(model, cache_key)
+
+    return model, FitResult(backend.name, history, params, fit_seconds)
+
+
+def clear_model_memo(model_file_name: str = None, model_file_format: str = "") -> None:
+
+    """
+    Drops models memoized by load_or_fit_model(memoize=True), so the next call loads them from disk
+
+    :param model_file_name: model file name, as passed to load_or_fit_model(); default is all models
+    :param model_file_format: see load_or_fit_model
+    :return: None
+    """
+
+    model_memo.invalidate(None if model_file_name is None else get_file_path(model_file_name, model_file_format))
+
+
+def wait_for_artifacts(timeout: float = None) -> List[Any]:
+
+    """
+    Blocks until all artifacts submitted by load_or_fit_model(async_save=True) have been written
+
+    :param timeout: maximum number of seconds to wait for each pending save; default is no limit
+    :return: list of saved model file paths; raises the first error encountered by the background writer
+    """
+
+    with _artifact_lock:
+        futures = list(_artifact_futures)
+        _artifact_futures.clear()
+
+    return [future.result(timeout) for future in futures]
+
+
+def _submit_artifacts(save_function) -> Future:
+    global _artifact_executor
+
+    with _artifact_lock:
+        if _artifact_executor is None:
+            _artifact_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ptmlib-artifacts')
+        future = _artifact_executor.submit(save_function)
+        _artifact_futures.append(future)
+
+    return future
+
+
+def _save_artifacts(model: Any, history: Any, model_file_name: str, model_file_format: str, metrics: List[str],
+                    images_enabled: bool, background: bool, remove_checkpoint: bool, entry_dir: str = None,
+                    manifest: dict = None, cache: pca.ModelCache = None, fit_lock: plk.SingleFlightLock = None):
+    try:
+        return _write_artifacts(model, history, model_file_name, model_file_format, metrics, images_enabled,
+                                background, remove_checkpoint, entry_dir, manifest, cache)
+    finally:
+        # released once every artifact is written, so waiting processes find a complete model
+        if fit_lock is not None:
+            fit_lock.release()
+
+
+def _write_artifacts(model: Any, history: Any, model_file_name: str, model_file_format: str, metrics: List[str],
+                     images_enabled: bool, background: bool, remove_checkpoint: bool, entry_dir: str = None,
+                     manifest: dict = None, cache: pca.ModelCache = None):
+    model_file_path = get_file_path(model_file_name, model_file_format)
+    save_start_time = time.perf_counter()
+    model_storage = save_model_file(model, model_file_path, model_file_format)
+    save_history_data(history, model_file_name)
+    if getattr(history, 'profile', None) is not None:
+        save_profile_data(history.profile, model_file_name)
+    save_seconds = time.perf_counter() - save_start_time
+
+    if images_enabled:
+        import ptmlib.charts as pch
+
+        if background:
+            # pyplot is not thread-safe; render directly to image files instead of displaying
+            image_dir, file_name_suffix = os.path.split(model_file_name)
+            pch.save_history_charts(history, (metrics or []) + ["loss"], file_name_suffix, image_dir)
+        else:
             _show_new_images(history, model_file_name, metrics)
 
+    if remove_checkpoint:
+        import ptmlib.callbacks as pcb
+
+        pcb.remove_checkpoint(model_file_name, _get_model_file_extension(_get_checkpoint_format(model_file_format)))
+
+    if entry_dir is not None:
+        if model_storage is not None:
+            manifest['model_storage'] = model_storage
+        manifest['files'] = sorted(f for f in os.listdir(entry_dir) if not f.startswith('.'))
+        _save_manifest(entry_dir, manifest)
+        # only complete entries are indexed; inserting may evict older entries to stay within the cache limits
+        cache.record_insert(os.path.basename(entry_dir), manifest['fit_seconds'])
+
+    artifact_paths = (model_file_path, phist.get_history_arrays_path(model_file_name),
+                      f'{model_file_name}{HISTORY_FILE_SUFFIX_EXTENSION}',
+                      f'{model_file_name}{PROFILE_FILE_SUFFIX_EXTENSION}')
+    pev.emit('load_or_fit_model.saved', model_file_name=model_file_path, save_seconds=save_seconds,
+             artifact_bytes={os.path.basename(path): pca.get_size_bytes(path)
+                             for path in artifact_paths if os.path.exists(path)})
+
+    return model_file_path
+
+
+def _get_checkpoint_format(model_file_format: str):
+    # checkpoints keep the optimizer state, which weight archives do not store
+    return "" if model_file_format in WEIGHTS_FILE_FORMATS else model_file_format
+
+
+def _check_fit_model_function(fit_model_function, checkpoint_epochs: int, profile_enabled: bool):
+    # fail before fitting, rather than with a TypeError from a fit function written for plain fit() calls
+    required = []
+    if checkpoint_epochs > 0:
+        required = ['callbacks', 'initial_epoch']
+    elif profile_enabled:
+        required = ['callbacks']
+
+    missing = [name for name in required if not _accepts_keyword_argument(fit_model_function, name)]
+    if missing:
+        feature = 'checkpoint_epochs' if checkpoint_epochs > 0 else 'profile_enabled'
+        raise TypeError(f'fit_model_function must accept {" and ".join(missing)} keyword arguments '
+                        f'to use {feature}')
+
+
+def _accepts_keyword_argument(function, name: str) -> bool:
+    try:
+        parameters = inspect.signature(function).parameters.values()
+    except (TypeError, ValueError):
+        return True  # no signature available, ex: some builtins; assume it does
+
+    return any(parameter.kind == parameter.VAR_KEYWORD
+               or (parameter.name == name and parameter.kind != parameter.POSITIONAL_ONLY) for parameter in parameters)
+
+
+def _get_fit_key(model: Any, x: Any, y: Any, validation_data: Any, epochs: int, data_fingerprint: str = None):
+    try:
+        return fpr.fit_fingerprint(model, x, y, validation_data, epochs, data_fingerprint)
+    except TypeError:
+        # generators and other inputs that cannot be fingerprinted; pass data_fingerprint to include the data
+        return fpr.fit_fingerprint(model, None, epochs=epochs, data_fingerprint='')
+
+
+def _fit_with_checkpoints(model: Any, model_file_name: str, x: Any, y: Any, validation_data: Any, epochs: int,
+                          checkpoint_epochs: int, model_file_format: str, load_model_function, fit_model_function,
+                          callbacks: List = None, fit_key: str = None):
+    import ptmlib.callbacks as pcb
+
+    file_extension = _get_model_file_extension(model_file_format)
+
+    state = pcb.load_checkpoint_state(model_file_name)
+    initial_epoch = 0
+
+    if state is not None and state.get('fit_key') != fit_key:
+        pev.emit('load_or_fit_model.stale_checkpoint',
+                 f'Removing checkpoint of a different fit: {pcb.get_checkpoint_file_name(model_file_name)}'
+                 f'{file_extension}', model_file_name=model_file_name, epoch=state['epoch'])
+        pcb.remove_checkpoint(model_file_name, file_extension)
+        state = None
+
+    if state is not None:
+        checkpoint_file_name = pcb.get_checkpoint_file_name(model_file_name)
+        pev.emit('load_or_fit_model.resume',
+                 f'Resuming from checkpoint file: {checkpoint_file_name}{file_extension} (epoch {state["epoch"]})',
+                 model_file_name=f'{checkpoint_file_name}{file_extension}', epoch=state['epoch'])
+        model = load_model_function(checkpoint_file_name, model_file_format)
+        initial_epoch = state['epoch']
+
+    checkpoint_callback = pcb.CheckpointCallback(model_file_name, file_extension, checkpoint_epochs, state, fit_key)
+    history = fit_model_function(model, x, y, validation_data, epochs,
+                                 callbacks=(callbacks or []) + [checkpoint_callback], initial_epoch=initial_epoch)
+
+    if state is not None:
+        # return a single History covering all epochs, including those completed before the restart
+        history.history = pcb.merge_history_data(state['history'], history.history)
+        history.epoch = list(range(initial_epoch)) + list(history.epoch)
+
     return model, history
 
 
+def _is_cached(model_file_name: str, file_extension: str, entry_dir: str = None):
+    if not os.path.exists(f'{model_file_name}{file_extension}'):
+        return False
+
+    # the manifest is written last; without it the entry is incomplete
+    return entry_dir is None or os.path.exists(os.path.join(entry_dir, MANIFEST_FILE_NAME))
+
+
 def save_history_data(history: Any, model_file_name: str):
-    with open(f'{model_file_name}{HISTORY_FILE_SUFFIX_EXTENSION}', 'wb') as history_file:
+    arrays_path = phist.get_history_arrays_path(model_file_name)
+    pickle_path = f'{model_file_name}{HISTORY_FILE_SUFFIX_EXTENSION}'
+    try:
+        phist.save_history_arrays(history.history, history.params, arrays_path)
+        pst.remove_path(pickle_path)
+    except (TypeError, ValueError):
+        # metrics that are not numeric sequences can only be stored in the legacy pickle format;
+        # the .npz file of an earlier fit is removed, since read_history_data() prefers it
         history_params_tuple = (history.history, history.params)
-        pickle.dump(history_params_tuple, history_file)
+        pst.write_pickle_atomic(history_params_tuple, pickle_path)
+        pst.remove_path(arrays_path)
 
 
 def load_history_data(model_file_name: str):
-    if not os.path.exists(f'{model_file_name}{HISTORY_FILE_SUFFIX_EXTENSION}'):
+    history_params_tuple = phist.read_history_data(model_file_name)
+    if history_params_tuple is None:
         return None
 
-    # create new history object for return value
-    history = keras.callbacks.History()
+    try:
+        from tensorflow import keras
 
-    with open(f'{model_file_name}{HISTORY_FILE_SUFFIX_EXTENSION}', 'rb') as history_file:
-        # load from previously saved history_params_tuple
-        h, p = pickle.load(history_file)
-        history.history = h
-        history.params = p
+        # create new history object for return value; .npz metric arrays are read on first access
+        history = keras.callbacks.History()
+    except ImportError:
+        # models of other frameworks only need the history data
+        history = SimpleNamespace(epoch=[])
+    history.history, history.params = history_params_tuple
+    if isinstance(history.history, phist.LazyHistoryData):
+        history.epoch = list(range(history.history.epochs))
 
     return history
 
 
+def save_profile_data(profile: dict, model_file_name: str):
+    pst.write_json_atomic(profile, f'{model_file_name}{PROFILE_FILE_SUFFIX_EXTENSION}')
+
+
+def load_profile_data(model_file_name: str):
+    if not os.path.exists(f'{model_file_name}{PROFILE_FILE_SUFFIX_EXTENSION}'):
+        return None
+
+    with open(f'{model_file_name}{PROFILE_FILE_SUFFIX_EXTENSION}', 'r', encoding='utf-8') as profile_file:
+        return json.load(profile_file)
+
+
 def _show_new_images(history: Any, model_file_name: str, metrics: List[str]):
+    import ptmlib.charts as pch
+
+    image_dir, file_name_suffix = os.path.split(model_file_name)
+    if not pch.display_available():
+        # headless: render all charts on one reused figure instead of one pyplot figure per chart
+        for image_file_name in pch.save_history_charts(history, (metrics or []) + ["loss"], file_name_suffix,
+                                                       image_dir):
+            pev.emit('chart.saved', f'Saved image: {image_file_name}', image_file_name=image_file_name)
+        return
+
     if metrics is not None:
         for metric in metrics:
-            pch.show_history_chart(history, metric, save_fig_enabled=True, file_name_suffix=model_file_name)
-    pch.show_history_chart(history, "loss", save_fig_enabled=True, file_name_suffix=model_file_name)
+            pch.show_history_chart(history, metric, save_fig_enabled=True, file_name_suffix=file_name_suffix,
+                                   image_dir=image_dir)
+    pch.show_history_chart(history, "loss", save_fig_enabled=True, file_name_suffix=file_name_suffix,
+                           image_dir=image_dir)
 
 
 def _show_saved_images(metrics: List[str], model_file_name: str, fig_size: (int, int) = (10, 6)):
+    import ptmlib.charts as pch
+
+    if not pch.display_available():
+        return
+
     if metrics is not None:
         for metric in metrics:
-            if os.path.exists(f'{metric}-{model_file_name}.png'):
-                _show_saved_image(f'{metric}-{model_file_name}.png', fig_size)
-    if os.path.exists(f'loss-{model_file_name}.png'):
-        _show_saved_image(f'loss-{model_file_name}.png', fig_size)
+            if os.path.exists(get_image_file_path(metric, model_file_name)):
+                _show_saved_image(get_image_file_path(metric, model_file_name), fig_size)
+    if os.path.exists(get_image_file_path("loss", model_file_name)):
+        _show_saved_image(get_image_file_path("loss", model_file_name), fig_size)
 
 
 def _show_saved_image(filename: str, fig_size: (int, int) = (10, 6)):
+    import matplotlib.image as mpimg
+    import matplotlib.pyplot as plt
+
     image_data = mpimg.imread(filename)
     fig = plt.figure(figsize=fig_size)
     ax = plt.Axes(fig, [0., 0., 1., 1.])
@@ -107,3 +881,4 @@ def _show_saved_image(filename: str, fig_size: (int, int) = (10, 6)):
     plt.axis('off')
     plt.imshow(image_data)
     plt.show()
+    plt.close(fig)
@@ -0,0 +1,282 @@
+import os
+import sys
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+import ptmlib.events as pev
+from ptmlib.cpu import CpuCount
+
+try:
+    import resource  # not available on windows; peak RSS is omitted there
+except ImportError:
+    resource = None
+
+# series recorded for every sample; per-core utilization is stored separately
+SAMPLE_FIELDS = ('time', 'process_cpu_percent', 'system_cpu_percent', 'rss_bytes', 'read_bytes', 'write_bytes')
+
+
+class ResourceMonitor:
+
+    """
+    The ResourceMonitor class samples CPU utilization per core, process CPU time, memory (RSS and peak RSS)
+    and disk read/write bytes from /proc in a background thread. Samples are stored in a fixed-size ring buffer,
+    so a long-running task keeps only the most recent samples. Use start()/stop(), a with statement,
+    or Stopwatch(monitor=True). On systems without /proc, only process CPU time and peak RSS are reported.
+    """
+
+    def __init__(self, interval: float = 0.5, capacity: int = 3600, proc_root: str = '/proc'):
+
+        """
+        :param interval: seconds between samples; default is 0.5
+        :param capacity: maximum number of samples kept; older samples are overwritten
+        :param proc_root: proc file system path; for testing only
+        """
+
+        self.interval = interval
+        self.capacity = capacity
+        self.proc_root = proc_root
+        self.proc_available = os.path.exists(os.path.join(proc_root, 'stat'))
+        self._proc_fds: Dict[str, int] = {}
+        self.core_count = len(self._read_core_times()) if self.proc_available else 0
+        self._close_proc_files()
+
+        self._series = {field: array('d', bytes(8 * capacity)) for field in SAMPLE_FIELDS}
+        self._core_percent = array('d', bytes(8 * capacity * self.core_count))
+        self._sample_count = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._summary = None
+        # set by start(); None until the monitor has been started
+        self._start_time: Optional[float] = None
+        self._last_time: Optional[float] = None
+
+    def start(self) -> 'ResourceMonitor':
+
+        """
+        Start sampling in a background thread; previous samples are discarded
+
+        :return: self
+        """
+
+        if self._thread is not None:
+            raise RuntimeError('ResourceMonitor is already running')
+
+        self._sample_count = 0
+        self._summary = None
+        self._start_time = self._last_time = time.perf_counter()
+        self._start_process_cpu = self._last_process_cpu = self._read_process_cpu_seconds()
+        self._start_io = self._read_io_bytes()
+        self._last_core_times = self._read_core_times()
+        self._peak_sampled_rss = 0
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='ptmlib-monitor', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Dict[str, Any]:
+
+        """
+        Stop sampling, take a final sample, and return the summary
+
+        :return: dict, see summary()
+        """
+
+        if self._thread is None:
+            return self.summary()
+
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        self._sample()
+        self._summary = self._get_summary()
+        self._close_proc_files()
+        return self._summary
+
+    def __enter__(self) -> 'ResourceMonitor':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self._sample()
+
+    def _sample(self) -> None:
+        now = time.perf_counter()
+        process_cpu = self._read_process_cpu_seconds()
+        core_times = self._read_core_times()
+        rss_bytes, _ = self._read_memory_bytes()
+        read_bytes, write_bytes = self._read_io_bytes()
+
+        elapsed = max(now - self._last_time, 1e-9)
+        core_percent = [100.0 * (busy - last_busy) / (total - last_total) if total > last_total else 0.0
+                        for ((busy, total), (last_busy, last_total)) in zip(core_times, self._last_core_times)]
+        values = {
+            'time': now - self._start_time,
+            'process_cpu_percent': 100.0 * (process_cpu - self._last_process_cpu) / elapsed,
+            'system_cpu_percent': sum(core_percent) / len(core_percent) if core_percent else float('nan'),
+            'rss_bytes': rss_bytes,
+            'read_bytes': read_bytes - self._start_io[0],
+            'write_bytes': write_bytes - self._start_io[1],
+        }
+
+        with self._lock:
+            index = self._sample_count % self.capacity
+            for field, value in values.items():
+                self._series[field][index] = value
+            offset = index * self.core_count
+            self._core_percent[offset:offset + len(core_percent)] = array('d', core_percent)
+            self._sample_count += 1
+
+        self._last_time = now
+        self._last_process_cpu = process_cpu
+        self._last_core_times = core_times
+        self._peak_sampled_rss = max(self._peak_sampled_rss, rss_bytes)
+
+    def samples(self) -> Dict[str, List]:
+
+        """
+        Returns the samples in time order: time (seconds since start), process_cpu_percent (100 per busy core),
+        system_cpu_percent (mean of all cores), rss_bytes, read_bytes and write_bytes (since start),
+        and core_percent (one list of per-core utilization per sample)
+
+        :return: dict of lists
+        """
+
+        with self._lock:
+            count = min(self._sample_count, self.capacity)
+            first = self._sample_count - count
+            indexes = [(first + i) % self.capacity for i in range(count)]
+            samples = {field: [series[i] for i in indexes] for field, series in self._series.items()}
+            samples['core_percent'] = [self._core_percent[i * self.core_count:(i + 1) * self.core_count].tolist()
+                                       for i in indexes]
+
+        return samples
+
+    def summary(self) -> Dict[str, Any]:
+
+        """
+        Returns a summary of the samples: seconds, samples, process_cpu_seconds, mean_process_cpu_percent,
+        mean_busy_cores, max_core_percent, cpu_efficiency (process CPU time / CPU time available to the process),
+        rss_bytes, peak_rss_bytes, read_bytes and write_bytes; all zero or None if the monitor was never started
+
+        :return: dict
+        """
+
+        if self._summary is not None:
+            return self._summary
+        if self._start_time is None:
+            return {'seconds': 0.0, 'samples': 0, 'process_cpu_seconds': 0.0, 'mean_process_cpu_percent': 0.0,
+                    'mean_busy_cores': None, 'max_core_percent': None, 'cpu_efficiency': 0.0, 'rss_bytes': None,
+                    'peak_rss_bytes': None, 'read_bytes': None, 'write_bytes': None}
+
+        return self._get_summary()
+
+    def _get_summary(self) -> Dict[str, Any]:
+        samples = self.samples()
+        seconds = self._last_time - self._start_time
+        process_cpu_seconds = self._last_process_cpu - self._start_process_cpu
+        _, peak_rss_bytes = self._read_memory_bytes()
+        busy_cores = [sum(core_percent) / 100.0 for core_percent in samples['core_percent']]
+
+        return {
+            'seconds': seconds,
+            'samples': self._sample_count,
+            'process_cpu_seconds': process_cpu_seconds,
+            'mean_process_cpu_percent': 100.0 * process_cpu_seconds / seconds if seconds > 0 else 0.0,
+            'mean_busy_cores': sum(busy_cores) / len(busy_cores) if busy_cores else None,
+            'max_core_percent': max((max(core_percent) for core_percent in samples['core_percent']
+                                     if core_percent), default=None),
+            'cpu_efficiency': process_cpu_seconds / (seconds * CpuCount().total_count()) if seconds > 0 else 0.0,
+            'rss_bytes': samples['rss_bytes'][-1] if samples['rss_bytes'] else None,
+            'peak_rss_bytes': max(peak_rss_bytes or 0, self._peak_sampled_rss),
+            'read_bytes': samples['read_bytes'][-1] if samples['read_bytes'] else None,
+            'write_bytes': samples['write_bytes'][-1] if samples['write_bytes'] else None,
+        }
+
+    def print_summary(self) -> None:
+
+        """
+        Prints the summary
+        """
+
+        summary = self.summary()
+        lines = [f"CPU: {summary['process_cpu_seconds']:0.2f} seconds, "
+                 f"{summary['mean_process_cpu_percent']:0.0f}% of one core, "
+                 f"{summary['cpu_efficiency'] * 100:0.0f}% of available CPUs"]
+        if summary['mean_busy_cores'] is not None:
+            lines.append(f"System Busy Cores: {summary['mean_busy_cores']:0.1f} of {self.core_count} "
+                         f"(max core {summary['max_core_percent']:0.0f}%)")
+        if summary['peak_rss_bytes'] is not None:
+            lines.append(f"Peak RSS: {summary['peak_rss_bytes'] / 2 ** 20:0.1f} MB")
+        if summary['read_bytes'] is not None and self.proc_available:
+            lines.append(f"Disk Read/Write: {summary['read_bytes'] / 2 ** 20:0.1f} MB / "
+                         f"{summary['write_bytes'] / 2 ** 20:0.1f} MB")
+        pev.emit('monitor.summary', '\n'.join(lines), **summary)
+
+    def _read_proc(self, *path: str) -> Optional[str]:
+        # proc files stay open while sampling; pread() from offset 0 returns current values without reopening
+        file_path = os.path.join(self.proc_root, *path)
+        try:
+            if file_path not in self._proc_fds:
+                self._proc_fds[file_path] = os.open(file_path, os.O_RDONLY)
+            return os.pread(self._proc_fds[file_path], 65536, 0).decode('ascii', 'replace')
+        except OSError:
+            return None
+
+    def _close_proc_files(self) -> None:
+        for fd in self._proc_fds.values():
+            os.close(fd)
+        self._proc_fds.clear()
+
+    def _read_core_times(self) -> List[Tuple[int, int]]:
+        # (busy, total) jiffies per core; idle and iowait are not busy
+        stat = self._read_proc('stat') if self.proc_available else None
+        if stat is None:
+            return []
+
+        core_times = []
+        for line in stat.splitlines():
+            if line.startswith('cpu') and line[3:4].isdigit():
+                values = [int(value) for value in line.split()[1:]]
+                total = sum(values[:8])  # guest time is already included in user time
+                core_times.append((total - values[3] - (values[4] if len(values) > 4 else 0), total))
+        return core_times
+
+    def _read_process_cpu_seconds(self) -> float:
+        stat = self._read_proc('self', 'stat') if self.proc_available else None
+        if stat is None:
+            return time.process_time()
+
+        # fields after the command name, which may contain spaces; utime and stime are fields 14 and 15
+        fields = stat[stat.rindex(')') + 2:].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+    def _read_memory_bytes(self) -> Tuple[float, float]:
+        status = self._read_proc('self', 'status') if self.proc_available else None
+        if status is None:
+            if resource is None:
+                return float('nan'), 0
+            # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+            return float('nan'), peak
+
+        values = {}
+        for line in status.splitlines():
+            if line.startswith(('VmRSS:', 'VmHWM:')):
+                name, value = line.split(':', 1)
+                values[name] = int(value.split()[0]) * 1024
+        return values.get('VmRSS', float('nan')), values.get('VmHWM', 0)
+
+    def _read_io_bytes(self) -> Tuple[float, float]:
+        io_data = self._read_proc('self', 'io') if self.proc_available else None
+        if io_data is None:
+            return 0.0, 0.0
+
+        values = dict(line.split(': ', 1) for line in io_data.splitlines() if ': ' in line)
+        return float(values.get('read_bytes', 0)), float(values.get('write_bytes', 0))
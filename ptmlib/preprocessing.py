@@ -0,0 +1,152 @@
+import os
+import pickle
+from typing import Any, Callable, Tuple
+
+import ptmlib.events as pev
+import ptmlib.fingerprint as fpr
+import ptmlib.storage as pst
+
+TRANSFORMER_FILE_NAME = 'transformer.pkl'
+MANIFEST_FILE_NAME = 'manifest.json'
+
+
+def get_transformer_key(transformer: Any, x: Any) -> str:
+
+    """
+    Returns a cache key for fitting transformer on x, derived from the transformer class and params
+    and a fingerprint of x
+
+    :param transformer: unfitted scikit-learn estimator or transformer
+    :param x: data passed to fit()
+    :return: str
+    """
+
+    config = {
+        'class_name': f'{type(transformer).__module__}.{type(transformer).__qualname__}',
+        # objects without get_params() are reduced to their state by fingerprint_config()
+        'params': transformer.get_params(deep=True) if hasattr(transformer, 'get_params') else transformer,
+    }
+    hasher = fpr.new_hasher()
+    hasher.update(fpr.fingerprint_config(config).encode('ascii'))
+    hasher.update(fpr.fingerprint_data(x).encode('ascii'))
+    return hasher.hexdigest()
+
+
+def load_or_fit_transform(transformer: Any, transformer_file_name: str, x: Any, *transform_x: Any,
+                          cache_dir: str = '', mmap_mode: str = 'r') -> Tuple:
+
+    """
+    Fits a scikit-learn transformer (ex: PCA) with fit_transform(x) and transforms any additional inputs;
+    the fitted transformer and transformed arrays are cached, keyed by transformer params plus input fingerprints.
+    Transformed arrays are stored as .npy files and reopened memory-mapped, so repeat runs do not recompute
+    or copy them.
+
+    :param transformer: unfitted scikit-learn estimator or transformer
+    :param transformer_file_name: name used for the cache entry directory
+    :param x: data passed to fit_transform()
+    :param transform_x: additional data passed to transform(), ex: test data
+    :param cache_dir: directory for cache entries; default is the working directory
+    :param mmap_mode: NumPy memory-map mode used to open cached arrays; None loads them into memory
+    :return: tuple of (fitted transformer, transformed x, transformed transform_x...)
+    """
+
+    cache_key = get_transformer_key(transformer, x)
+    entry_dir = os.path.join(cache_dir, f'{transformer_file_name}-{cache_key}')
+    transformer_path = os.path.join(entry_dir, TRANSFORMER_FILE_NAME)
+    manifest_path = os.path.join(entry_dir, MANIFEST_FILE_NAME)
+    fit_array_name = 'fit_transform'
+
+    if os.path.exists(manifest_path):
+        pev.emit('preprocessing.hit', f'Loading existing transformer file: {transformer_path}', entry_dir=entry_dir,
+                 cache_key=cache_key)
+        manifest = pst.read_json(manifest_path)
+        with open(transformer_path, 'rb') as transformer_file:
+            transformer = pickle.load(transformer_file)
+        x_transformed = _load_array(entry_dir, fit_array_name, mmap_mode)
+    else:
+        os.makedirs(entry_dir, exist_ok=True)
+        x_transformed = transformer.fit_transform(x)
+        pev.emit('preprocessing.save', f'Saving new transformer file: {transformer_path}', entry_dir=entry_dir,
+                 cache_key=cache_key)
+        pst.write_pickle_atomic(transformer, transformer_path)
+        x_transformed = _save_array(x_transformed, entry_dir, fit_array_name, mmap_mode)
+        # the manifest is written last; without it the entry is incomplete
+        manifest = {'cache_key': cache_key, 'transformer': type(transformer).__name__, 'transform_arrays': []}
+        pst.write_json_atomic(manifest, manifest_path)
+
+    transformed = [x_transformed]
+    for data in transform_x:
+        # each additional input is cached by its own fingerprint; the fitted transformer is shared.
+        # only arrays recorded in the manifest are complete; files left by an interrupted run are overwritten
+        array_name = f'transform-{fpr.fingerprint_data(data)}'
+        transform_arrays = manifest.setdefault('transform_arrays', [])
+        if array_name in transform_arrays:
+            transformed.append(_load_array(entry_dir, array_name, mmap_mode))
+        else:
+            transformed.append(_save_array(transformer.transform(data), entry_dir, array_name, mmap_mode))
+            transform_arrays.append(array_name)
+            pst.write_json_atomic(manifest, manifest_path)
+
+    return (transformer, *transformed)
+
+
+def load_or_compute_arrays(array_file_name: str, compute_function: Callable[[], Tuple], cache_dir: str = '',
+                           mmap_mode: str = 'r') -> Tuple:
+
+    """
+    Returns the arrays produced by compute_function, computing and caching them on the first call only;
+    use for expensive data loading and conversion, ex: fetch_openml(). The cache is keyed by name only,
+    so delete the cached files (or change the name) if compute_function changes.
+
+    :param array_file_name: name used for the cache entry directory
+    :param compute_function: function with no arguments returning a tuple of arrays
+    :param cache_dir: directory for cache entries; default is the working directory
+    :param mmap_mode: NumPy memory-map mode used to open cached arrays; None loads them into memory
+    :return: tuple of arrays
+    """
+
+    entry_dir = os.path.join(cache_dir, array_file_name)
+    manifest_path = os.path.join(entry_dir, MANIFEST_FILE_NAME)
+
+    if os.path.exists(manifest_path):
+        pev.emit('preprocessing.hit', f'Loading existing array files: {entry_dir}', entry_dir=entry_dir)
+        count = pst.read_json(manifest_path)['count']
+        return tuple(_load_array(entry_dir, f'array_{index}', mmap_mode) for index in range(count))
+
+    arrays = compute_function()
+    os.makedirs(entry_dir, exist_ok=True)
+    pev.emit('preprocessing.save', f'Saving new array files: {entry_dir}', entry_dir=entry_dir)
+    arrays = tuple(_save_array(array, entry_dir, f'array_{index}', mmap_mode)
+                   for (index, array) in enumerate(arrays))
+    pst.write_json_atomic({'count': len(arrays)}, manifest_path)
+    return arrays
+
+
+def _save_array(array: Any, entry_dir: str, array_name: str, mmap_mode: str) -> Any:
+    import numpy as np
+
+    if hasattr(array, 'to_numpy'):
+        # pandas output (ex: set_output(transform="pandas")) is stored as a plain array
+        array = array.to_numpy()
+
+    if not isinstance(array, np.ndarray) or array.dtype.hasobject:
+        # sparse matrices and object arrays cannot be memory-mapped
+        pst.write_pickle_atomic(array, os.path.join(entry_dir, f'{array_name}.pkl'))
+        # _load_array() prefers .npy files; remove one left by an interrupted run
+        pst.remove_path(os.path.join(entry_dir, f'{array_name}.npy'))
+        return array
+
+    array_path = os.path.join(entry_dir, f'{array_name}.npy')
+    pst.write_array_atomic(array, array_path)
+    return np.load(array_path, mmap_mode=mmap_mode) if mmap_mode else array
+
+
+def _load_array(entry_dir: str, array_name: str, mmap_mode: str) -> Any:
+    import numpy as np
+
+    array_path = os.path.join(entry_dir, f'{array_name}.npy')
+    if os.path.exists(array_path):
+        return np.load(array_path, mmap_mode=mmap_mode, allow_pickle=False)
+
+    with open(os.path.join(entry_dir, f'{array_name}.pkl'), 'rb') as array_file:
+        return pickle.load(array_file)
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import threading
+from typing import Any, Dict, List
+
+
+def get_temp_path(file_path: str) -> str:
+
+    """
+    Returns a hidden temporary path next to file_path, keeping the file extension
+    so that format detection (ex: .h5) still applies when saving
+
+    :param file_path: final file or directory path
+    :return: str
+    """
+
+    directory, file_name = os.path.split(file_path)
+    root, extension = os.path.splitext(file_name)
+    return os.path.join(directory, f'.{root}.tmp-{os.getpid()}-{threading.get_ident()}{extension}')
+
+
+def replace_path(temp_path: str, file_path: str) -> None:
+
+    """
+    Moves a fully written file or directory into place; os.replace() is atomic for files,
+    directories (ex: TensorFlow SavedModel) must remove an existing target first
+
+    :param temp_path: path of the completed temporary file or directory
+    :param file_path: final file or directory path
+    :return: None
+    """
+
+    if os.path.isdir(temp_path) and os.path.isdir(file_path):
+        shutil.rmtree(file_path)
+    os.replace(temp_path, file_path)
+
+
+def remove_path(path: str) -> None:
+
+    """
+    Removes a file or directory if it exists
+
+    :param path: file or directory path
+    :return: None
+    """
+
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def save_model_atomic(model: Any, file_path: str) -> None:
+
+    """
+    Saves a Keras model with write-then-rename, so a crash never leaves a partial model at file_path
+
+    :param model: Keras model
+    :param file_path: model file path, including extension
+    :return: None
+    """
+
+    temp_path = get_temp_path(file_path)
+    try:
+        model.save(temp_path)
+        replace_path(temp_path, file_path)
+    finally:
+        remove_path(temp_path)
+
+
+def write_json_atomic(data: Any, file_path: str) -> None:
+
+    """
+    Writes JSON data with write-then-rename
+
+    :param data: JSON-compatible data
+    :param file_path: JSON file path
+    :return: None
+    """
+
+    temp_path = get_temp_path(file_path)
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as json_file:
+            json.dump(data, json_file, indent=2, sort_keys=True)
+        os.replace(temp_path, file_path)
+    finally:
+        remove_path(temp_path)
+
+
+def write_pickle_atomic(data: Any, file_path: str) -> None:
+
+    """
+    Pickles data with write-then-rename
+
+    :param data: picklable object
+    :param file_path: pickle file path
+    :return: None
+    """
+
+    temp_path = get_temp_path(file_path)
+    try:
+        with open(temp_path, 'wb') as pickle_file:
+            pickle.dump(data, pickle_file)
+        os.replace(temp_path, file_path)
+    finally:
+        remove_path(temp_path)
+
+
+def write_array_atomic(array: Any, file_path: str) -> None:
+
+    """
+    Saves a NumPy array in .npy format with write-then-rename; the file can be reopened with
+    numpy.load(file_path, mmap_mode='r') without reading it into memory
+
+    :param array: NumPy array
+    :param file_path: .npy file path
+    :return: None
+    """
+
+    import numpy as np
+
+    temp_path = get_temp_path(file_path)
+    try:
+        with open(temp_path, 'wb') as array_file:
+            np.save(array_file, array, allow_pickle=False)
+        os.replace(temp_path, file_path)
+    finally:
+        remove_path(temp_path)
+
+
+# storage dtypes for weight archives; None keeps the dtype of each array
+WEIGHTS_DTYPES = (None, 'float16', 'bfloat16')
+
+_WEIGHTS_HEADER_KEY = 'header'
+_WEIGHTS_FORMAT_VERSION = 1
+
+
+def write_weights_atomic(weights: List[Any], file_path: str, dtype: str = None,
+                         compress: bool = True) -> Dict[str, Any]:
+
+    """
+    Saves a list of weight arrays (ex: model.get_weights()) as a .npz archive with write-then-rename.
+    Floating point arrays may be stored as float16 or bfloat16, halving their size; read_weights() upcasts them
+    to their original dtype. A JSON header in the archive records the format, dtypes and a checksum.
+
+    :param weights: list of NumPy arrays
+    :param file_path: .npz file path
+    :param dtype: storage dtype for floating point arrays: None (unchanged), 'float16' or 'bfloat16';
+                  float16 keeps more precision but raises ValueError for values beyond +/-65504,
+                  bfloat16 keeps the float32 range
+    :param compress: compress the archive with zlib
+    :return: header dict: format_version, dtype, compressed, dtypes, checksum
+    """
+
+    import numpy as np
+
+    if dtype not in WEIGHTS_DTYPES:
+        raise ValueError(f'dtype must be one of {WEIGHTS_DTYPES}, not {dtype!r}')
+
+    hasher = hashlib.sha256()
+    arrays = {}
+    dtypes = []
+    for index, array in enumerate(weights):
+        array = np.asarray(array)
+        dtypes.append(array.dtype.str)
+        if dtype is not None and np.issubdtype(array.dtype, np.floating):
+            array = _to_bfloat16_bits(array) if dtype == 'bfloat16' else _to_float16(array)
+        array = np.ascontiguousarray(array)
+        hasher.update(array.data.cast('B'))
+        arrays[f'weights_{index}'] = array
+
+    header = {
+        'format_version': _WEIGHTS_FORMAT_VERSION,
+        'dtype': dtype,
+        'compressed': compress,
+        'dtypes': dtypes,
+        'checksum': f'sha256:{hasher.hexdigest()}',
+    }
+    arrays[_WEIGHTS_HEADER_KEY] = np.frombuffer(json.dumps(header).encode('utf-8'), dtype=np.uint8)
+
+    temp_path = get_temp_path(file_path)
+    try:
+        with open(temp_path, 'wb') as weights_file:
+            (np.savez_compressed if compress else np.savez)(weights_file, **arrays)
+        os.replace(temp_path, file_path)
+    finally:
+        remove_path(temp_path)
+
+    return header
+
+
+def read_weights(file_path: str, verify: bool = True) -> List[Any]:
+
+    """
+    Reads a weight archive saved by write_weights_atomic(), upcasting reduced precision arrays to their original dtype
+
+    :param file_path: .npz file path
+    :param verify: compare the stored arrays with the checksum in the header; raises ValueError if they differ
+    :return: list of NumPy arrays, ex: for model.set_weights()
+    """
+
+    import numpy as np
+
+    with np.load(file_path, allow_pickle=False) as npz_file:
+        header = json.loads(npz_file[_WEIGHTS_HEADER_KEY].tobytes().decode('utf-8'))
+        stored_arrays = [npz_file[f'weights_{index}'] for index in range(len(header['dtypes']))]
+
+    if verify:
+        hasher = hashlib.sha256()
+        for array in stored_arrays:
+            hasher.update(np.ascontiguousarray(array).data.cast('B'))
+        if f'sha256:{hasher.hexdigest()}' != header['checksum']:
+            raise ValueError(f'Weights checksum does not match, the file is corrupt: {file_path}')
+
+    weights = []
+    for array, original_dtype in zip(stored_arrays, header['dtypes']):
+        if header['dtype'] == 'bfloat16' and array.dtype == np.uint16 and np.dtype(original_dtype).kind == 'f':
+            array = (array.astype(np.uint32) << 16).view(np.float32)
+        weights.append(array.astype(original_dtype, copy=False))
+
+    return weights
+
+
+def read_weights_header(file_path: str) -> Dict[str, Any]:
+
+    """
+    Reads only the JSON header of a weight archive
+
+    :param file_path: .npz file path
+    :return: header dict, see write_weights_atomic()
+    """
+
+    import numpy as np
+
+    with np.load(file_path, allow_pickle=False) as npz_file:
+        return json.loads(npz_file[_WEIGHTS_HEADER_KEY].tobytes().decode('utf-8'))
+
+
+def _to_float16(array: Any) -> Any:
+    import numpy as np
+
+    with np.errstate(over='ignore'):
+        half = array.astype(np.float16)
+    if np.any(np.isinf(half) & np.isfinite(array)):
+        raise ValueError('weights exceed the float16 range of +/-65504; use bfloat16 instead')
+    return half
+
+
+def _to_bfloat16_bits(array: Any) -> Any:
+    # bfloat16 is the upper half of a float32; round to nearest even, and keep NaN as NaN
+    import numpy as np
+
+    bits = array.astype(np.float32).view(np.uint32)
+    rounded = (bits + np.uint32(0x7FFF) + ((bits >> 16) & np.uint32(1))) >> 16
+    return np.where(np.isnan(array), np.uint16(0x7FC0), rounded.astype(np.uint16))
+
+
+def read_json(file_path: str) -> Any:
+
+    """
+    Reads a JSON file
+
+    :param file_path: JSON file path
+    :return: JSON data
+    """
+
+    with open(file_path, 'r', encoding='utf-8') as json_file:
+        return json.load(json_file)
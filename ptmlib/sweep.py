@@ -0,0 +1,172 @@
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Union
+
+import ptmlib.events as pev
+import ptmlib.fingerprint as fpr
+import ptmlib.history as phist
+import ptmlib.model_tools as modt
+from ptmlib.cpu import CpuCount, ThreadBudget
+
+# training data, set once per worker process by _init_worker
+_worker_data: Dict[str, Any] = {}
+
+
+def expand_grid(param_grid: Union[Dict[str, List], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+
+    """
+    Returns a list of configs for every combination of values in param_grid;
+    a list of dicts is returned as-is
+
+    :param param_grid: dict of parameter name to list of values, ex: {'units': [64, 128], 'dropout': [0.2]}
+    :return: list of config dicts
+    """
+
+    if isinstance(param_grid, dict):
+        names = sorted(param_grid.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*(param_grid[name] for name in names))]
+    return [dict(config) for config in param_grid]
+
+
+def get_config_file_name(model_file_name: str, config: Dict[str, Any]) -> str:
+
+    """
+    Returns the model file name used for a config; equal configs always map to the same name
+
+    :param model_file_name: base model file name
+    :param config: config dict
+    :return: str
+    """
+
+    return f'{model_file_name}-{fpr.fingerprint_config(config)[:12]}'
+
+
+def run_sweep(model_function: Callable[[Dict[str, Any]], Any], param_grid: Union[Dict[str, List], List[Dict]],
+              model_file_name: str, x: Any, y: Any = None, validation_data: Any = None, epochs: int = 1,
+              output_dir: str = '', model_file_format: str = "", fit_model_function: Callable = None,
+              max_workers: int = None, threads_per_worker: int = None,
+              excluded_percent: float = CpuCount._default_excluded_percent, data_fingerprint: str = None) -> Any:
+
+    """
+    Runs load_or_fit_model for every config in param_grid across a pool of worker processes;
+    models are cached in output_dir with the same keys as load_or_fit_model(cache_dir=...), so configs already fit
+    with the same model config, data and epochs are not refit. The pool is sized from CpuCount, and each worker's
+    BLAS/OpenMP/TensorFlow thread pools are capped so that workers x threads does not exceed the budget
+
+    :param model_function: top-level function returning a compiled model for a config dict; must be picklable
+    :param param_grid: dict of parameter lists, or list of config dicts; an 'epochs' key overrides epochs
+    :param model_file_name: base model file name; a config fingerprint is appended per config
+    :param x: training data, sent once to each worker
+    :param y: target data
+    :param validation_data: validation data passed to fit()
+    :param epochs: number of epochs
+    :param output_dir: cache directory for model, history and image files; default is the working directory
+    :param model_file_format: see load_or_fit_model
+    :param fit_model_function: top-level fit function; see load_or_fit_model
+    :param max_workers: number of worker processes; default is based on CpuCount and the number of configs
+    :param threads_per_worker: thread limit per worker; default divides the CPU budget evenly between workers
+    :param excluded_percent: percent of CPUs to keep free; default is 0.25
+    :param data_fingerprint: if set, used instead of fingerprinting x, y and validation_data; see load_or_fit_model
+    :return: pandas DataFrame with one row per config: config values, file name, cached, seconds, metrics
+    """
+
+    import pandas as pd
+
+    return pd.DataFrame(_run_configs(model_function, expand_grid(param_grid), model_file_name, x, y, validation_data,
+                                     epochs, output_dir, model_file_format, fit_model_function, max_workers,
+                                     threads_per_worker, excluded_percent, data_fingerprint))
+
+
+def _run_configs(model_function: Callable, configs: List[Dict[str, Any]], model_file_name: str, x: Any, y: Any,
+                 validation_data: Any, epochs: int, output_dir: str, model_file_format: str,
+                 fit_model_function: Callable, max_workers: int, threads_per_worker: int, excluded_percent: float,
+                 data_fingerprint: str = None) -> List[Dict[str, Any]]:
+    cache_dir = output_dir or '.'
+    os.makedirs(cache_dir, exist_ok=True)
+    if data_fingerprint is None:
+        # hashed once here, instead of by every worker
+        data_fingerprint = fpr.fingerprint_data([x, y, validation_data])
+
+    rows = []
+    pending = []
+    for config in configs:
+        config_file_name = get_config_file_name(model_file_name, config)
+        config_epochs = config.get('epochs', epochs)
+        # the same key as load_or_fit_model(cache_dir=...), so changes to the model, data or epochs are refit
+        cache_key = fpr.fit_fingerprint(model_function(config), None, epochs=config_epochs,
+                                        data_fingerprint=data_fingerprint)
+        entry_dir = modt.get_cache_entry_dir(cache_dir, config_file_name, cache_key)
+        entry_file_name = os.path.join(entry_dir, os.path.basename(config_file_name))
+        if modt._is_cached(entry_file_name, modt._get_model_file_extension(model_file_format), entry_dir):
+            rows.append(_get_result_row(config, entry_file_name, cached=True, seconds=0.0))
+        else:
+            pending.append((config, config_file_name, entry_file_name, config_epochs))
+
+    cpu_budget = CpuCount().adjusted_count_by_percent(excluded_percent)
+    max_workers = max(1, min(max_workers or cpu_budget, len(pending) or 1))
+    threads_per_worker = threads_per_worker or max(1, cpu_budget // max_workers)
+
+    pev.emit('sweep.configs', f'Sweep configs: {len(configs)} ({len(configs) - len(pending)} cached, '
+             f'{len(pending)} to fit)', configs=len(configs), pending=len(pending))
+    if len(pending) > 0:
+        pev.emit('sweep.workers', f'Sweep workers: {max_workers} x {threads_per_worker} threads',
+                 max_workers=max_workers, threads_per_worker=threads_per_worker)
+
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker,
+                                 initargs=(threads_per_worker, x, y, validation_data)) as executor:
+            futures = {executor.submit(_fit_config, model_function, fit_model_function, config, config_file_name,
+                                       config_epochs, model_file_format, cache_dir, data_fingerprint):
+                       (config, entry_file_name)
+                       for (config, config_file_name, entry_file_name, config_epochs) in pending}
+
+            for future in as_completed(futures):
+                config, entry_file_name = futures[future]
+                try:
+                    seconds = future.result()
+                    rows.append(_get_result_row(config, entry_file_name, cached=False, seconds=seconds))
+                except Exception as ex:
+                    # one failing config must not discard the rest of the sweep
+                    pev.emit('sweep.failed', f'Sweep config failed: {entry_file_name}: {ex!r}',
+                             file_name=entry_file_name, error=repr(ex))
+                    rows.append({**config, 'file_name': entry_file_name, 'cached': False, 'error': repr(ex)})
+
+    return rows
+
+
+def _get_result_row(config: Dict[str, Any], config_file_name: str, cached: bool, seconds: float) -> Dict[str, Any]:
+    row = {**config, 'file_name': config_file_name, 'cached': cached, 'seconds': seconds}
+
+    history_params_tuple = phist.read_history_data(config_file_name)
+    if history_params_tuple is not None:
+        history_data, _ = history_params_tuple
+        for metric in history_data.keys():
+            values = history_data[metric]
+            row['epochs_run'] = len(values)
+            row[metric] = float(values[-1]) if len(values) > 0 else None
+
+    return row
+
+
+def _init_worker(threads_per_worker: int, x: Any, y: Any, validation_data: Any) -> None:
+    # applied for the life of the worker, before TensorFlow creates its thread pools;
+    # NumPy may already be loaded to unpickle the data, so BLAS pools are resized with threadpoolctl if installed
+    ThreadBudget(threads_per_worker, silent=True).apply()
+
+    _worker_data.update(x=x, y=y, validation_data=validation_data)
+
+
+def _fit_config(model_function: Callable, fit_model_function: Callable, config: Dict[str, Any],
+                config_file_name: str, epochs: int, model_file_format: str, cache_dir: str,
+                data_fingerprint: str) -> float:
+    start_time = time.perf_counter()
+    model = model_function(config)
+    modt.load_or_fit_model(model, config_file_name, _worker_data['x'], _worker_data['y'],
+                           _worker_data['validation_data'], epochs=epochs, images_enabled=False,
+                           model_file_format=model_file_format,
+                           fit_model_function=fit_model_function or modt._default_fit_model_function,
+                           cache_dir=cache_dir, data_fingerprint=data_fingerprint)
+    return time.perf_counter() - start_time
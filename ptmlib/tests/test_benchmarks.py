@@ -0,0 +1,47 @@
+import contextlib
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import ptmlib.benchmarks as pbench
+import ptmlib.time as ptime
+
+tensorflow_available = importlib.util.find_spec('tensorflow') is not None
+
+
+class BenchmarksTestCase(unittest.TestCase):
+
+    def test_run_benchmarks(self):
+        results = pbench.run_benchmarks(['stopwatch'], repeat=1, keyword='section')
+        self.assertEqual({'stopwatch.section', 'stopwatch.section_disabled'}, set(results['results']))
+        self.assertGreater(results['results']['stopwatch.section']['seconds'], 0)
+
+    def test_compare_results(self):
+        baseline = {'results': {'fast': {'seconds': 1.0}, 'slow': {'seconds': 1.0}, 'removed': {'seconds': 1.0}}}
+        results = {'results': {'fast': {'seconds': 1.1}, 'slow': {'seconds': 1.5}, 'added': {'seconds': 1.0}}}
+
+        regressions = pbench.compare_results(results, baseline, threshold=0.2)
+        self.assertEqual(['slow'], [regression['name'] for regression in regressions])
+        self.assertAlmostEqual(0.5, regressions[0]['change'])
+
+    def test_main_with_baseline(self):
+        with tempfile.TemporaryDirectory() as temp_dir, contextlib.redirect_stdout(io.StringIO()):
+            output_path = os.path.join(temp_dir, 'results.json')
+            self.assertEqual(0, pbench.main(['stopwatch', '-k', 'disabled', '-r', '1', '-o', output_path]))
+            self.assertEqual(0, pbench.main(['stopwatch', '-k', 'disabled', '-r', '1', '-b', output_path,
+                                             '-t', '100']))
+
+    @unittest.skipUnless(tensorflow_available, 'requires tensorflow')
+    def test_keras_benchmarks_are_silent(self):
+        audio_backends = (mock.Mock(), mock.Mock(), mock.Mock())
+        with mock.patch.object(ptime, '_get_audio_backends', return_value=audio_backends):
+            pbench.run_benchmarks(['keras'], repeat=1)
+        for audio_backend in audio_backends:
+            self.assertEqual([], audio_backend.mock_calls, 'timed fits should not play the stopwatch alert')
+
+
+if __name__ == '__main__':
+    unittest.main()
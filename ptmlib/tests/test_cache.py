@@ -0,0 +1,177 @@
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+
+import ptmlib.cache as pcache
+from ptmlib.cache import ModelCache, ModelMemo, main
+from ptmlib.locks import SingleFlightLock
+from ptmlib.storage import write_json_atomic
+
+
+def write_entry(cache_dir: str, entry_name: str, size_bytes: int = 100, fit_seconds: float = 1.0) -> None:
+    entry_dir = os.path.join(cache_dir, entry_name)
+    os.makedirs(entry_dir, exist_ok=True)
+    with open(os.path.join(entry_dir, 'model.h5'), 'wb') as model_file:
+        model_file.write(b'\0' * size_bytes)
+    write_json_atomic({'created': time.time(), 'fit_seconds': fit_seconds, 'files': ['model.h5']},
+                      os.path.join(entry_dir, 'manifest.json'))
+
+
+def insert_entries(cache_dir: str, worker: int) -> None:
+    cache = ModelCache(cache_dir)
+    for index in range(5):
+        entry_name = f'model-{worker}-{index}'
+        write_entry(cache_dir, entry_name)
+        cache.record_insert(entry_name, 1.0)
+
+
+class ModelCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def insert(self, cache: ModelCache, entry_name: str, fit_seconds: float = 1.0):
+        write_entry(self.cache_dir, entry_name, fit_seconds=fit_seconds)
+        return cache.record_insert(entry_name, fit_seconds)
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = ModelCache(self.cache_dir, max_entries=2)
+        self.insert(cache, 'a')
+        self.insert(cache, 'b')
+        cache.record_hit('a')
+        evicted = self.insert(cache, 'c')
+
+        self.assertEqual(['b'], evicted)
+        self.assertEqual({'a', 'c'}, set(cache.entries()))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, 'b')))
+
+    def test_max_bytes_never_evicts_new_entry(self):
+        cache = ModelCache(self.cache_dir, max_bytes=50)
+        self.insert(cache, 'a')
+        evicted = self.insert(cache, 'b')
+
+        self.assertEqual(['a'], evicted)
+        self.assertEqual({'b'}, set(cache.entries()))
+
+    def test_hits_are_throttled(self):
+        cache = ModelCache(self.cache_dir)
+        self.insert(cache, 'a')
+        for _ in range(3):
+            cache.record_hit('a')
+        self.assertEqual(1, cache.entries()['a']['hits'], 'hits within hit_interval should not be recorded')
+
+        pcache._recorded_hits.clear()  # as seen by another process
+        cache.record_hit('a')
+        self.assertEqual(1, cache.entries()['a']['hits'], 'hits recorded by other processes should count')
+
+        unthrottled_cache = ModelCache(self.cache_dir, hit_interval=0)
+        unthrottled_cache.record_hit('a')
+        unthrottled_cache.record_hit('a')
+        self.assertEqual(3, cache.entries()['a']['hits'])
+
+    def test_cost_policy_keeps_slow_fits(self):
+        cache = ModelCache(self.cache_dir, max_entries=2, policy='cost')
+        self.insert(cache, 'slow', fit_seconds=1000.0)
+        self.insert(cache, 'fast', fit_seconds=0.0)
+        time.sleep(0.01)
+        evicted = self.insert(cache, 'new', fit_seconds=1.0)
+
+        self.assertEqual(['fast'], evicted)
+
+    def test_prune_and_verify(self):
+        write_entry(self.cache_dir, 'unindexed')
+        os.makedirs(os.path.join(self.cache_dir, 'incomplete'))
+        cache = ModelCache(self.cache_dir)
+
+        self.assertEqual({'incomplete', 'unindexed'}, set(cache.verify()))
+        self.assertEqual([], cache.prune())
+        self.assertEqual({'incomplete'}, set(cache.verify()))
+
+        os.remove(os.path.join(self.cache_dir, 'unindexed', 'model.h5'))
+        self.assertIn('file is missing: model.h5', cache.verify()['unindexed'])
+        self.assertEqual(1, main(['verify', self.cache_dir]))
+
+        self.assertEqual(0, main(['prune', self.cache_dir, '--max-entries', '0']))
+        self.assertEqual({}, cache.entries())
+
+    def test_entries_being_written_are_not_evicted(self):
+        cache = ModelCache(self.cache_dir)
+        os.makedirs(os.path.join(self.cache_dir, 'incomplete'))
+        self.insert(cache, 'fitting')
+        self.insert(cache, 'a')
+
+        fit_lock = SingleFlightLock(os.path.join(self.cache_dir, 'fitting', 'model'))
+        fit_lock.acquire()
+        try:
+            self.assertEqual(['a'], cache.prune(max_entries=0), 'entries with a held lock should not be evicted')
+        finally:
+            fit_lock.release()
+
+        self.assertTrue(os.path.isdir(os.path.join(self.cache_dir, 'incomplete')),
+                        'entries without a manifest should not be evicted')
+        self.assertEqual({'fitting'}, set(cache.entries()))
+        self.assertEqual(['fitting'], cache.prune(max_entries=0))
+
+    def test_concurrent_inserts(self):
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=insert_entries, args=(self.cache_dir, worker)) for worker in range(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+            self.assertEqual(0, process.exitcode)
+
+        self.assertEqual(15, len(ModelCache(self.cache_dir).entries()), 'no index updates should be lost')
+
+
+class ModelMemoTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.model_path = os.path.join(self.temp_dir.name, 'model.h5')
+        with open(self.model_path, 'wb') as model_file:
+            model_file.write(b'model')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_get_put_and_invalidate(self):
+        memo = ModelMemo()
+        self.assertIsNone(memo.get(self.model_path))
+        memo.put(self.model_path, 'loaded')
+        self.assertEqual('loaded', memo.get(self.model_path))
+
+        memo.invalidate(self.model_path)
+        self.assertIsNone(memo.get(self.model_path))
+
+    def test_replaced_file_is_not_returned(self):
+        memo = ModelMemo()
+        memo.put(self.model_path, 'loaded')
+        temp_path = f'{self.model_path}.tmp'
+        with open(temp_path, 'wb') as model_file:
+            model_file.write(b'refit model')
+        os.replace(temp_path, self.model_path)
+
+        self.assertIsNone(memo.get(self.model_path), 'changed files should be reloaded')
+        self.assertEqual(0, len(memo))
+
+    def test_capacity(self):
+        memo = ModelMemo(max_models=1)
+        other_path = os.path.join(self.temp_dir.name, 'other.h5')
+        with open(other_path, 'wb') as model_file:
+            model_file.write(b'other')
+        memo.put(self.model_path, 'loaded')
+        memo.put(other_path, 'other')
+
+        self.assertIsNone(memo.get(self.model_path), 'least recently used model should be dropped')
+        self.assertEqual('other', memo.get(other_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
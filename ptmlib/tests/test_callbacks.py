@@ -0,0 +1,66 @@
+import os
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+
+import ptmlib.callbacks as pcb
+
+
+def fit_profiled_model(model, x, y=None, validation_data=None, epochs=1, callbacks=None):
+    # a training loop that spends 10 ms waiting for each batch of data and 20 ms on each train step
+    for epoch in range(epochs):
+        for callback in callbacks:
+            callback.on_epoch_begin(epoch)
+        for batch in range(3):
+            time.sleep(0.01)
+            for callback in callbacks:
+                callback.on_train_batch_begin(batch)
+            time.sleep(0.02)
+            for callback in callbacks:
+                callback.on_train_batch_end(batch)
+        for callback in callbacks:
+            callback.on_epoch_end(epoch, {'loss': 1.0})
+    return SimpleNamespace(history={'loss': [1.0] * epochs}, params={'epochs': epochs})
+
+
+class ProfilingCallbackTestCase(unittest.TestCase):
+
+    def test_profile(self):
+        profiling_callback = pcb.ProfilingCallback(batch_size=32, batch_sample_every=2)
+        fit_profiled_model(None, None, epochs=2, callbacks=[profiling_callback])
+        profile = profiling_callback.profile
+
+        self.assertEqual([0, 1], [epoch['epoch'] for epoch in profile['epochs']])
+        for epoch in profile['epochs']:
+            self.assertEqual(3, epoch['steps'])
+            self.assertGreaterEqual(epoch['compute_seconds'], 0.06)
+            self.assertGreaterEqual(epoch['data_wait_seconds'], 0.03)
+            self.assertLess(epoch['data_wait_seconds'], epoch['compute_seconds'], 'train steps should take longer')
+            self.assertAlmostEqual(epoch['steps_per_second'] * 32, epoch['samples_per_second'])
+        self.assertEqual([(0, 0), (0, 2), (1, 0), (1, 2)],
+                         [(batch['epoch'], batch['batch']) for batch in profile['batches']],
+                         'every 2nd batch should be sampled')
+
+    def test_load_or_fit_model_profile(self):
+        import importlib.util
+
+        if importlib.util.find_spec('numpy') is None:
+            self.skipTest('requires numpy')
+
+        import ptmlib.model_tools as modt
+        from ptmlib.tests.test_model_tools import SavableModel, load_savable_model
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            model_file_name = os.path.join(temp_dir, 'model')
+            kwargs = dict(x=[1.0], images_enabled=False, profile_enabled=True, load_model_function=load_savable_model,
+                          fit_model_function=fit_profiled_model)
+
+            _, history = modt.load_or_fit_model(SavableModel(), model_file_name, **kwargs)
+            self.assertEqual(3, history.profile['epochs'][0]['steps'])
+            _, loaded_history = modt.load_or_fit_model(SavableModel(), model_file_name, **kwargs)
+            self.assertEqual(history.profile, loaded_history.profile, 'the profile should be saved with the model')
+
+
+if __name__ == '__main__':
+    unittest.main()
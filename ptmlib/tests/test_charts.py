@@ -0,0 +1,56 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+import ptmlib.charts as pch
+
+numpy_available = importlib.util.find_spec('numpy') is not None
+matplotlib_available = importlib.util.find_spec('matplotlib') is not None
+
+
+class RenderHistoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_render_empty_directory(self):
+        self.assertEqual([], pch.render_history_directory(self.temp_dir.name, ['loss']))
+
+    @unittest.skipUnless(numpy_available and matplotlib_available, 'requires numpy and matplotlib')
+    def test_save_history_charts(self):
+        history_data = {'loss': [1.0, 0.5], 'val_loss': [1.1, 0.6], 'accuracy': [0.5, 0.8]}
+
+        image_file_names = pch.save_history_charts(history_data, ['accuracy', 'loss', 'missing'], 'run',
+                                                   self.temp_dir.name)
+        self.assertEqual([os.path.join(self.temp_dir.name, 'accuracy-run.png'),
+                          os.path.join(self.temp_dir.name, 'loss-run.png')], image_file_names,
+                         'search strings without data should be skipped')
+
+        image_file_names = pch.save_history_charts(history_data, ['accuracy', 'loss'], 'run', self.temp_dir.name,
+                                                   layout='grid')
+        self.assertEqual([os.path.join(self.temp_dir.name, 'history-run.png')], image_file_names)
+        for image_file_name in os.listdir(self.temp_dir.name):
+            self.assertGreater(os.path.getsize(os.path.join(self.temp_dir.name, image_file_name)), 0)
+
+    @unittest.skipUnless(numpy_available and matplotlib_available, 'requires numpy and matplotlib')
+    def test_render_history_directory(self):
+        import ptmlib.history as phist
+
+        for run in ('a', 'b'):
+            run_dir = os.path.join(self.temp_dir.name, run)
+            os.makedirs(run_dir)
+            phist.save_history_arrays({'loss': [1.0, 0.5]}, {}, phist.get_history_arrays_path(
+                os.path.join(run_dir, 'model')))
+
+        image_file_names = pch.render_history_directory(self.temp_dir.name, ['loss'], max_workers=2)
+        self.assertEqual([os.path.join(self.temp_dir.name, run, 'loss-model.png') for run in ('a', 'b')],
+                         image_file_names)
+        self.assertTrue(all(os.path.exists(image_file_name) for image_file_name in image_file_names))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,15 @@
+import os
+import tempfile
 import unittest
-from ptmlib.cpu import CpuCount
+from ptmlib.cpu import CpuCount, ThreadBudget
+
+
+def write_files(root: str, files: dict) -> None:
+    for relative_path, content in files.items():
+        file_path = os.path.join(root, relative_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as fake_file:
+            fake_file.write(content)
 
 
 class CpuCountTestCase(unittest.TestCase):
@@ -26,5 +36,113 @@ class CpuCountTestCase(unittest.TestCase):
         cpu_count.print_stats()
 
 
+class CpuCountFakeSystemTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        files = {
+            'sys/devices/system/cpu/online': '0-7\n',
+            'sys/devices/system/node/node0/cpulist': '0-3\n',
+            'sys/devices/system/node/node1/cpulist': '4-7\n',
+            'proc/self/status': 'Name:\tpython\nCpus_allowed_list:\t0-5\n',
+        }
+        for cpu in range(8):
+            # cpus 0-3 and 4-7 are hyper-threads of cores 0-3
+            files[f'sys/devices/system/cpu/cpu{cpu}/topology/core_id'] = f'{cpu % 4}\n'
+            files[f'sys/devices/system/cpu/cpu{cpu}/topology/physical_package_id'] = '0\n'
+        write_files(self.root, files)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_affinity_limits_count(self):
+        cpu_count = CpuCount(root=self.root)
+
+        self.assertEqual(8, cpu_count.host_count(), 'host cpu count should be 8')
+        self.assertEqual(6, cpu_count.affinity_count(), 'affinity cpu count should be 6')
+        self.assertIsNone(cpu_count.quota(), 'quota should be None without cgroup files')
+        self.assertEqual(6, cpu_count.total_count(), 'total cpu count should be limited by affinity')
+        self.assertEqual(4, cpu_count.physical_count(), 'physical core count should be 4')
+        self.assertEqual({0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}, cpu_count.numa_nodes(), 'numa nodes should match')
+
+    def test_cgroup_v2_quota_limits_count(self):
+        write_files(self.root, {
+            'proc/self/cgroup': '0::/kubepods/pod1\n',
+            'sys/fs/cgroup/cpu.max': 'max 100000\n',
+            'sys/fs/cgroup/kubepods/cpu.max': '400000 100000\n',
+            'sys/fs/cgroup/kubepods/pod1/cpu.max': '250000 100000\n',
+        })
+        cpu_count = CpuCount(root=self.root)
+
+        self.assertEqual(2.5, cpu_count.quota(), 'quota should be the smallest limit in the hierarchy')
+        self.assertEqual(3, cpu_count.total_count(), 'total cpu count should round the quota up')
+        self.assertEqual(2, cpu_count.adjusted_count_by_percent(0.5), 'adjusted count should use the quota')
+
+    def test_cgroup_v1_quota_limits_count(self):
+        write_files(self.root, {
+            'proc/self/cgroup': '4:cpu,cpuacct:/docker/abc\n',
+            'sys/fs/cgroup/cpu,cpuacct/cpu.cfs_quota_us': '200000\n',
+            'sys/fs/cgroup/cpu,cpuacct/cpu.cfs_period_us': '100000\n',
+        })
+        cpu_count = CpuCount(root=self.root)
+
+        self.assertEqual(2.0, cpu_count.quota(), 'quota should be read from the container cgroup root')
+        self.assertEqual(2, cpu_count.total_count(), 'total cpu count should be limited by quota')
+
+    def test_cgroup_v1_nested_quota_limits_count(self):
+        write_files(self.root, {
+            'proc/self/cgroup': '12:cpuset:/\n4:cpu,cpuacct:/kubepods/pod1\n',
+            'sys/fs/cgroup/cpu,cpuacct/cpu.cfs_quota_us': '-1\n',
+            'sys/fs/cgroup/cpu,cpuacct/cpu.cfs_period_us': '100000\n',
+            'sys/fs/cgroup/cpu,cpuacct/kubepods/cpu.cfs_quota_us': '150000\n',
+            'sys/fs/cgroup/cpu,cpuacct/kubepods/cpu.cfs_period_us': '100000\n',
+            'sys/fs/cgroup/cpu,cpuacct/kubepods/pod1/cpu.cfs_quota_us': '-1\n',
+            'sys/fs/cgroup/cpu,cpuacct/kubepods/pod1/cpu.cfs_period_us': '100000\n',
+            'sys/fs/cgroup/cpu,cpuacct/kubepods/pod2/cpu.cfs_quota_us': '50000\n',
+            'sys/fs/cgroup/cpu,cpuacct/kubepods/pod2/cpu.cfs_period_us': '100000\n',
+        })
+        cpu_count = CpuCount(root=self.root)
+
+        self.assertEqual(1.5, cpu_count.quota(), 'quota should be the smallest limit on the process cgroup path')
+        self.assertEqual(2, cpu_count.total_count(), 'total cpu count should round the quota up')
+
+    def test_cgroup_v1_unlimited_quota(self):
+        write_files(self.root, {
+            'proc/self/cgroup': '4:cpu,cpuacct:/\n',
+            'sys/fs/cgroup/cpu,cpuacct/cpu.cfs_quota_us': '-1\n',
+            'sys/fs/cgroup/cpu,cpuacct/cpu.cfs_period_us': '100000\n',
+        })
+        self.assertIsNone(CpuCount(root=self.root).quota(), 'quota of -1 should be unlimited')
+
+
+class ThreadBudgetTestCase(unittest.TestCase):
+
+    def test_thread_budget_restores_environment(self):
+        import ptmlib.events as pev
+
+        previous_omp = os.environ.get('OMP_NUM_THREADS')
+        os.environ.pop('MKL_NUM_THREADS', None)
+        records = []
+        pev.add_sink(records.append)
+        try:
+            with ThreadBudget(3, silent=True) as budget:
+                self.assertEqual('3', os.environ['OMP_NUM_THREADS'], 'OpenMP threads should be limited')
+                self.assertEqual('3', os.environ['MKL_NUM_THREADS'], 'MKL threads should be limited')
+                self.assertEqual('1', os.environ['TF_NUM_INTEROP_THREADS'], 'inter-op threads should default to 1')
+                self.assertEqual(3, budget.applied['threads'])
+        finally:
+            pev.remove_sink(records.append)
+
+        self.assertEqual(previous_omp, os.environ.get('OMP_NUM_THREADS'), 'OMP_NUM_THREADS should be restored')
+        self.assertNotIn('MKL_NUM_THREADS', os.environ, 'unset variables should be removed again')
+        self.assertEqual(['cpu.thread_budget'], [record['event'] for record in records])
+        self.assertNotIn('message', records[0], 'silent budgets should not print')
+
+    def test_thread_budget_default_threads(self):
+        budget = ThreadBudget(excluded_percent=0.5)
+        self.assertEqual(CpuCount().adjusted_count_by_percent(0.5), budget.threads)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,85 @@
+import importlib.util
+import os
+import pickle
+import tempfile
+import unittest
+
+numpy_available = importlib.util.find_spec('numpy') is not None
+tensorflow_available = importlib.util.find_spec('tensorflow') is not None
+
+
+@unittest.skipUnless(numpy_available, 'requires numpy')
+class ArrayBatchesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        import numpy as np
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.x = np.arange(10 * 4, dtype=np.uint8).reshape(10, 4)
+        self.y = np.arange(10)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_sharded_batches_are_scaled(self):
+        import numpy as np
+        import ptmlib.data as pdata
+
+        x_paths = pdata.save_shards(self.x, os.path.join(self.temp_dir.name, 'x'), shard_rows=3)
+        self.assertEqual(4, len(x_paths))
+
+        batches = pdata.ArrayBatches(os.path.join(self.temp_dir.name, 'x-*.npy'), self.y, batch_size=4,
+                                     scale=1 / 255.0)
+        self.assertEqual(3, len(batches))
+        x_batches, y_batches = zip(*[(x.copy(), y) for (x, y) in batches])
+        np.testing.assert_allclose(self.x / 255.0, np.concatenate(x_batches), rtol=1e-6)
+        np.testing.assert_array_equal(self.y, np.concatenate(y_batches))
+        self.assertEqual(np.float32, x_batches[0].dtype)
+
+    def test_scale_requires_float_dtype(self):
+        import ptmlib.data as pdata
+
+        with self.assertRaises(ValueError):
+            pdata.ArrayBatches(self.x, scale=1 / 255.0, dtype=None)
+        self.assertEqual(1, len(pdata.ArrayBatches(self.x.astype('float16'), batch_size=10, scale=0.5, dtype=None)))
+
+    def test_shuffle_and_early_stop(self):
+        import numpy as np
+        import ptmlib.data as pdata
+
+        batches = pdata.ArrayBatches(self.x, batch_size=2, dtype=None, shuffle=True, seed=1, prefetch=1)
+        rows = np.concatenate([x.copy() for x in batches])
+        np.testing.assert_array_equal(self.x, rows[np.argsort(rows[:, 0])], 'every row should be read once')
+
+        for _ in batches:
+            break  # the prefetch thread must not block
+
+    @unittest.skipUnless(tensorflow_available, 'requires tensorflow')
+    def test_dataset_batches_are_not_overwritten(self):
+        import numpy as np
+        import ptmlib.data as pdata
+
+        for prefetch in (0, 1):
+            dataset = pdata.ArrayBatches(self.x, self.y, batch_size=2, dtype=None, prefetch=prefetch).to_dataset()
+            iterator = iter(dataset)
+            x_first, _ = next(iterator)
+            next(iterator)
+            next(iterator)
+            np.testing.assert_array_equal(self.x[:2], x_first.numpy(),
+                                          'reading the next batches should not change a batch')
+
+    def test_fingerprint_uses_file_metadata(self):
+        import ptmlib.data as pdata
+        import ptmlib.fingerprint as fpr
+
+        pdata.save_shards(self.x, os.path.join(self.temp_dir.name, 'x'), shard_rows=5)
+        sharded = pdata.ShardedArray(os.path.join(self.temp_dir.name, 'x-*.npy'))
+        key = fpr.fingerprint_data(pdata.ArrayBatches(sharded, scale=1 / 255.0))
+
+        self.assertEqual(key, fpr.fingerprint_data(pdata.ArrayBatches(pickle.loads(pickle.dumps(sharded)),
+                                                                      scale=1 / 255.0)))
+        self.assertNotEqual(key, fpr.fingerprint_data(pdata.ArrayBatches(sharded)), 'scale should matter')
+
+
+if __name__ == '__main__':
+    unittest.main()
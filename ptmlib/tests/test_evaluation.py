@@ -0,0 +1,130 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+numpy_available = importlib.util.find_spec('numpy') is not None
+
+
+class LinearModel:
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.predicted_rows = []
+
+    def get_config(self):
+        return {'units': self.weights.shape[1]}
+
+    def get_weights(self):
+        return [self.weights]
+
+    def predict(self, x):
+        self.predicted_rows.append(len(x))
+        return x @ self.weights
+
+    def score(self, x, y):
+        return float(((x @ self.weights).argmax(axis=1) == y).mean())
+
+
+class TwoOutputModel(LinearModel):
+
+    def predict(self, x):
+        return [x @ self.weights, (x @ self.weights).argmax(axis=1)]
+
+
+class LoadedModel(LinearModel):
+
+    def get_weights(self):
+        raise AssertionError('the weights of a loaded model should not be read')
+
+
+@unittest.skipUnless(numpy_available, 'requires numpy')
+class LoadOrPredictTestCase(unittest.TestCase):
+
+    def setUp(self):
+        import numpy as np
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.x = np.arange(100 * 4, dtype=np.float32).reshape(100, 4)
+        self.weights = np.ones((4, 3), dtype=np.float32)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_predict_batches_and_cache(self):
+        import numpy as np
+
+        import ptmlib.evaluation as peval
+
+        model = LinearModel(self.weights)
+        predictions = peval.load_or_predict(model, self.x, self.temp_dir.name, batch_size=30)
+        self.assertEqual([30, 30, 30, 10], model.predicted_rows, 'rows should be predicted in batches')
+        self.assertIsInstance(predictions, np.memmap, 'predictions should be memory-mapped')
+        np.testing.assert_array_equal(self.x @ self.weights, predictions)
+
+        cached_predictions = peval.load_or_predict(model, self.x, self.temp_dir.name, batch_size=30)
+        self.assertEqual(4, len(model.predicted_rows), 'cached predictions should not be computed again')
+        np.testing.assert_array_equal(predictions, cached_predictions)
+
+        peval.load_or_predict(LinearModel(self.weights * 2), self.x, self.temp_dir.name)
+        peval.load_or_predict(model, self.x[:50], self.temp_dir.name)
+        self.assertEqual(5, len(model.predicted_rows), 'other inputs should be predicted')
+        self.assertEqual(3, len(os.listdir(self.temp_dir.name)), 'other weights or inputs should have new entries')
+
+    def test_sharded_input(self):
+        import numpy as np
+
+        import ptmlib.data as pdata
+        import ptmlib.evaluation as peval
+
+        shards = pdata.ShardedArray(pdata.save_shards(self.x, os.path.join(self.temp_dir.name, 'x'), 40))
+        predictions = peval.load_or_predict(LinearModel(self.weights), shards, self.temp_dir.name, batch_size=30)
+        np.testing.assert_array_equal(self.x @ self.weights, predictions)
+
+    def test_multiple_outputs(self):
+        import numpy as np
+
+        import ptmlib.evaluation as peval
+
+        for _ in range(2):
+            scores, labels = peval.load_or_predict(TwoOutputModel(self.weights), self.x, self.temp_dir.name,
+                                                   batch_size=64, mmap_mode=None)
+            self.assertEqual((100, 3), scores.shape)
+            np.testing.assert_array_equal(np.zeros(100), labels)
+
+    def test_loaded_model_fingerprint(self):
+        import numpy as np
+
+        import ptmlib.evaluation as peval
+        import ptmlib.fingerprint as fpr
+        import ptmlib.storage as pst
+
+        model = LoadedModel(self.weights)
+        fpr.set_model_fingerprint(model, 'cache-key')
+        predictions = peval.load_or_predict(model, self.x, self.temp_dir.name, mmap_mode=None)
+        np.testing.assert_array_equal(self.x @ self.weights, predictions)
+        (entry_dir,) = os.listdir(self.temp_dir.name)
+        manifest = pst.read_json(os.path.join(self.temp_dir.name, entry_dir, peval.MANIFEST_FILE_NAME))
+        self.assertEqual('cache-key', manifest['model_fingerprint'])
+
+    def test_evaluate_is_cached(self):
+        import numpy as np
+
+        import ptmlib.evaluation as peval
+
+        calls = []
+
+        def evaluate(model, x, y):
+            calls.append(len(x))
+            return {'accuracy': np.float32(model.score(x, y))}
+
+        y = np.zeros(100, dtype=np.int64)
+        for _ in range(2):
+            metrics = peval.load_or_evaluate(LinearModel(self.weights), self.x, y, self.temp_dir.name,
+                                             evaluate_function=evaluate)
+            self.assertEqual({'accuracy': 1.0}, metrics)
+        self.assertEqual(1, len(calls), 'cached metrics should not be computed again')
+
+
+if __name__ == '__main__':
+    unittest.main()
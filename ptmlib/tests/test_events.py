@@ -0,0 +1,85 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import ptmlib.events as pev
+from ptmlib.cpu import CpuCount
+from ptmlib.time import Stopwatch, TimingRegistry
+
+
+class EventsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.records = []
+        pev.add_sink(self.records.append)
+
+    def tearDown(self):
+        pev.remove_sink(self.records.append)
+
+    def test_stopwatch_and_cpu_events(self):
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            stopwatch = Stopwatch('task', registry=TimingRegistry())
+            stopwatch.start()
+            stopwatch.stop(silent=True)
+            CpuCount().print_stats()
+
+        self.assertEqual(['stopwatch.start', 'stopwatch.stop', 'cpu.stats'], [r['event'] for r in self.records])
+        self.assertEqual('task', self.records[1]['name'])
+        self.assertGreaterEqual(self.records[1]['wall_seconds'], 0.0)
+        self.assertIn('total_count', self.records[2])
+        self.assertIn('Elapsed seconds:', output.getvalue(), 'print_sink should keep printing messages')
+        self.assertIn('Total CPU Count:', output.getvalue())
+
+    def test_remove_print_sink(self):
+        pev.remove_sink(pev.print_sink)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                pev.emit('test.event', 'hidden', value=1)
+        finally:
+            pev.add_sink(pev.print_sink)
+
+        self.assertEqual('', output.getvalue())
+        self.assertEqual(1, self.records[0]['value'])
+
+    def test_failing_sink(self):
+        def failing_sink(record):
+            raise OSError('disk full')
+
+        later_records = []
+        later_sink = later_records.append
+        pev.add_sink(failing_sink)
+        pev.add_sink(later_sink)
+        try:
+            with self.assertWarnsRegex(RuntimeWarning, 'disk full'):
+                pev.emit('test.event', value=1)
+        finally:
+            pev.remove_sink(failing_sink)
+            pev.remove_sink(later_sink)
+
+        self.assertEqual([1], [record['value'] for record in later_records], 'later sinks should get the event')
+
+    def test_json_lines_sink(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            events_path = os.path.join(temp_dir, 'events.jsonl')
+            sink = pev.JsonLinesSink(events_path, flush_interval=60)
+            pev.add_sink(sink)
+            try:
+                pev.emit('test.event', value=1)
+                pev.emit('test.event', value=2)
+                self.assertFalse(os.path.exists(events_path), 'events should be buffered')
+            finally:
+                pev.remove_sink(sink)
+                sink.close()
+
+            with open(events_path, encoding='utf-8') as events_file:
+                records = [json.loads(line) for line in events_file]
+
+        self.assertEqual([1, 2], [record['value'] for record in records])
+        self.assertEqual(os.getpid(), records[0]['pid'])
+
+
+if __name__ == '__main__':
+    unittest.main()
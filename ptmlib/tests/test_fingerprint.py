@@ -0,0 +1,189 @@
+import importlib.util
+import unittest
+
+import ptmlib.fingerprint as fpr
+
+numpy_available = importlib.util.find_spec('numpy') is not None
+tensorflow_available = importlib.util.find_spec('tensorflow') is not None
+
+
+class FakeModel:
+
+    def __init__(self, units: int):
+        self.units = units
+
+    def get_config(self):
+        return {'units': self.units, 'activation': max}
+
+    @staticmethod
+    def get_compile_config():
+        return {'optimizer': 'adam', 'loss': 'mse'}
+
+
+class AutoNamedModel:
+
+    # numbers its layer names per process, like Keras: dense, dense_1, ...
+    layer_count = 0
+
+    def __init__(self, units: int):
+        self.units = units
+        self.input_name = self._new_name('input')
+        self.dense_name = self._new_name('dense')
+
+    @classmethod
+    def _new_name(cls, prefix: str) -> str:
+        cls.layer_count += 1
+        return f'{prefix}_{cls.layer_count}'
+
+    def get_config(self):
+        return {
+            'name': self._new_name('model'),
+            'layers': [
+                {'class_name': 'InputLayer', 'name': self.input_name, 'inbound_nodes': [],
+                 'config': {'name': self.input_name, 'dtype': {'class_name': 'DTypePolicy',
+                                                               'config': {'name': 'float32'}}}},
+                {'class_name': 'Dense', 'name': self.dense_name, 'inbound_nodes': [[[self.input_name, 0, 0, {}]]],
+                 'config': {'name': self.dense_name, 'units': self.units}},
+            ],
+            'input_layers': [[self.input_name, 0, 0]],
+            'output_layers': [[self.dense_name, 0, 0]],
+        }
+
+
+class FittedEstimator:
+
+    def __init__(self, alpha: float = 1.0):
+        self.alpha = alpha
+
+    def get_params(self, deep: bool = True):
+        return {'alpha': self.alpha}
+
+    def fit(self, coef):
+        self.coef_ = coef
+        self.estimators_ = [FittedEstimator(self.alpha * 2)]
+        self.estimators_[0].coef_ = coef * 2
+        self._cache = object()  # not a fitted attribute
+        return self
+
+
+class Opaque:
+
+    # no get_config(); str() includes the memory address
+    def __init__(self, seed: int):
+        self.seed = seed
+
+
+class FingerprintTestCase(unittest.TestCase):
+
+    def test_fingerprint_data_is_stable(self):
+        data = ([1, 2, 3], {'b': b'abc', 'a': 1.5})
+        self.assertEqual(fpr.fingerprint_data(data), fpr.fingerprint_data(data), 'fingerprint should be stable')
+
+    def test_fingerprint_data_distinguishes_values_and_types(self):
+        self.assertNotEqual(fpr.fingerprint_data([1, 2]), fpr.fingerprint_data([1, 3]), 'values should differ')
+        self.assertNotEqual(fpr.fingerprint_data([1, 2]), fpr.fingerprint_data((1, 2)), 'types should differ')
+        self.assertNotEqual(fpr.fingerprint_data(None), fpr.fingerprint_data('none'), 'None should differ')
+
+    def test_fingerprint_large_buffer_in_chunks(self):
+        data = bytes(range(256)) * 10
+        original_chunk_size = fpr.CHUNK_SIZE_BYTES
+        try:
+            fpr.CHUNK_SIZE_BYTES = 7
+            chunked = fpr.fingerprint_data(data)
+        finally:
+            fpr.CHUNK_SIZE_BYTES = original_chunk_size
+        self.assertEqual(fpr.fingerprint_data(data), chunked, 'chunk size should not change the fingerprint')
+
+    def test_fingerprint_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            fpr.fingerprint_data(object())
+
+    def test_fit_fingerprint_changes_with_config_and_epochs(self):
+        key = fpr.fit_fingerprint(FakeModel(8), [1, 2, 3], epochs=5)
+        self.assertEqual(key, fpr.fit_fingerprint(FakeModel(8), [1, 2, 3], epochs=5), 'key should be stable')
+        self.assertNotEqual(key, fpr.fit_fingerprint(FakeModel(16), [1, 2, 3], epochs=5), 'config should matter')
+        self.assertNotEqual(key, fpr.fit_fingerprint(FakeModel(8), [1, 2, 3], epochs=6), 'epochs should matter')
+
+    def test_fingerprint_config_of_objects(self):
+        key = fpr.fingerprint_config({'random_state': Opaque(1), 'classes': {'b', 'a'}})
+        self.assertEqual(key, fpr.fingerprint_config({'random_state': Opaque(1), 'classes': {'a', 'b'}}),
+                         'equal objects should match, regardless of their address')
+        self.assertNotEqual(key, fpr.fingerprint_config({'random_state': Opaque(2), 'classes': {'a', 'b'}}),
+                            'object state should matter')
+
+    @unittest.skipUnless(numpy_available, 'requires numpy')
+    def test_fingerprint_config_of_random_state(self):
+        import numpy as np
+
+        self.assertEqual(fpr.fingerprint_config([np.random.RandomState(0)]),
+                         fpr.fingerprint_config([np.random.RandomState(0)]))
+        self.assertNotEqual(fpr.fingerprint_config([np.random.RandomState(0)]),
+                            fpr.fingerprint_config([np.random.RandomState(1)]))
+
+    def test_fit_fingerprint_ignores_layer_names(self):
+        key = fpr.fit_fingerprint(AutoNamedModel(8), [1, 2, 3])
+        self.assertEqual(key, fpr.fit_fingerprint(AutoNamedModel(8), [1, 2, 3]), 'rebuilt models should match')
+        self.assertNotEqual(key, fpr.fit_fingerprint(AutoNamedModel(16), [1, 2, 3]), 'config should matter')
+
+        config = fpr.normalize_layer_names(AutoNamedModel(8).get_config())
+        self.assertEqual([['layer_1', 0, 0, {}]], config['layers'][1]['inbound_nodes'][0])
+        self.assertEqual('float32', config['layers'][0]['config']['dtype']['config']['name'],
+                         'only layer names should be renamed')
+
+    @unittest.skipUnless(tensorflow_available, 'requires tensorflow')
+    def test_keras_model_built_twice(self):
+        from tensorflow import keras
+
+        def build_model():
+            inputs = keras.Input(shape=(4,))
+            outputs = keras.layers.Dense(2)(keras.layers.Dense(8, activation='relu')(inputs))
+            model = keras.Model(inputs, outputs)
+            model.compile(optimizer='adam', loss='mse')
+            return model
+
+        self.assertEqual(fpr.fit_fingerprint(build_model(), [1, 2, 3]), fpr.fit_fingerprint(build_model(), [1, 2, 3]),
+                         'the same architecture built twice in one process should have the same key')
+
+    def test_streaming_inputs(self):
+        class Batches:
+            def fingerprint(self):
+                return 'v1'
+
+        self.assertEqual(fpr.fingerprint_data(Batches()), fpr.fingerprint_data(Batches()), 'fingerprint() is used')
+        generator = (batch for batch in [[1, 2], [3, 4]])
+        key = fpr.fit_fingerprint(FakeModel(8), generator, data_fingerprint='v1')
+        self.assertEqual(key, fpr.fit_fingerprint(FakeModel(8), None, data_fingerprint='v1'), 'x should be ignored')
+        self.assertNotEqual(key, fpr.fit_fingerprint(FakeModel(8), None, data_fingerprint='v2'))
+
+    @unittest.skipUnless(numpy_available, 'requires numpy')
+    def test_fingerprint_numpy_layouts(self):
+        import numpy as np
+
+        array = np.arange(24, dtype=np.float32).reshape(4, 6)
+        self.assertEqual(fpr.fingerprint_data(array), fpr.fingerprint_data(array.copy()), 'copies should match')
+        self.assertEqual(fpr.fingerprint_data(array.T), fpr.fingerprint_data(np.ascontiguousarray(array.T)),
+                         'non-contiguous arrays should match their contiguous copy')
+        self.assertNotEqual(fpr.fingerprint_data(array), fpr.fingerprint_data(array.reshape(6, 4)),
+                            'shape should matter')
+        self.assertNotEqual(fpr.fingerprint_data(array), fpr.fingerprint_data(array.astype(np.float64)),
+                            'dtype should matter')
+
+    @unittest.skipUnless(numpy_available, 'requires numpy')
+    def test_model_fingerprint_of_estimators(self):
+        import numpy as np
+
+        key = fpr.model_fingerprint(FittedEstimator().fit(np.ones(3)))
+        self.assertEqual(key, fpr.model_fingerprint(FittedEstimator().fit(np.ones(3))), 'equal models should match')
+        self.assertNotEqual(key, fpr.model_fingerprint(FittedEstimator(2.0).fit(np.ones(3))), 'params should matter')
+        self.assertNotEqual(key, fpr.model_fingerprint(FittedEstimator().fit(np.zeros(3))),
+                            'fitted attributes should matter')
+
+        model = FittedEstimator().fit(np.ones(3))
+        fpr.set_model_fingerprint(model, 'cache-key')
+        self.assertEqual('cache-key', fpr.model_fingerprint(model), 'a recorded fingerprint should be used')
+        fpr.set_model_fingerprint(model, None)
+        self.assertEqual(key, fpr.model_fingerprint(model))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+numpy_available = importlib.util.find_spec('numpy') is not None
+
+
+@unittest.skipUnless(numpy_available, 'requires numpy')
+class HistoryArraysTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, 'model_history.npz')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_save_and_load_history_arrays(self):
+        import ptmlib.history as phist
+
+        history_data = {'loss': [0.9, 0.5, 0.25], 'val_loss': [1.0, 0.6, 0.4]}
+        params = {'epochs': 3, 'steps': 10, 'verbose': 1}
+        phist.save_history_arrays(history_data, params, self.file_path)
+
+        lazy_data = phist.LazyHistoryData(self.file_path)
+        self.assertEqual(params, lazy_data.params, 'params should be restored')
+        self.assertEqual(3, lazy_data.epochs, 'epoch count should be restored')
+        self.assertEqual(['loss', 'val_loss'], list(lazy_data.keys()), 'metric order should be preserved')
+        self.assertEqual({}, lazy_data._loaded, 'no metrics should be read before access')
+        self.assertEqual(history_data['val_loss'], lazy_data['val_loss'], 'values should be restored')
+        self.assertEqual(['val_loss'], list(lazy_data._loaded.keys()), 'only accessed metrics should be read')
+        self.assertIsInstance(lazy_data['val_loss'], list, 'values should be History compatible lists')
+
+    def test_save_history_arrays_rejects_non_numeric(self):
+        import ptmlib.history as phist
+
+        with self.assertRaises(ValueError):
+            phist.save_history_arrays({'lr': ['a', 'b']}, {}, self.file_path)
+        self.assertFalse(os.path.exists(self.file_path), 'no partial file should be left behind')
+
+    def test_pickle_fallback_replaces_arrays(self):
+        from types import SimpleNamespace
+
+        import ptmlib.history as phist
+        import ptmlib.model_tools as modt
+
+        model_file_name = os.path.join(self.temp_dir.name, 'model')
+        modt.save_history_data(SimpleNamespace(history={'loss': [1.0]}, params={}), model_file_name)
+        modt.save_history_data(SimpleNamespace(history={'lr': ['a']}, params={}), model_file_name)
+        self.assertEqual({'lr': ['a']}, phist.read_history_data(model_file_name)[0],
+                         'the history of an earlier fit should not be returned')
+
+        modt.save_history_data(SimpleNamespace(history={'loss': [0.5]}, params={}), model_file_name)
+        self.assertEqual([0.5], phist.read_history_data(model_file_name)[0]['loss'])
+        self.assertEqual(['model_history.npz'], os.listdir(self.temp_dir.name))
+
+
+@unittest.skipUnless(numpy_available, 'requires numpy')
+class HistoryComparisonTestCase(unittest.TestCase):
+
+    def test_find_histories(self):
+        import ptmlib.history as phist
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for entry_name in ('computer_vision-aaaa', 'computer_vision-bbbb', 'nlp-cccc'):
+                entry_dir = os.path.join(cache_dir, entry_name)
+                os.makedirs(entry_dir)
+                model_name = entry_name.split('-')[0]
+                history_path = os.path.join(entry_dir, f'{model_name}_history.npz')
+                phist.save_history_arrays({'loss': [1.0, 0.5]}, {}, history_path)
+
+            histories = phist.find_histories(cache_dir, 'computer_vision-*')
+            self.assertEqual(['computer_vision-aaaa/computer_vision', 'computer_vision-bbbb/computer_vision'],
+                             list(histories.keys()), 'only matching runs should be found, sorted by name')
+            self.assertEqual([1.0, 0.5], histories['computer_vision-aaaa/computer_vision']['loss'])
+
+    def test_smooth_values(self):
+        import numpy as np
+
+        import ptmlib.history as phist
+
+        smoothed = phist.smooth_values([1.0, 3.0, np.nan, 5.0, 7.0], 2)
+        self.assertEqual([1.0, 2.0, 3.0, 5.0, 6.0], smoothed.tolist(), 'NaN values should be skipped')
+
+    def test_downsample_keeps_extremes(self):
+        import numpy as np
+
+        import ptmlib.history as phist
+
+        values = np.sin(np.linspace(0, 20, 200000))
+        values[123457] = 10.0
+        values[54321] = -10.0
+        for downsample_function in (phist.downsample_min_max, phist.downsample_lttb):
+            indexes = downsample_function(values, 500)
+            self.assertLessEqual(len(indexes), 500, 'at most max_points indexes should be returned')
+            self.assertTrue(np.all(np.diff(indexes) > 0), 'indexes should be sorted and unique')
+            self.assertEqual([0, len(values) - 1], [indexes[0], indexes[-1]], 'end points should be kept')
+            self.assertIn(123457, indexes, 'spikes should be kept')
+            self.assertIn(54321, indexes, 'dips should be kept')
+
+        self.assertEqual(list(range(10)), phist.downsample_lttb(values[:10], 500).tolist(),
+                         'short series should not be downsampled')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import json
+import subprocess
+import sys
+import unittest
+
+_heavy_modules = ('tensorflow', 'matplotlib', 'pandas', 'numpy', 'playsound', 'google.colab')
+
+
+def import_in_subprocess(statement: str) -> dict:
+    # a fresh interpreter, so modules imported by other tests do not hide slow imports
+    code = f'''
+import json, sys, time
+start_time = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start_time
+print(json.dumps({{'seconds': seconds, 'modules': [m for m in {_heavy_modules!r} if m in sys.modules]}}))
+'''
+    completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+class ImportTimeTestCase(unittest.TestCase):
+
+    def test_import_time_without_heavy_dependencies(self):
+        result = import_in_subprocess('import ptmlib.time')
+        self.assertEqual([], result['modules'], f"ptmlib.time should not import heavy dependencies "
+                         f"(import took {result['seconds']:0.4f} seconds)")
+
+    def test_import_cpu_without_heavy_dependencies(self):
+        result = import_in_subprocess('import ptmlib.cpu')
+        self.assertEqual([], result['modules'], f"ptmlib.cpu should not import heavy dependencies "
+                         f"(import took {result['seconds']:0.4f} seconds)")
+
+    def test_package_attributes_are_lazy(self):
+        result = import_in_subprocess('import ptmlib\nassert "ptmlib.time" not in sys.modules\n'
+                                      'ptmlib.Stopwatch\nassert "ptmlib.time" in sys.modules')
+        self.assertEqual([], result['modules'], 'import ptmlib should not import heavy dependencies')
+
+    def test_import_model_tools_without_heavy_dependencies(self):
+        result = import_in_subprocess('import ptmlib.model_tools')
+        self.assertEqual([], result['modules'], f"ptmlib.model_tools should not import heavy dependencies "
+                         f"(import took {result['seconds']:0.4f} seconds)")
+
+    def test_import_sweep_without_heavy_dependencies(self):
+        # sweep workers must set thread limits before NumPy/TensorFlow are imported
+        result = import_in_subprocess('import ptmlib.sweep')
+        self.assertEqual([], result['modules'], 'ptmlib.sweep should not import heavy dependencies')
+
+    def test_import_tuning_without_heavy_dependencies(self):
+        result = import_in_subprocess('import ptmlib.tuning')
+        self.assertEqual([], result['modules'], 'ptmlib.tuning should not import heavy dependencies')
+
+    def test_import_evaluation_without_heavy_dependencies(self):
+        result = import_in_subprocess('import ptmlib.evaluation')
+        self.assertEqual([], result['modules'], 'ptmlib.evaluation should not import heavy dependencies')
+
+
+if __name__ == '__main__':
+    unittest.main()
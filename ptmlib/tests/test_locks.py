@@ -0,0 +1,92 @@
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from ptmlib.locks import SingleFlightLock
+from ptmlib.storage import write_json_atomic
+
+
+def fit_once(directory: str) -> None:
+    result_path = os.path.join(directory, 'model.json')
+    fit_lock = SingleFlightLock(os.path.join(directory, 'model'), poll_interval=0.05)
+    if fit_lock.acquire(is_done=lambda: os.path.exists(result_path)):
+        try:
+            with open(os.path.join(directory, 'fits.txt'), 'a') as fits_file:
+                fits_file.write(f'{os.getpid()}\n')
+            time.sleep(0.5)
+            write_json_atomic({'pid': os.getpid()}, result_path)
+        finally:
+            fit_lock.release()
+
+
+class SingleFlightLockTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'model')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_marker(self, **marker) -> None:
+        with open(os.path.join(self.temp_dir.name, '.model.inprogress'), 'w') as marker_file:
+            json.dump({'token': 'other', 'heartbeat': 0, **marker}, marker_file)
+
+    def test_processes_fit_once(self):
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=fit_once, args=(self.temp_dir.name,)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+            self.assertEqual(0, process.exitcode)
+
+        with open(os.path.join(self.temp_dir.name, 'fits.txt')) as fits_file:
+            self.assertEqual(1, len(fits_file.readlines()), 'only one process should fit')
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir.name, '.model.inprogress')),
+                         'the marker should be removed on release')
+
+    def test_fail_fast_and_heartbeat(self):
+        owner_lock = SingleFlightLock(self.path, heartbeat_interval=0.05)
+        self.assertTrue(owner_lock.acquire())
+        try:
+            with self.assertRaises(TimeoutError):
+                SingleFlightLock(self.path).acquire(timeout=0)
+            time.sleep(0.3)
+            self.assertGreater(owner_lock.owner()['heartbeat'], 0, 'the owner should refresh the marker')
+        finally:
+            owner_lock.release()
+
+        self.assertIsNone(owner_lock.owner())
+        fit_lock = SingleFlightLock(self.path)
+        self.assertTrue(fit_lock.acquire(timeout=0), 'a released lock should be acquired')
+        fit_lock.release()
+
+    def test_exited_owner_is_stale(self):
+        exited_process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited_process.wait()
+        self.write_marker(host=socket.gethostname(), pid=exited_process.pid)
+        fit_lock = SingleFlightLock(self.path)
+        self.assertTrue(fit_lock.acquire(timeout=0), 'a lock of an exited process is stale')
+        fit_lock.release()
+
+    def test_missing_heartbeat_is_stale(self):
+        self.write_marker(host='other-host', pid=1)
+        fit_lock = SingleFlightLock(self.path, stale_seconds=0.2, poll_interval=0.05)
+        with self.assertRaises(TimeoutError):
+            fit_lock.acquire(timeout=0.1)
+
+        start_time = time.monotonic()
+        self.assertTrue(fit_lock.acquire(timeout=5), 'a lock without heartbeats should be taken over')
+        self.assertLess(time.monotonic() - start_time, 1.0)
+        fit_lock.release()
+
+
+if __name__ == '__main__':
+    unittest.main()
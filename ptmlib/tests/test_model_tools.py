@@ -0,0 +1,391 @@
+import importlib.util
+import multiprocessing
+import os
+import pickle
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import ptmlib.cache as pca
+import ptmlib.fingerprint as fpr
+import ptmlib.history as phist
+import ptmlib.model_tools as modt
+import ptmlib.time as ptime
+from ptmlib.locks import SingleFlightLock
+
+numpy_available = importlib.util.find_spec('numpy') is not None
+
+
+class MeanModel:
+
+    def __init__(self):
+        self.mean = None
+
+    def fit(self, x, y=None):
+        self.mean = sum(x) / len(x)
+        return self
+
+
+class SavableModel:
+
+    def __init__(self):
+        self.fit_count = 0
+
+    def save(self, file_path):
+        with open(file_path, 'wb') as model_file:
+            pickle.dump(self, model_file)
+
+
+def fit_savable_model(model, x, y=None, validation_data=None, epochs=1):
+    model.fit_count += 1
+    return SimpleNamespace(history={'loss': [1.0] * epochs}, params={'epochs': epochs})
+
+
+def load_savable_model(model_file_name, model_file_format=""):
+    load_savable_model.count += 1
+    with open(modt.get_file_path(model_file_name, model_file_format), 'rb') as model_file:
+        return pickle.load(model_file)
+
+
+load_savable_model.count = 0
+
+
+def fit_slow_savable_model(model, x, y=None, validation_data=None, epochs=1):
+    with open(f'{x[0]}-fits.txt', 'a') as fits_file:
+        fits_file.write(f'{os.getpid()}\n')
+    time.sleep(0.5)
+    return fit_savable_model(model, x, y, validation_data, epochs)
+
+
+def load_or_fit_slow_model(model_file_name: str) -> None:
+    modt.load_or_fit_model(SavableModel(), model_file_name, x=[model_file_name], images_enabled=False,
+                           single_flight=True, load_model_function=load_savable_model,
+                           fit_model_function=fit_slow_savable_model)
+
+
+class FitInterrupted(Exception):
+    pass
+
+
+def get_checkpointed_fit_function(interrupt_epoch=None):
+
+    def fit_checkpointed_model(model, x, y=None, validation_data=None, epochs=1, callbacks=None, initial_epoch=0):
+        for callback in callbacks:
+            callback.set_model(model)
+            callback.set_params({'epochs': epochs})
+        for epoch in range(initial_epoch, epochs):
+            if epoch == interrupt_epoch:
+                raise FitInterrupted()
+            model.fit_count += 1
+            for callback in callbacks:
+                callback.on_epoch_end(epoch, {'loss': float(epoch)})
+        return SimpleNamespace(history={'loss': [float(epoch) for epoch in range(initial_epoch, epochs)]},
+                               params={'epochs': epochs}, epoch=list(range(initial_epoch, epochs)))
+
+    return fit_checkpointed_model
+
+
+@unittest.skipUnless(numpy_available, 'requires numpy')
+class LoadOrFitModelTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        modt.clear_model_memo()
+
+    def test_alert(self):
+        playsound = mock.Mock()
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch.object(ptime, '_get_audio_backends', return_value=(playsound, None, None)):
+            kwargs = dict(x=[1.0], images_enabled=False, fit_model_function=fit_savable_model)
+            modt.load_or_fit_model(SavableModel(), os.path.join(temp_dir, 'silent'), alert=False, **kwargs)
+            playsound.assert_not_called()
+
+            modt.load_or_fit_model(SavableModel(), os.path.join(temp_dir, 'alert'), **kwargs)
+            playsound.assert_called_once()
+
+    def test_memoize(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            model_file_name = os.path.join(temp_dir, 'model')
+            kwargs = dict(x=[1.0], epochs=2, images_enabled=False, memoize=True,
+                          load_model_function=load_savable_model, fit_model_function=fit_savable_model)
+            load_savable_model.count = 0
+
+            fitted_model, _ = modt.load_or_fit_model(SavableModel(), model_file_name, **kwargs)
+            model, _ = modt.load_or_fit_model(SavableModel(), model_file_name, **kwargs)
+            self.assertIs(fitted_model, model, 'fitted model should be memoized')
+            self.assertEqual(0, load_savable_model.count, 'memoized model should not be loaded')
+
+            modt.clear_model_memo(model_file_name)
+            model, history = modt.load_or_fit_model(SavableModel(), model_file_name, **kwargs)
+            loaded_model, loaded_history = modt.load_or_fit_model(SavableModel(), model_file_name, **kwargs)
+            self.assertEqual(1, load_savable_model.count, 'model should be loaded once after invalidation')
+            self.assertIs(model, loaded_model)
+            self.assertIs(history, loaded_history)
+
+
+class SlowSavableModel(SavableModel):
+
+    def save(self, file_path):
+        time.sleep(0.2)
+        super().save(file_path)
+
+
+@unittest.skipUnless(numpy_available, 'requires numpy')
+class AsyncSaveTestCase(unittest.TestCase):
+
+    def test_wait_for_artifacts(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            model_file_name = os.path.join(temp_dir, 'model')
+            model, history = modt.load_or_fit_model(SlowSavableModel(), model_file_name, x=[1.0], epochs=2,
+                                                    images_enabled=False, async_save=True,
+                                                    fit_model_function=fit_savable_model)
+            self.assertEqual(1, model.fit_count)
+            self.assertFalse(os.path.exists(f'{model_file_name}.h5'), 'the model should be saved in the background')
+
+            self.assertEqual([f'{model_file_name}.h5'], modt.wait_for_artifacts(timeout=10))
+            self.assertTrue(os.path.exists(f'{model_file_name}.h5'))
+            history_data, _ = phist.read_history_data(model_file_name)
+            self.assertEqual([1.0, 1.0], list(history_data['loss']))
+            self.assertEqual([], modt.wait_for_artifacts(), 'completed saves should not be returned again')
+
+    def test_background_error(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            model_file_name = os.path.join(temp_dir, 'missing', 'model')
+            modt.load_or_fit_model(SavableModel(), model_file_name, x=[1.0], images_enabled=False, async_save=True,
+                                   fit_model_function=fit_savable_model)
+            with self.assertRaises(OSError):
+                modt.wait_for_artifacts(timeout=10)
+
+
+@unittest.skipUnless(numpy_available, 'requires numpy')
+class CheckpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.model_file_name = os.path.join(self.temp_dir.name, 'model')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def load_or_fit(self, epochs=5, interrupt_epoch=None):
+        return modt.load_or_fit_model(SavableModel(), self.model_file_name, x=[1.0], epochs=epochs,
+                                      images_enabled=False, checkpoint_epochs=1, load_model_function=load_savable_model,
+                                      fit_model_function=get_checkpointed_fit_function(interrupt_epoch))
+
+    def test_resume(self):
+        with self.assertRaises(FitInterrupted):
+            self.load_or_fit(interrupt_epoch=3)
+
+        model, history = self.load_or_fit()
+        self.assertEqual(5, model.fit_count, 'only the epochs after the checkpoint should be fit')
+        self.assertEqual([0.0, 1.0, 2.0, 3.0, 4.0], history.history['loss'], 'history should cover all epochs')
+        self.assertEqual(['model.h5', 'model_history.npz'], sorted(f for f in os.listdir(self.temp_dir.name)
+                                                                   if not f.startswith('.')),
+                         'checkpoint files should be removed')
+
+    def test_checkpoint_of_other_fit_is_not_resumed(self):
+        with self.assertRaises(FitInterrupted):
+            self.load_or_fit(interrupt_epoch=3)
+
+        model, history = self.load_or_fit(epochs=6)
+        self.assertEqual(6, model.fit_count, 'a checkpoint for other epochs should not be resumed')
+        self.assertEqual(6, len(history.history['loss']))
+
+    def test_fit_function_without_callbacks(self):
+        model = SavableModel()
+        with self.assertRaises(TypeError):
+            modt.load_or_fit_model(model, self.model_file_name, x=[1.0], images_enabled=False, checkpoint_epochs=1,
+                                   fit_model_function=fit_savable_model)
+        self.assertEqual(0, model.fit_count, 'the model should not be fit')
+
+
+@unittest.skipUnless(numpy_available, 'requires numpy')
+class SingleFlightTestCase(unittest.TestCase):
+
+    def test_fail_fast(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            model_file_name = os.path.join(temp_dir, 'model')
+            model = SavableModel()
+            kwargs = dict(x=[1.0], images_enabled=False, single_flight=True, fit_model_function=fit_savable_model)
+
+            other_process_lock = SingleFlightLock(model_file_name)
+            other_process_lock.acquire()
+            try:
+                with self.assertRaises(TimeoutError):
+                    modt.load_or_fit_model(model, model_file_name, wait_timeout=0, **kwargs)
+                self.assertEqual(0, model.fit_count, 'the model should not be fit while another process fits it')
+            finally:
+                other_process_lock.release()
+
+            modt.load_or_fit_model(model, model_file_name, wait_timeout=0, **kwargs)
+            self.assertEqual(1, model.fit_count, 'the model should be fit once the lock is released')
+            self.assertIsNone(other_process_lock.owner(), 'the lock should be released after saving')
+
+    def test_single_flight_is_opt_in(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            modt.load_or_fit_model(SavableModel(), os.path.join(temp_dir, 'model'), x=[1.0], images_enabled=False,
+                                   fit_model_function=fit_savable_model)
+            self.assertEqual([], [name for name in os.listdir(temp_dir) if name.startswith('.')],
+                             'no lock files should be created by default')
+
+    def test_single_flight_processes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            model_file_name = os.path.join(temp_dir, 'model')
+            context = multiprocessing.get_context('spawn')
+            processes = [context.Process(target=load_or_fit_slow_model, args=(model_file_name,)) for _ in range(3)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join(120)
+                self.assertEqual(0, process.exitcode)
+
+            with open(f'{model_file_name}-fits.txt') as fits_file:
+                self.assertEqual(1, len(fits_file.readlines()), 'only one process should fit the model')
+
+
+class WeightsModel:
+
+    def __init__(self, weights):
+        self.weights = weights
+
+    def get_weights(self):
+        return self.weights
+
+    def set_weights(self, weights):
+        self.weights = weights
+
+
+@unittest.skipUnless(numpy_available, 'requires numpy')
+class WeightsFileFormatTestCase(unittest.TestCase):
+
+    def test_save_and_load(self):
+        import numpy as np
+
+        weights = [np.linspace(-2.0, 2.0, 60, dtype=np.float32).reshape(3, 4, 5), np.arange(5, dtype=np.int64)]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            model_file_name = os.path.join(temp_dir, 'model')
+            for model_file_format, (extension, dtype) in modt.WEIGHTS_FILE_FORMATS.items():
+                model_file_path = modt.get_file_path(model_file_name, model_file_format)
+                self.assertTrue(model_file_path.endswith(extension))
+
+                storage = modt.save_model_file(WeightsModel(weights), model_file_path, model_file_format)
+                self.assertEqual(dtype, storage['dtype'])
+                self.assertTrue(storage['checksum'].startswith('sha256:'))
+
+                model = modt.load_model_file(WeightsModel(None), model_file_name, model_file_format)
+                self.assertEqual(np.float32, model.weights[0].dtype, 'weights should be restored as float32')
+                np.testing.assert_allclose(weights[0], model.weights[0], rtol=0.01, atol=0.0,
+                                           err_msg=f'{model_file_format} should keep 2 significant digits')
+                np.testing.assert_array_equal(weights[1], model.weights[1], 'integer arrays are not reduced')
+
+    def test_checksum_mismatch(self):
+        import numpy as np
+
+        import ptmlib.storage as pst
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, 'weights.npz')
+            pst.write_weights_atomic([np.ones(10, dtype=np.float32)], file_path, 'float16')
+
+            with np.load(file_path) as archive:
+                arrays = dict(archive)
+            arrays['weights_0'] = arrays['weights_0'] * 2
+            np.savez_compressed(file_path, **arrays)
+
+            with self.assertRaises(ValueError):
+                pst.read_weights(file_path)
+            self.assertEqual(2.0, pst.read_weights(file_path, verify=False)[0][0])
+
+    def test_float16_overflow(self):
+        import numpy as np
+
+        import ptmlib.storage as pst
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, 'weights.npz')
+            with self.assertRaises(ValueError):
+                pst.write_weights_atomic([np.array([1e6], dtype=np.float32)], file_path, 'float16')
+            pst.write_weights_atomic([np.array([1e6], dtype=np.float32)], file_path, 'bfloat16')
+            self.assertAlmostEqual(1e6, pst.read_weights(file_path)[0][0], delta=1e6 * 0.01)
+
+
+class ConfigurableWeightsModel(WeightsModel):
+
+    def get_config(self):
+        return {'shapes': [list(weight.shape) for weight in self.weights]}
+
+
+def fit_weights_model(model, x, y=None, validation_data=None, epochs=1):
+    model.set_weights([weight + epochs for weight in model.get_weights()])
+    return SimpleNamespace(history={'loss': [1.0] * epochs}, params={'epochs': epochs})
+
+
+@unittest.skipUnless(numpy_available, 'requires numpy')
+class WarmStartTestCase(unittest.TestCase):
+
+    def test_warm_start(self):
+        import numpy as np
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            kwargs = dict(epochs=3, images_enabled=False, model_file_format='weights_npz',
+                          fit_model_function=fit_weights_model, cache_dir=cache_dir, warm_start=True)
+            model_file_name = os.path.join(cache_dir, 'model')
+
+            model, _ = modt.load_or_fit_model(ConfigurableWeightsModel([np.zeros((2, 3))]), model_file_name,
+                                              x=[1.0], **kwargs)
+            np.testing.assert_array_equal(3.0, model.weights[0], 'no compatible entry; fit from scratch')
+
+            model, _ = modt.load_or_fit_model(ConfigurableWeightsModel([np.zeros((2, 3))]), model_file_name,
+                                              x=[2.0], warm_start_epochs=1, **kwargs)
+            np.testing.assert_array_equal(4.0, model.weights[0], 'weights of the first fit should be trained further')
+
+            model, _ = modt.load_or_fit_model(ConfigurableWeightsModel([np.zeros((3, 3))]), model_file_name,
+                                              x=[2.0], warm_start_epochs=1, **kwargs)
+            np.testing.assert_array_equal(3.0, model.weights[0], 'weights with other shapes are not compatible')
+
+            manifests = sorted(pca.ModelCache(cache_dir).manifests().values(), key=lambda manifest: manifest['created'])
+            self.assertEqual([3, 4, 3], [manifest['total_epochs'] for manifest in manifests])
+            self.assertEqual([[], [manifests[0]['cache_key']], []], [manifest['lineage'] for manifest in manifests])
+            self.assertEqual({'cache_key': manifests[0]['cache_key'], 'model_file_name': 'model', 'epochs': 1,
+                              'optimizer_loaded': False}, manifests[1]['warm_start'])
+            self.assertEqual(manifests[2]['cache_key'], fpr.model_fingerprint(model),
+                             'models from the cache should be fingerprinted by their cache key')
+
+    def test_requires_cache_dir(self):
+        with self.assertRaises(ValueError):
+            modt.load_or_fit_model(SavableModel(), 'model', x=[1.0], warm_start=True)
+
+
+class BackendTestCase(unittest.TestCase):
+
+    def test_get_backend(self):
+        self.assertIsInstance(modt.get_backend(MeanModel()), modt.CallableBackend, 'plain models use callable')
+
+    def test_incomplete_backend(self):
+        class FitOnlyBackend(modt.ModelBackend):
+
+            def fit(self, model, x, y=None, validation_data=None, epochs=1):
+                return model, {}, {}
+
+        with self.assertRaises(TypeError, msg='backends without save() and load() should not be created'):
+            FitOnlyBackend()
+
+    @unittest.skipUnless(numpy_available, 'requires numpy')
+    def test_load_or_fit_callable_backend(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            model_file_name = os.path.join(temp_dir, 'mean_model')
+
+            model, result = modt.load_or_fit(MeanModel(), model_file_name, x=[1.0, 2.0, 3.0])
+            self.assertEqual(2.0, model.mean, 'model should be fit')
+            self.assertFalse(result.cached, 'first call should fit')
+            self.assertEqual('callable', result.backend, 'backend name should be recorded')
+
+            model, cached_result = modt.load_or_fit(MeanModel(), model_file_name, x=[1.0, 2.0, 3.0])
+            self.assertEqual(2.0, model.mean, 'saved model should be loaded')
+            self.assertTrue(cached_result.cached, 'second call should load')
+            self.assertEqual(result.fit_seconds, cached_result.fit_seconds, 'fit time should be recorded')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from ptmlib.monitor import ResourceMonitor
+from ptmlib.time import Stopwatch, TimingRegistry
+
+
+def write_proc_files(root: str, core_jiffies: list, process_ticks: int, rss_kb: int, read_bytes: int) -> None:
+    files = {
+        'stat': 'cpu  0 0 0 0 0 0 0 0\n' + ''.join(
+            f'cpu{index} {busy} 0 0 {idle} 0 0 0 0 0 0\n' for index, (busy, idle) in enumerate(core_jiffies)),
+        'self/stat': f'42 (python worker) R 1 1 1 0 -1 0 0 0 0 0 {process_ticks} 0 0 0 20 0 1 0',
+        'self/status': f'Name:\tpython\nVmHWM:\t{rss_kb * 2} kB\nVmRSS:\t{rss_kb} kB\n',
+        'self/io': f'rchar: 1\nwchar: 1\nread_bytes: {read_bytes}\nwrite_bytes: 0\n',
+    }
+    for relative_path, content in files.items():
+        file_path = os.path.join(root, relative_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as proc_file:
+            proc_file.write(content)
+
+
+class ResourceMonitorFakeProcTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.proc_root = self.temp_dir.name
+        write_proc_files(self.proc_root, [(0, 0), (0, 0)], process_ticks=0, rss_kb=1024, read_bytes=0)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_sample_and_summary(self):
+        monitor = ResourceMonitor(interval=60, capacity=2, proc_root=self.proc_root)
+        self.assertEqual(2, monitor.core_count)
+        monitor.start()
+
+        write_proc_files(self.proc_root, [(100, 0), (25, 75)], process_ticks=10, rss_kb=2048, read_bytes=4096)
+        summary = monitor.stop()
+        samples = monitor.samples()
+
+        self.assertEqual([[100.0, 25.0]], samples['core_percent'])
+        self.assertEqual([62.5], samples['system_cpu_percent'])
+        self.assertEqual([2048 * 1024], samples['rss_bytes'])
+        self.assertEqual(4096, summary['read_bytes'])
+        self.assertEqual(1.25, summary['mean_busy_cores'])
+        self.assertEqual(4096 * 1024, summary['peak_rss_bytes'], 'peak RSS should be read from VmHWM')
+        self.assertEqual({}, monitor._proc_fds, 'proc files should be closed after stop')
+
+    def test_ring_buffer_keeps_latest_samples(self):
+        monitor = ResourceMonitor(interval=60, capacity=2, proc_root=self.proc_root)
+        monitor.start()
+        for rss_kb in (1, 2, 3):
+            write_proc_files(self.proc_root, [(0, 0), (0, 0)], process_ticks=0, rss_kb=rss_kb, read_bytes=0)
+            monitor._sample()
+        monitor.stop()
+
+        self.assertEqual([3 * 1024, 3 * 1024], monitor.samples()['rss_bytes'])
+        self.assertEqual(4, monitor.summary()['samples'])
+
+    def test_summary_before_start(self):
+        monitor = ResourceMonitor(interval=60, proc_root=self.proc_root)
+        self.assertEqual(0, monitor.summary()['samples'])
+        self.assertEqual(0.0, monitor.stop()['seconds'], 'stop() before start() should return an empty summary')
+        self.assertEqual([], monitor.samples()['rss_bytes'])
+
+
+@unittest.skipUnless(os.path.exists('/proc/self/stat'), 'requires /proc')
+class ResourceMonitorStopwatchTestCase(unittest.TestCase):
+
+    def test_stopwatch_monitor(self):
+        stopwatch = Stopwatch(registry=TimingRegistry(), monitor=ResourceMonitor(interval=0.01))
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            stopwatch.start()
+            sum(range(200000))
+            result = stopwatch.stop(silent=True)
+
+        self.assertGreater(result.resources['peak_rss_bytes'], 0)
+        self.assertGreaterEqual(result.resources['samples'], 1)
+        self.assertIn('Peak RSS:', output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+numpy_available = importlib.util.find_spec('numpy') is not None
+
+
+class ScaleTransformer:
+
+    def __init__(self, factor: float = 2.0):
+        self.factor = factor
+        self.fit_count = 0
+
+    def get_params(self, deep: bool = True):
+        return {'factor': self.factor}
+
+    def fit_transform(self, x):
+        self.fit_count += 1
+        return x * self.factor
+
+    def transform(self, x):
+        return x * self.factor
+
+
+class PlainTransformer:
+
+    # no get_params(); repr() includes the memory address
+    def __init__(self, factor: float = 2.0):
+        self.factor = factor
+
+    def fit_transform(self, x):
+        return x * self.factor
+
+
+@unittest.skipUnless(numpy_available, 'requires numpy')
+class LoadOrFitTransformTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_transform_is_cached_and_memory_mapped(self):
+        import numpy as np
+        import ptmlib.preprocessing as pprep
+
+        x_train = np.arange(12, dtype=np.float64).reshape(4, 3)
+        x_test = np.ones((2, 3))
+
+        transformer, x_train_scaled, x_test_scaled = pprep.load_or_fit_transform(
+            ScaleTransformer(), 'scale', x_train, x_test, cache_dir=self.temp_dir.name)
+        self.assertEqual(1, transformer.fit_count, 'transformer should be fit on the first call')
+
+        transformer, x_train_cached, x_test_cached = pprep.load_or_fit_transform(
+            ScaleTransformer(), 'scale', x_train, x_test, cache_dir=self.temp_dir.name)
+        self.assertEqual(1, transformer.fit_count, 'cached transformer should not be refit')
+        self.assertIsInstance(x_train_cached, np.memmap, 'cached arrays should be memory-mapped')
+        np.testing.assert_array_equal(x_train * 2.0, x_train_cached)
+        np.testing.assert_array_equal(x_test_scaled, x_test_cached)
+
+        pprep.load_or_fit_transform(ScaleTransformer(3.0), 'scale', x_train, cache_dir=self.temp_dir.name)
+        self.assertEqual(2, len(os.listdir(self.temp_dir.name)), 'new params should create a new entry')
+
+    def test_partial_transform_array_is_ignored(self):
+        import numpy as np
+        import ptmlib.fingerprint as fpr
+        import ptmlib.preprocessing as pprep
+
+        x_train = np.arange(12, dtype=np.float64).reshape(4, 3)
+        x_test = np.ones((2, 3))
+        pprep.load_or_fit_transform(ScaleTransformer(), 'scale', x_train, cache_dir=self.temp_dir.name)
+
+        # a transformed array left by an interrupted run, not recorded in the manifest
+        (entry_dir,) = os.listdir(self.temp_dir.name)
+        np.save(os.path.join(self.temp_dir.name, entry_dir, f'transform-{fpr.fingerprint_data(x_test)}.npy'),
+                np.zeros((1, 3)))
+
+        for _ in range(2):
+            _, _, x_test_scaled = pprep.load_or_fit_transform(ScaleTransformer(), 'scale', x_train, x_test,
+                                                              cache_dir=self.temp_dir.name)
+            np.testing.assert_array_equal(x_test * 2.0, x_test_scaled)
+
+    def test_key_of_transformer_without_params(self):
+        import numpy as np
+        import ptmlib.preprocessing as pprep
+
+        x_train = np.ones((2, 3))
+        key = pprep.get_transformer_key(PlainTransformer(), x_train)
+        self.assertEqual(key, pprep.get_transformer_key(PlainTransformer(), x_train))
+        self.assertNotEqual(key, pprep.get_transformer_key(PlainTransformer(3.0), x_train))
+
+
+if __name__ == '__main__':
+    unittest.main()
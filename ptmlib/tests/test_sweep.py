@@ -0,0 +1,84 @@
+import importlib.util
+import os
+import pickle
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import ptmlib.sweep as psw
+
+numpy_available = importlib.util.find_spec('numpy') is not None
+pandas_available = importlib.util.find_spec('pandas') is not None
+
+
+class ConfigModel:
+
+    # numbered per process, like Keras model names
+    count = 0
+
+    def __init__(self, config):
+        ConfigModel.count += 1
+        self.config = config
+        self.name = f'model_{ConfigModel.count}'
+
+    def get_config(self):
+        return {'name': self.name, **self.config}
+
+    def save(self, file_path):
+        with open(file_path, 'wb') as model_file:
+            pickle.dump(self, model_file)
+
+
+def get_config_model(config):
+    return ConfigModel(config)
+
+
+def fit_config_model(model, x, y=None, validation_data=None, epochs=1):
+    # x is the path of a file that records every fit, across worker processes
+    with open(x[0], 'a') as fits_file:
+        fits_file.write(f'{model.config["units"]}\n')
+    return SimpleNamespace(history={'loss': [1.0 / model.config['units']] * epochs}, params={'epochs': epochs})
+
+
+@unittest.skipUnless(numpy_available, 'requires numpy')
+class SweepTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.fits_path = os.path.join(self.temp_dir.name, 'fits.txt')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def run_configs(self, epochs=2):
+        return psw._run_configs(get_config_model, psw.expand_grid({'units': [1, 2]}), 'model', [self.fits_path],
+                                None, None, epochs, os.path.join(self.temp_dir.name, 'sweep'), "", fit_config_model,
+                                max_workers=2, threads_per_worker=1, excluded_percent=0.25)
+
+    def read_fits(self):
+        with open(self.fits_path) as fits_file:
+            return sorted(int(line) for line in fits_file)
+
+    def test_cached_configs_are_not_refit(self):
+        rows = self.run_configs()
+        self.assertEqual([1, 2], self.read_fits())
+        self.assertEqual([False, False], [row['cached'] for row in rows])
+        self.assertEqual({1.0, 0.5}, {row['loss'] for row in rows}, 'final metrics should be reported')
+
+        rows = self.run_configs()
+        self.assertEqual([1, 2], self.read_fits(), 'saved configs should not be refit')
+        self.assertEqual([True, True], [row['cached'] for row in rows])
+
+        rows = self.run_configs(epochs=3)
+        self.assertEqual([1, 1, 2, 2], self.read_fits(), 'configs should be refit when epochs change')
+        self.assertEqual([3, 3], [row['epochs_run'] for row in rows])
+
+    @unittest.skipUnless(pandas_available, 'requires pandas')
+    def test_run_sweep(self):
+        results = psw.run_sweep(get_config_model, {'units': [1, 2]}, 'model', x=[self.fits_path],
+                                output_dir=self.temp_dir.name, fit_model_function=fit_config_model, max_workers=1)
+        self.assertEqual([1, 2], sorted(results['units']))
+
+
+if __name__ == '__main__':
+    unittest.main()
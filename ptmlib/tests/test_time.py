@@ -0,0 +1,78 @@
+import unittest
+
+from ptmlib.time import Stopwatch, TimingRegistry
+
+
+class StopwatchTestCase(unittest.TestCase):
+
+    def test_stop_returns_result(self):
+        registry = TimingRegistry()
+        stopwatch = Stopwatch('task', registry=registry)
+        stopwatch.start()
+        result = stopwatch.stop(silent=True)
+
+        self.assertEqual('task', result.name, 'result name should match stopwatch name')
+        self.assertGreaterEqual(result.wall_seconds, 0.0, 'wall seconds should be set')
+        self.assertGreaterEqual(result.cpu_seconds, 0.0, 'cpu seconds should be set')
+        self.assertEqual(1, registry.stats('task')['count'], 'stop should be recorded in the registry')
+
+    def test_stop_without_start_fails(self):
+        with self.assertRaises(ValueError):
+            Stopwatch(registry=TimingRegistry()).stop(silent=True)
+
+    def test_laps(self):
+        stopwatch = Stopwatch('pipeline', registry=TimingRegistry())
+        stopwatch.start()
+        stopwatch.lap('load')
+        stopwatch.lap()
+        stopwatch.stop(silent=True)
+
+        self.assertEqual(['pipeline/load', 'pipeline/lap2'], [lap.name for lap in stopwatch.laps],
+                         'laps should be named in order')
+
+    def test_nested_sections_and_decorator(self):
+        registry = TimingRegistry()
+        stopwatch = Stopwatch(registry=registry)
+
+        @stopwatch.timed('predict')
+        def predict():
+            pass
+
+        with stopwatch.section('pipeline'):
+            with stopwatch.section('fit') as fit_section:
+                pass
+            for _ in range(3):
+                predict()
+
+        self.assertEqual('pipeline/fit', fit_section.result.name, 'nested section name should include parent')
+        self.assertEqual(['pipeline', 'pipeline/fit', 'pipeline/predict'], list(registry.report().keys()),
+                         'report should list nested sections after their parent')
+        stats = registry.stats('pipeline/predict')
+        self.assertEqual(3, stats['count'], 'repeated sections should be aggregated')
+        self.assertLessEqual(stats['min'], stats['p50'], 'p50 should not be less than min')
+        self.assertLessEqual(stats['p99'], stats['max'], 'p99 should not exceed max')
+
+    def test_disabled_registry(self):
+        registry = TimingRegistry(enabled=False)
+        stopwatch = Stopwatch(registry=registry)
+
+        with stopwatch.section('hot_loop') as section:
+            pass
+
+        self.assertIsNone(section.result, 'disabled sections should not produce results')
+        self.assertEqual({}, registry.report(), 'disabled registry should not record timings')
+
+    def test_registry_bounded_samples(self):
+        registry = TimingRegistry(max_samples=10)
+        for value in range(100):
+            registry.record('section', float(value))
+
+        stats = registry.stats('section')
+        self.assertEqual(100, stats['count'], 'count should be exact')
+        self.assertEqual(0.0, stats['min'], 'min should be exact')
+        self.assertEqual(99.0, stats['max'], 'max should be exact')
+        self.assertEqual(10, len(registry._samples['section']), 'samples should be bounded')
+
+
+if __name__ == '__main__':
+    unittest.main()
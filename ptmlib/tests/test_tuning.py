@@ -0,0 +1,121 @@
+import importlib.util
+import os
+import tempfile
+import time
+import unittest
+
+numpy_available = importlib.util.find_spec('numpy') is not None
+
+
+class SleepEstimator:
+
+    fits = 0
+
+    def __init__(self, seconds: float = 0.001, n_jobs: int = None):
+        self.seconds = seconds
+        self.n_jobs = n_jobs
+
+    def get_params(self, deep: bool = True):
+        return {'seconds': self.seconds, 'n_jobs': self.n_jobs}
+
+    def set_params(self, **params):
+        for key, value in params.items():
+            setattr(self, key, value)
+        return self
+
+    def fit(self, x, y=None):
+        SleepEstimator.fits += 1
+        time.sleep(self.seconds)
+        return self
+
+
+@unittest.skipUnless(numpy_available, 'requires numpy')
+class TuningTestCase(unittest.TestCase):
+
+    def test_fit_scaling_curve(self):
+        import ptmlib.tuning as ptun
+
+        curve = {'serial_seconds': 1.0, 'parallel_seconds': 8.0, 'overhead_seconds': 0.1}
+        timings = {n_jobs: ptun.predict_seconds(curve, n_jobs) for n_jobs in (1, 2, 4, 8, 16)}
+        fitted = ptun.fit_scaling_curve(timings)
+        for term, value in curve.items():
+            self.assertAlmostEqual(value, fitted[term], places=6, msg=f'{term} should be recovered')
+
+        # seconds(n) = 1 + 8 / n + 0.1 n is fastest at n = 9
+        self.assertEqual(9, ptun.recommend_n_jobs(curve, 16, tolerance=0.0))
+        self.assertEqual(7, ptun.recommend_n_jobs(curve, 16, tolerance=0.05))
+        self.assertEqual(6, ptun.recommend_n_jobs(curve, 16, objective='efficiency', min_efficiency=0.5))
+
+    def test_fit_scaling_curve_is_non_negative(self):
+        import ptmlib.tuning as ptun
+
+        fitted = ptun.fit_scaling_curve({1: 1.0, 2: 1.1, 4: 0.9, 8: 1.0})
+        self.assertTrue(all(value >= 0 for value in fitted.values()), 'terms should not be negative')
+
+    def test_tune_n_jobs_is_cached(self):
+        import ptmlib.tuning as ptun
+
+        calls = []
+
+        def workload(n_jobs):
+            calls.append(n_jobs)
+            time.sleep(0.002 + 0.02 / n_jobs)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            result = ptun.tune_n_jobs(workload, n_jobs_values=[1, 2, 4], repeat=1, cache_dir=cache_dir)
+            self.assertEqual([1, 1, 2, 4], calls, 'one warm-up run and one run per worker count expected')
+            self.assertEqual(4, result.n_jobs, 'the fastest worker count should be recommended')
+            self.assertTrue(os.path.exists(result.cache_path), 'timings should be cached')
+
+            cached_result = ptun.tune_n_jobs(workload, n_jobs_values=[1, 2, 4], repeat=1, cache_dir=cache_dir)
+            self.assertEqual(4, len(calls), 'cached calibrations should not run again')
+            self.assertEqual(result.timings, cached_result.timings)
+
+    def test_estimator_params_are_cached_separately(self):
+        import numpy as np
+        import ptmlib.tuning as ptun
+
+        x = np.zeros((10, 2))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            kwargs = dict(x=x, n_jobs_values=[1, 2], repeat=1, cache_dir=cache_dir)
+            SleepEstimator.fits = 0
+            result = ptun.tune_n_jobs(SleepEstimator(0.001), **kwargs)
+            self.assertEqual(3, SleepEstimator.fits)
+
+            self.assertEqual(result.cache_path, ptun.tune_n_jobs(SleepEstimator(0.001, n_jobs=4), **kwargs).cache_path,
+                             'n_jobs should not be part of the cache key')
+            other_result = ptun.tune_n_jobs(SleepEstimator(0.002), **kwargs)
+            self.assertNotEqual(result.cache_path, other_result.cache_path, 'other params should be calibrated')
+            self.assertEqual(6, SleepEstimator.fits)
+
+    def test_callables_are_cached_separately(self):
+        import ptmlib.tuning as ptun
+
+        def make_workload(calls):
+            def workload(n_jobs):
+                calls.append(n_jobs)
+            return workload
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            kwargs = dict(n_jobs_values=[1], repeat=1, cache_dir=cache_dir)
+            with self.assertRaises(ValueError, msg='lambdas should need an explicit name'):
+                ptun.tune_n_jobs(lambda n_jobs: None, **kwargs)
+
+            calls = []
+
+            def workload(n_jobs):
+                calls.append(n_jobs)
+
+            ptun.tune_n_jobs(make_workload([]), **kwargs)
+            ptun.tune_n_jobs(workload, **kwargs)
+            self.assertEqual([1, 1], calls, 'functions with the same name should not share a calibration')
+            ptun.tune_n_jobs(lambda n_jobs: calls.append(n_jobs), name='workload', **kwargs)
+            self.assertEqual([1, 1, 1, 1], calls, 'a named lambda should not reuse another calibration')
+
+            result = ptun.tune_n_jobs(lambda n_jobs: None, name='<workload>', **kwargs)
+            self.assertTrue(os.path.basename(result.cache_path).startswith('_workload_-'),
+                            'file names should only contain safe characters')
+
+
+if __name__ == '__main__':
+    unittest.main()
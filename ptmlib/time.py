@@ -1,20 +1,32 @@
 import time
 import os
+import functools
+import random
+import threading
+from typing import Any, Callable, Dict, List
 
-try:
-    from playsound import playsound
-except ImportError:
-    playsound = None
+import ptmlib.events as pev
 
-try:
-    import winsound  # requires windows; only used if playsound/colab unavailable
-except ImportError:
-    winsound = None
 
-try:
-    from google.colab import output
-except ImportError:
-    output = None
+@functools.lru_cache(maxsize=None)
+def _get_audio_backends() -> tuple:
+    # imported on first use; these modules are slow to import and only needed when a sound is played
+    try:
+        from playsound import playsound
+    except ImportError:
+        playsound = None
+
+    try:
+        import winsound  # requires windows; only used if playsound/colab unavailable
+    except ImportError:
+        winsound = None
+
+    try:
+        from google.colab import output
+    except ImportError:
+        output = None
+
+    return playsound, winsound, output
 
 
 def get_time_string():
@@ -32,6 +44,192 @@ class AlertSounds:
     DORE: str = 'media/dore.mp3'
 
 
+class StopwatchResult:
+
+    """
+    Elapsed wall clock and CPU time for a timed task, lap or section;
+    resources is the ResourceMonitor summary for a Stopwatch with a monitor, otherwise None
+    """
+
+    __slots__ = ('name', 'wall_seconds', 'cpu_seconds', 'resources')
+
+    def __init__(self, name: str, wall_seconds: float, cpu_seconds: float, resources: Dict[str, Any] = None):
+        self.name = name
+        self.wall_seconds = wall_seconds
+        self.cpu_seconds = cpu_seconds
+        self.resources = resources
+
+    def __repr__(self) -> str:
+        return f'StopwatchResult(name={self.name!r}, wall_seconds={self.wall_seconds:0.6f}, ' \
+               f'cpu_seconds={self.cpu_seconds:0.6f})'
+
+
+class TimingRegistry:
+
+    """
+    The TimingRegistry class aggregates repeated timings by name (count, total, min, max, percentiles).
+    Set enabled to False to make Stopwatch sections nearly free, ex: inside hot loops.
+    """
+
+    def __init__(self, enabled: bool = True, max_samples: int = 10000):
+
+        """
+        :param enabled: record timings; default is True
+        :param max_samples: number of samples kept per name for percentiles; count/total/min/max are exact
+        """
+
+        self.enabled: bool = enabled
+        self.max_samples: int = max_samples
+        self._lock = threading.Lock()
+        self._stats: Dict[str, List[float]] = {}  # name -> [count, total, min, max, cpu_total]
+        self._samples: Dict[str, List[float]] = {}
+
+    def record(self, name: str, wall_seconds: float, cpu_seconds: float = 0.0) -> None:
+
+        """
+        Adds a single timing for name
+
+        :param name: section name; nested sections use 'outer/inner'
+        :param wall_seconds: elapsed wall clock seconds
+        :param cpu_seconds: elapsed process CPU seconds
+        :return: None
+        """
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                self._stats[name] = [1, wall_seconds, wall_seconds, wall_seconds, cpu_seconds]
+                self._samples[name] = [wall_seconds]
+                return
+
+            stats[0] += 1
+            stats[1] += wall_seconds
+            stats[2] = min(stats[2], wall_seconds)
+            stats[3] = max(stats[3], wall_seconds)
+            stats[4] += cpu_seconds
+
+            # reservoir sampling keeps percentiles representative with bounded memory
+            samples = self._samples[name]
+            if len(samples) < self.max_samples:
+                samples.append(wall_seconds)
+            else:
+                index = random.randrange(stats[0])
+                if index < self.max_samples:
+                    samples[index] = wall_seconds
+
+    def stats(self, name: str, percentiles: tuple = (50, 90, 99)) -> Dict[str, float]:
+
+        """
+        Returns aggregated timings for name: count, total, mean, min, max, cpu_total and pNN percentiles
+
+        :param name: section name
+        :param percentiles: percentiles to include; default is (50, 90, 99)
+        :return: dict
+        """
+
+        with self._lock:
+            count, total, minimum, maximum, cpu_total = self._stats[name]
+            samples = sorted(self._samples[name])
+
+        result = {'count': count, 'total': total, 'mean': total / count, 'min': minimum, 'max': maximum,
+                  'cpu_total': cpu_total}
+        for percentile in percentiles:
+            result[f'p{percentile}'] = samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+        return result
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+
+        """
+        Returns aggregated timings for all names, sorted by name so nested sections follow their parent
+
+        :return: dict of name to stats dict
+        """
+
+        with self._lock:
+            names = sorted(self._stats.keys())
+
+        return {name: self.stats(name) for name in names}
+
+    def print_report(self) -> None:
+
+        """
+        Print aggregated timings for all names
+        """
+
+        print(f"{'Section':<40}{'Count':>8}{'Total':>12}{'Mean':>12}{'Min':>12}{'Max':>12}{'P90':>12}")
+        for name, stats in self.report().items():
+            indented_name = '  ' * name.count('/') + name.rsplit('/', 1)[-1]
+            print(f"{indented_name:<40}{stats['count']:>8}{stats['total']:>12.4f}{stats['mean']:>12.6f}"
+                  f"{stats['min']:>12.6f}{stats['max']:>12.6f}{stats['p90']:>12.6f}")
+
+    def reset(self) -> None:
+
+        """
+        Remove all recorded timings
+        """
+
+        with self._lock:
+            self._stats.clear()
+            self._samples.clear()
+
+
+default_registry = TimingRegistry()
+
+# names of the sections currently open in each thread, used to build nested names
+_section_stack = threading.local()
+
+
+class _Section:
+
+    __slots__ = ('name', 'registry', 'result', '_start_time', '_start_cpu_time', '_stack')
+
+    def __init__(self, name: str, registry: TimingRegistry):
+        self.name = name
+        self.registry = registry
+        self.result = None
+
+    def __enter__(self) -> '_Section':
+        stack = getattr(_section_stack, 'names', None)
+        if stack is None:
+            stack = _section_stack.names = []
+        if stack:
+            self.name = f'{stack[-1]}/{self.name}'
+        stack.append(self.name)
+        self._stack = stack
+
+        self._start_cpu_time = time.process_time()
+        self._start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        wall_seconds = time.perf_counter() - self._start_time
+        cpu_seconds = time.process_time() - self._start_cpu_time
+        self._stack.pop()
+
+        self.result = StopwatchResult(self.name, wall_seconds, cpu_seconds)
+        self.registry.record(self.name, wall_seconds, cpu_seconds)
+
+
+class _NullSection:
+
+    __slots__ = ()
+
+    result = None
+
+    def __enter__(self) -> '_NullSection':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_null_section = _NullSection()
+
+
 class Stopwatch:
 
     """
@@ -41,8 +239,27 @@ class Stopwatch:
 
     default_colab_sound_url: str = 'https://upload.wikimedia.org/wikipedia/commons/3/3b/Bee5th.ogg'
 
-    def __init__(self):
+    def __init__(self, name: str = 'stopwatch', registry: TimingRegistry = None, monitor: Any = None):
+
+        """
+        :param name: name used for results and registry entries; default is 'stopwatch'
+        :param registry: TimingRegistry for start/stop, laps and sections; default is ptmlib.time.default_registry
+        :param monitor: ptmlib.monitor.ResourceMonitor sampled from start() to stop(), or True for a default monitor
+        """
+
+        if monitor is True:
+            from ptmlib.monitor import ResourceMonitor
+
+            monitor = ResourceMonitor()
+
+        self.name: str = name
+        self.registry: TimingRegistry = registry if registry is not None else default_registry
+        self.monitor = monitor or None
+        self.laps: List[StopwatchResult] = []
         self._start_time = None
+        self._start_cpu_time = None
+        self._lap_time = None
+        self._lap_cpu_time = None
 
     def start(self) -> None:
         """
@@ -52,12 +269,78 @@ class Stopwatch:
         :return: None
         """
 
-        print("Start Time:", time.ctime())
+        pev.emit('stopwatch.start', f'Start Time: {time.ctime()}', name=self.name)
 
-        self._start_time = time.perf_counter()
+        self.laps = []
+        if self.monitor is not None:
+            self.monitor.start()
+        self._start_cpu_time = self._lap_cpu_time = time.process_time()
+        self._start_time = self._lap_time = time.perf_counter()
+
+    def lap(self, name: str = None) -> StopwatchResult:
+
+        """
+        Record a split time since start() or the previous lap, without stopping the timer
+
+        :param name: lap name; default is lap number, ex: 'lap1'
+        :return: StopwatchResult
+        """
+
+        if self._start_time is None:
+            raise ValueError('start time must be set by calling start() before lap()')
+
+        lap_time = time.perf_counter()
+        lap_cpu_time = time.process_time()
+
+        result = StopwatchResult(f'{self.name}/{name or f"lap{len(self.laps) + 1}"}',
+                                 lap_time - self._lap_time, lap_cpu_time - self._lap_cpu_time)
+        self.laps.append(result)
+        self.registry.record(result.name, result.wall_seconds, result.cpu_seconds)
+
+        self._lap_time = lap_time
+        self._lap_cpu_time = lap_cpu_time
+        return result
+
+    def section(self, name: str) -> Any:
+
+        """
+        Returns a context manager that times a named section; sections may be nested,
+        and are recorded in the registry as 'outer/inner'. Nothing is printed.
+
+        Example: with stopwatch.section('fit') as fit_section: ...
+
+        :param name: section name
+        :return: context manager; its result attribute is a StopwatchResult after exit
+        """
+
+        if not self.registry.enabled:
+            return _null_section
+
+        return _Section(name, self.registry)
+
+    def timed(self, name: str = None) -> Callable:
+
+        """
+        Returns a decorator that times every call of a function as a section
+
+        :param name: section name; default is the function name
+        :return: decorator
+        """
+
+        def decorator(function: Callable) -> Callable:
+            section_name = name or function.__name__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.section(section_name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
 
     def stop(self, silent: bool = False, sound_path: str = AlertSounds.BEE5,
-             colab_sound_url: str = default_colab_sound_url) -> None:
+             colab_sound_url: str = default_colab_sound_url) -> StopwatchResult:
 
         """
         Stop the timer and print elapsed time info;
@@ -66,7 +349,7 @@ class Stopwatch:
         :param silent: disable audio alert
         :param sound_path: OPTIONS: ptmlib.time.AlertSounds value, or absolute file path to audio file
         :param colab_sound_url: absolute URL to audio file to be played if in Google Colab environment
-        :return: None
+        :return: StopwatchResult with elapsed wall clock and CPU seconds
         """
 
         if self._start_time is None:
@@ -74,9 +357,18 @@ class Stopwatch:
 
         # stop and show duration immediately
         end_time = time.perf_counter()
-        print("End Time:  ", time.ctime())
-        print(f'Elapsed seconds: {end_time - self._start_time:0.4f}'
-              + f' ({(end_time - self._start_time) / 60:0.2f} minutes)')
+        end_cpu_time = time.process_time()
+        pev.emit('stopwatch.stop', f'End Time:   {time.ctime()}\n'
+                 + f'Elapsed seconds: {end_time - self._start_time:0.4f}'
+                 + f' ({(end_time - self._start_time) / 60:0.2f} minutes)',
+                 name=self.name, wall_seconds=end_time - self._start_time,
+                 cpu_seconds=end_cpu_time - self._start_cpu_time)
+
+        result = StopwatchResult(self.name, end_time - self._start_time, end_cpu_time - self._start_cpu_time)
+        if self.monitor is not None:
+            result.resources = self.monitor.stop()
+            self.monitor.print_summary()
+        self.registry.record(result.name, result.wall_seconds, result.cpu_seconds)
 
         # must reset
         self._start_time = None
@@ -88,6 +380,8 @@ class Stopwatch:
             except Exception as ex:
                 print('STOPWATCH _alert_finished ERROR:', ex)
 
+        return result
+
     @staticmethod
     def _alert_finished(sound_path: str, colab_sound_url: str) -> None:
 
@@ -110,6 +404,8 @@ class Stopwatch:
         else:
             sound_path = None
 
+        playsound, winsound, output = _get_audio_backends()
+
         if playsound is not None and sound_path is not None:
             # PLAYSOUND ON LOCAL
             playsound(sound_path)
@@ -0,0 +1,338 @@
+import functools
+import itertools
+import os
+import platform
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+import ptmlib.events as pev
+import ptmlib.fingerprint as fpr
+import ptmlib.storage as pst
+from ptmlib.cpu import CpuCount, ThreadBudget
+from ptmlib.time import Stopwatch, TimingRegistry
+
+# NumPy and Scikit-Learn are imported by the functions that use them
+
+# calibrations are shared by every project on a machine; pass cache_dir=None to disable
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'ptmlib', 'tuning')
+
+OBJECTIVES = ('throughput', 'efficiency')
+
+
+class TuningResult:
+
+    """
+    Calibration timings for one workload, the fitted scaling curve
+    seconds(n_jobs) = serial_seconds + parallel_seconds / n_jobs + overhead_seconds * n_jobs,
+    and the recommended n_jobs
+    """
+
+    __slots__ = ('name', 'n_jobs', 'objective', 'timings', 'curve', 'host_fingerprint', 'cache_path')
+
+    def __init__(self, name: str, n_jobs: int, objective: str, timings: Dict[int, float], curve: Dict[str, float],
+                 host_fingerprint: str, cache_path: str = None):
+        self.name = name
+        self.n_jobs = n_jobs
+        self.objective = objective
+        self.timings = timings
+        self.curve = curve
+        self.host_fingerprint = host_fingerprint
+        self.cache_path = cache_path
+
+    def __repr__(self) -> str:
+        return f'TuningResult(name={self.name!r}, n_jobs={self.n_jobs}, objective={self.objective!r})'
+
+    def predict_seconds(self, n_jobs: int) -> float:
+
+        """
+        Returns the calibration run time predicted by the scaling curve
+
+        :param n_jobs: number of workers
+        :return: float
+        """
+
+        return predict_seconds(self.curve, n_jobs)
+
+    def print_summary(self) -> None:
+
+        """
+        Prints measured and predicted seconds, speedup and efficiency for each calibrated worker count
+        """
+
+        lines = [f"{'n_jobs':>8}{'Seconds':>12}{'Predicted':>12}{'Speedup':>10}{'Efficiency':>12}"]
+        for n_jobs, seconds in sorted(self.timings.items()):
+            speedup = self.predict_seconds(1) / self.predict_seconds(n_jobs)
+            lines.append(f'{n_jobs:>8}{seconds:>12.4f}{self.predict_seconds(n_jobs):>12.4f}'
+                         f'{speedup:>10.2f}{speedup / n_jobs:>12.2f}')
+        lines.append(f'Recommended n_jobs: {self.n_jobs} ({self.objective})')
+        pev.emit('tuning.result', '\n'.join(lines), name=self.name, n_jobs=self.n_jobs, objective=self.objective,
+                 timings=self.timings, curve=self.curve, host_fingerprint=self.host_fingerprint)
+
+
+def host_fingerprint(cpu_count: CpuCount = None) -> str:
+
+    """
+    Returns a fingerprint of the machine type: architecture, CPU model, usable and physical CPU counts,
+    NUMA nodes and memory size; machines of the same type share calibrations, ex: on a shared cache_dir
+
+    :param cpu_count: CpuCount; default is CpuCount()
+    :return: str
+    """
+
+    cpu_count = cpu_count or CpuCount()
+    return fpr.fingerprint_config({
+        'machine': platform.machine(),
+        'processor': _read_cpu_model() or platform.processor(),
+        'total_count': cpu_count.total_count(),
+        'physical_count': cpu_count.physical_count(),
+        'numa_nodes': len(cpu_count.numa_nodes()),
+        'memory_gb': _read_memory_gb(),
+    })
+
+
+def fit_scaling_curve(timings: Dict[int, float]) -> Dict[str, float]:
+
+    """
+    Fits seconds(n_jobs) = serial_seconds + parallel_seconds / n_jobs + overhead_seconds * n_jobs to measured
+    timings with non-negative least squares: Amdahl's law plus a cost per worker, which models workloads that
+    stop scaling, ex: when memory bandwidth saturates
+
+    :param timings: dict of n_jobs to seconds
+    :return: dict with serial_seconds, parallel_seconds and overhead_seconds
+    """
+
+    import numpy as np
+
+    n_jobs = np.array(sorted(timings), dtype=np.float64)
+    seconds = np.array([timings[n] for n in sorted(timings)], dtype=np.float64)
+    terms = np.column_stack((np.ones_like(n_jobs), 1.0 / n_jobs, n_jobs))
+
+    # with three terms, trying every subset is an exact non-negative least squares solution
+    best_coefficients, best_error = np.zeros(3), float(np.sum(seconds ** 2))
+    for size in (1, 2, 3):
+        for columns in itertools.combinations(range(3), size):
+            solution = np.linalg.lstsq(terms[:, columns], seconds, rcond=None)[0]
+            if np.all(solution >= 0):
+                coefficients = np.zeros(3)
+                coefficients[list(columns)] = solution
+                error = float(np.sum((terms @ coefficients - seconds) ** 2))
+                if error < best_error - 1e-15:
+                    best_coefficients, best_error = coefficients, error
+
+    return dict(zip(('serial_seconds', 'parallel_seconds', 'overhead_seconds'), best_coefficients.tolist()))
+
+
+def predict_seconds(curve: Dict[str, float], n_jobs: int) -> float:
+    return curve['serial_seconds'] + curve['parallel_seconds'] / n_jobs + curve['overhead_seconds'] * n_jobs
+
+
+def recommend_n_jobs(curve: Dict[str, float], max_n_jobs: int, objective: str = 'throughput',
+                     tolerance: float = 0.05, min_efficiency: float = 0.5) -> int:
+
+    """
+    Returns the recommended worker count for a scaling curve
+
+    :param curve: dict returned by fit_scaling_curve
+    :param max_n_jobs: largest worker count considered
+    :param objective: "throughput" returns the fewest workers within tolerance of the fastest predicted time;
+                      "efficiency" returns the most workers whose speedup per worker is at least min_efficiency,
+                      leaving the rest of the machine for other work
+    :param tolerance: fraction of the fastest time that may be given up to use fewer workers; default is 0.05
+    :param min_efficiency: minimum speedup / n_jobs for the "efficiency" objective; default is 0.5
+    :return: int
+    """
+
+    if objective not in OBJECTIVES:
+        raise ValueError(f'objective must be one of {OBJECTIVES}, not {objective!r}')
+
+    candidates = range(1, max_n_jobs + 1)
+    predicted = {n_jobs: predict_seconds(curve, n_jobs) for n_jobs in candidates}
+    if objective == 'throughput':
+        fastest = min(predicted.values())
+        return min(n_jobs for n_jobs in candidates if predicted[n_jobs] <= fastest * (1 + tolerance))
+
+    efficient = [n_jobs for n_jobs in candidates
+                 if predicted[1] / max(predicted[n_jobs], 1e-12) / n_jobs >= min_efficiency]
+    return max(efficient, default=1)
+
+
+def tune_n_jobs(estimator_or_function: Any, x: Any = None, y: Any = None, name: str = None,
+                n_jobs_values: List[int] = None, sample_rows: int = 10000, repeat: int = 2,
+                objective: str = 'throughput', tolerance: float = 0.05, min_efficiency: float = 0.5,
+                cache_dir: str = DEFAULT_CACHE_DIR, seed: int = 0) -> TuningResult:
+
+    """
+    Recommends n_jobs for a workload on this machine. Short calibration fits are timed with a Stopwatch at several
+    worker counts on a subsample of the data, a scaling curve is fitted (see fit_scaling_curve), and the worker count
+    with the best throughput or efficiency is returned. Timings are cached per workload and host fingerprint,
+    so calibration only runs once per machine type; the recommendation is recomputed from the cached curve.
+    Workloads are identified by the module and qualified name of the function or estimator class, plus
+    get_params() for estimators, except n_jobs; lambdas and functools.partial objects need an explicit name.
+
+    Estimators with an n_jobs parameter (ex: RandomForestClassifier) are cloned and fitted with n_jobs set;
+    other estimators (ex: PCA) are fitted inside a ThreadBudget, which limits their BLAS/OpenMP threads.
+
+    :param estimator_or_function: Scikit-Learn style estimator, or function called as function(n_jobs)
+    :param x: training data for an estimator; a random sample of sample_rows rows is used
+    :param y: target data for an estimator
+    :param name: workload name used for the cache file; default is the estimator class or function name;
+                 required for lambdas and functools.partial objects when cache_dir is set
+    :param n_jobs_values: worker counts to calibrate; default is 1, 2, 4, ... up to CpuCount().total_count()
+    :param sample_rows: maximum rows used for calibration fits
+    :param repeat: timed runs per worker count; the fastest is used
+    :param objective: "throughput" or "efficiency"; see recommend_n_jobs
+    :param tolerance: see recommend_n_jobs
+    :param min_efficiency: see recommend_n_jobs
+    :param cache_dir: directory for cached calibrations; None disables caching
+    :param seed: random seed used to sample rows
+    :return: TuningResult; its n_jobs attribute is the recommendation
+    """
+
+    host = host_fingerprint()
+    max_count = CpuCount().total_count()
+    n_jobs_values = sorted(set(n_jobs_values or _get_default_n_jobs_values(max_count)))
+    workload_id = _get_workload_id(estimator_or_function)
+    if cache_dir is not None and workload_id is None and name is None:
+        raise ValueError('pass name to tune_n_jobs() for lambdas and functools.partial objects, '
+                         'so their calibrations are not shared with other workloads')
+    name = name or getattr(estimator_or_function, '__name__', type(estimator_or_function).__name__)
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_config = {
+            'name': name,
+            'workload': workload_id,
+            'host': host,
+            'n_jobs_values': n_jobs_values,
+            'sample_rows': sample_rows,
+            'repeat': repeat,
+            'shape': list(getattr(x, 'shape', ())),
+        }
+        if hasattr(estimator_or_function, 'get_params'):
+            # differently configured estimators of the same class scale differently; n_jobs is what is being tuned
+            params = {key: value for (key, value) in estimator_or_function.get_params().items() if key != 'n_jobs'}
+            cache_config['params'] = fpr.fingerprint_config(params)
+        cache_key = fpr.fingerprint_config(cache_config)
+        # names such as "<lambda>" are not valid file names on windows
+        cache_path = os.path.join(cache_dir, f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', name)}-{cache_key}.json")
+
+    if cache_path is not None and os.path.exists(cache_path):
+        pev.emit('tuning.hit', f'Using cached n_jobs calibration: {cache_path}', name=name, cache_path=cache_path)
+        timings = {int(n_jobs): seconds for (n_jobs, seconds) in pst.read_json(cache_path)['timings'].items()}
+    else:
+        run_function = _get_run_function(estimator_or_function, x, y, sample_rows, seed)
+        timings = _calibrate(run_function, name, n_jobs_values, repeat)
+        if cache_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            pst.write_json_atomic({'name': name, 'host_fingerprint': host, 'timings': timings}, cache_path)
+
+    curve = fit_scaling_curve(timings)
+    n_jobs = recommend_n_jobs(curve, max(n_jobs_values), objective, tolerance, min_efficiency)
+    result = TuningResult(name, n_jobs, objective, timings, curve, host, cache_path)
+    result.print_summary()
+    return result
+
+
+def _get_workload_id(workload: Any) -> Optional[str]:
+    # module and qualified name of a function or estimator class; None if they do not identify the workload
+    if isinstance(workload, functools.partial):
+        return None
+    if hasattr(workload, 'fit') or not hasattr(workload, '__qualname__'):
+        return f'{type(workload).__module__}.{type(workload).__qualname__}'
+    if '<lambda>' in workload.__qualname__:
+        return None
+    return f'{workload.__module__}.{workload.__qualname__}'
+
+
+def _calibrate(run_function: Callable[[int], Any], name: str, n_jobs_values: List[int],
+               repeat: int) -> Dict[int, float]:
+    stopwatch = Stopwatch(name, registry=TimingRegistry())
+
+    # untimed warm-up, so imports, caches and worker pool startup are not counted against the first worker count
+    run_function(n_jobs_values[0])
+
+    timings = {}
+    for n_jobs in n_jobs_values:
+        for _ in range(repeat):
+            with stopwatch.section(f'n_jobs={n_jobs}') as section:
+                run_function(n_jobs)
+            timings[n_jobs] = min(timings.get(n_jobs, float('inf')), section.result.wall_seconds)
+        pev.emit('tuning.calibrate', name=name, n_jobs=n_jobs, seconds=timings[n_jobs])
+
+    return timings
+
+
+def _get_run_function(estimator_or_function: Any, x: Any, y: Any, sample_rows: int,
+                      seed: int) -> Callable[[int], Any]:
+    if not hasattr(estimator_or_function, 'fit'):
+        return estimator_or_function
+
+    x_sample, y_sample = _sample_rows(x, y, sample_rows, seed)
+    estimator = estimator_or_function
+
+    def run_estimator(n_jobs: int) -> None:
+        fit_estimator = _clone(estimator)
+        if 'n_jobs' in fit_estimator.get_params():
+            fit_estimator.set_params(n_jobs=n_jobs)
+            fit_estimator.fit(x_sample, y_sample)
+        else:
+            with ThreadBudget(n_jobs, silent=True):
+                fit_estimator.fit(x_sample, y_sample)
+
+    return run_estimator
+
+
+def _clone(estimator: Any) -> Any:
+    try:
+        from sklearn.base import clone
+    except ImportError:
+        import copy
+
+        return copy.deepcopy(estimator)
+
+    return clone(estimator)
+
+
+def _sample_rows(x: Any, y: Any, sample_rows: int, seed: int) -> tuple:
+    if x is None or len(x) <= sample_rows:
+        return x, y
+
+    import numpy as np
+
+    indexes = np.sort(np.random.default_rng(seed).choice(len(x), sample_rows, replace=False))
+
+    def take(data):
+        if data is None:
+            return None
+        return data.iloc[indexes] if hasattr(data, 'iloc') else data[indexes]
+
+    return take(x), take(y)
+
+
+def _get_default_n_jobs_values(max_count: int) -> List[int]:
+    n_jobs_values = [1]
+    while n_jobs_values[-1] * 2 < max_count:
+        n_jobs_values.append(n_jobs_values[-1] * 2)
+    if max_count > 1:
+        n_jobs_values.append(max_count)
+
+    return n_jobs_values
+
+
+def _read_cpu_model() -> str:
+    try:
+        with open('/proc/cpuinfo', 'r') as cpuinfo_file:
+            for line in cpuinfo_file:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+
+    return None
+
+
+def _read_memory_gb() -> int:
+    try:
+        return round(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 2 ** 30)
+    except (AttributeError, ValueError, OSError):
+        return None